@@ -0,0 +1,229 @@
+from functools import lru_cache
+from music21 import key, note, pitch, stream
+
+# accidental display of detokenized staves without the makeAccidentals pass of music21: the same rules
+# (Pitch.updateAccidentalDisplay, for accidentals of the 'normal' display type and pitch-class cautionaries),
+# applied to light spellings of the pitches, with key signature tables computed once per key;
+# the measures of a staff are made one at a time, carrying the state of the previous measure
+#
+#   state = AccidentalState()
+#   for m in measures: state.apply(m) # as p.makeAccidentals(cautionaryNotImmediateRepeat=False, overrideStatus=True, inPlace=True)
+
+class Spelling: # what the display rules look at in a pitch; the accidental name and display status are written back
+    __slots__ = ('pitch', 'step', 'octave', 'name', 'name_with_octave', 'accidental', 'status')
+
+    def __init__(self, p):
+        self.pitch = p
+        self.step, self.octave, self.name = p.step, p.octave, p.name
+        self.name_with_octave = self.name + str(self.octave)
+        acc = p.accidental
+        self.accidental, self.status = (None, None) if acc is None else (acc.name, acc.displayStatus)
+
+    def show(self): # a natural is added if the pitch has no accidental
+        if self.accidental is None:
+            self.accidental = 'natural'
+        self.status = True
+
+    def write(self):
+        acc = self.pitch.accidental
+        if acc is None:
+            if self.accidental is None:
+                return
+            acc = self.pitch.accidental = pitch.Accidental(self.accidental)
+        acc.displayStatus = self.status
+
+@lru_cache(maxsize=None)
+def key_table(sharps): # -> ({step: accidental names in the key signature}, names of the scale), None for no key signature
+    if sharps is None:
+        return {}, ()
+    ks = key.KeySignature(sharps)
+    altered = {}
+    for p in ks.alteredPitches:
+        altered.setdefault(p.step, set()).add(p.accidental.name)
+    return altered, tuple(p.name for p in ks.getScale().pitches)
+
+def in_key(s, altered): # _nameInKeySignature
+    return s.accidental is not None and s.accidental in altered.get(s.step, ())
+
+def update_display(s, past, past_measure, others, altered, override, repeat, tied):
+    # Pitch.updateAccidentalDisplay(cautionaryPitchClass=True, cautionaryAll=False) of an accidental displayed normally;
+    # past: spellings before s in the measure, past_measure: in the previous measure, others: of the same chord,
+    # altered: key_table()[0], override: overrideStatus, repeat: cautionaryNotImmediateRepeat, tied: lastNoteWasTied
+    acc = s.accidental
+    if not override and acc is not None and s.status is not None:
+        return
+    if tied: # the note after a tie shows no accidental
+        if acc is not None:
+            s.status = False
+        return
+    if others and any(o.step == s.step and o.name != s.name for o in others):
+        s.show()
+        return
+    step_in_key = s.step in altered
+
+    if not past and not past_measure:
+        if acc is not None:
+            s.status = step_in_key if acc == 'natural' else not in_key(s, altered)
+        elif step_in_key:
+            s.show()
+        return
+
+    for p in reversed(past): # the last pitch of the same step and octave in the measure
+        if p.step == s.step and p.octave == s.octave:
+            if p.name != s.name:
+                s.show()
+                return
+            break
+
+    past_all = past_measure + past
+    n_out = len(past_measure)
+    set_from_past, show_if_first = False, False
+    repeats = len(past_all) # past_all[repeats:] are the same pitch as s, immediately before it in the measure
+    while repeats > n_out and past_all[repeats - 1].name_with_octave == s.name_with_octave:
+        repeats -= 1
+    for i in range(len(past_all) - 1, -1, -1):
+        in_measure = i >= n_out
+        continuous = in_measure and i >= repeats
+        if not in_measure and acc is not None and not in_key(s, altered):
+            s.status = True
+            return
+        p = past_all[i]
+        if p.step != s.step:
+            continue
+        octave_match = s.octave == p.octave
+        p_acc = p.accidental
+
+        if continuous and p_acc is not None and p.status is True:
+            if acc is not None:
+                s.status = False
+            return
+        elif continuous and p_acc is not None and acc is not None and p_acc == acc:
+            if not in_key(s, altered) and (not octave_match or p.status is False):
+                show_if_first = True
+                continue
+            s.status = False
+            set_from_past = True
+            break
+        elif p_acc == 'natural' and (acc is None or acc == 'natural'):
+            if continuous:
+                if step_in_key and not octave_match:
+                    s.show()
+                elif acc is not None:
+                    s.status = False
+            elif step_in_key and (repeat or not in_measure):
+                s.show()
+            elif acc is not None:
+                s.status = False
+            set_from_past = True
+            break
+        elif p_acc is not None and p.name != s.name and p_acc != 'natural' and (acc is None or s.status is False):
+            s.show()
+            set_from_past = True
+            break
+        elif (p_acc is None or p_acc == 'natural') and acc is not None and acc != 'natural':
+            s.status = True
+            set_from_past = True
+            break
+        elif p_acc is not None and acc is not None and p_acc != acc:
+            s.status = True
+            set_from_past = True
+            break
+        elif p_acc is None and acc is not None: # a natural after the same step without accidental
+            s.status = step_in_key
+            set_from_past = True
+            break
+        elif not continuous and p_acc is not None and acc is not None and p_acc == acc and octave_match:
+            if not repeat and p.status is not False:
+                s.status = False
+                show_if_first = False
+                set_from_past = True
+                break
+            elif p.status is False: # in case of ties
+                show_if_first = True
+            else:
+                s.status = not in_key(s, altered)
+                return
+
+    if show_if_first:
+        if not in_key(s, altered):
+            s.show()
+        elif acc is not None:
+            s.status = False
+    elif not set_from_past:
+        if acc is not None:
+            s.status = step_in_key if acc == 'natural' else not in_key(s, altered)
+        elif step_in_key:
+            s.show()
+
+def tie_names(n): # getTiePitchSet of music21 for a note or a chord
+    return {x.pitch.nameWithOctave for x in (n if n.isChord else (n,)) if x.tie is not None and x.tie.type != 'stop'}
+
+def make_accidentals(elements, past_measure, altered, ties, override, repeat): # -> spellings of the pitches, in order
+    # Stream.makeAccidentals over the notes and rests of one measure (or voice); ties is updated in place
+    past = []
+    for e in elements:
+        if e.isNote:
+            s = Spelling(e.pitch)
+            update_display(s, past, past_measure, None, altered, override, repeat, s.name_with_octave in ties)
+            past.append(s)
+            ties.clear()
+            if e.tie is not None and e.tie.type != 'stop':
+                ties.add(s.name_with_octave)
+        elif e.isChord:
+            spellings = [Spelling(p) for p in e.pitches]
+            held = set()
+            for n, s in zip(e, spellings):
+                others = [o for o in spellings if o is not s]
+                update_display(s, past, past_measure, others, altered, override, repeat, s.name_with_octave in ties)
+                if n.tie is not None and n.tie.type != 'stop':
+                    held.add(s.name_with_octave)
+            ties.clear()
+            ties.update(held)
+            past += spellings
+        else: # a rest
+            ties.clear()
+    for s in past:
+        s.write()
+    return past
+
+def notes_and_rests(m): # recurse().notesAndRests of a measure, whose voices hold no other streams
+    for e in m:
+        if isinstance(e, stream.Stream):
+            yield from (x for x in e if isinstance(x, note.GeneralNote))
+        elif isinstance(e, note.GeneralNote):
+            yield e
+
+class AccidentalState: # makeAccidentalsInMeasureStream of music21 (the pass of tokens_to_PartStaff), applied one measure at a time
+    def __init__(self):
+        self.previous, self.previous_last = None, None # spellings and last note or chord (outside of voices) of the previous measure
+        self.ks_last = None # sharps of the last key signature, None before any
+        self.pitch_past_measure, self.tie_pitches = [], None
+
+    def apply(self, m):
+        ks = m.keySignature
+        if self.previous is not None: # context from the previous measure
+            if ks is None:
+                self.pitch_past_measure = self.previous
+            elif self.ks_last is not None:
+                diatonic = key_table(self.ks_last)[1]
+                self.pitch_past_measure = [s for s in self.previous if s.name not in diatonic]
+            if self.previous_last is not None:
+                self.tie_pitches = tie_names(self.previous_last)
+                if ks is not None:
+                    diatonic = key_table(ks.sharps)[1]
+                    self.tie_pitches = {name for name in self.tie_pitches if name in diatonic}
+
+        if ks is not None:
+            self.ks_last = ks.sharps
+        if self.tie_pitches is None: # not shared with the next measure, as music21 makes its own set
+            ties = set()
+        else:
+            ties = self.tie_pitches
+        self.previous = make_accidentals(notes_and_rests(m), self.pitch_past_measure, key_table(self.ks_last)[0], ties, True, False)
+        self.previous_last = next(reversed(m.getElementsByClass(note.NotRest)), None)
+        m.streamStatus.accidentals = True
+
+def make_part_accidentals(measures):
+    state = AccidentalState()
+    for m in measures:
+        state.apply(m)
@@ -0,0 +1,115 @@
+from collections import deque
+
+from token_records import token_record
+
+# windows of a fixed number of bars for training, streamed from bar-major ST+ tokens or from a score: the first bar
+# of each window re-emits the key, time signature, clefs and chord symbol in effect, so that every window is
+# a sequence of its own (tokens_to_score() decodes it); only the bars of one window are held at a time
+#
+#   for window in token_windows(tokens, 16, hop=8):     # bars 1-16, 9-24, 17-32, ... (and the remaining bars)
+#       ...
+#   for window in score_windows('sonata.musicxml', 16): # through the measure index of the score
+
+def split_bar(tokens): # tokens of one bar -> (header, chords, R, L), where the header holds its key and time signatures
+    i_R = tokens.index('R')
+    i_L = tokens.index('L') if 'L' in tokens else len(tokens)
+    header = [t for t in tokens[1:i_R] if token_record(t).family in ('key', 'time')]
+    chords = [t for t in tokens[1:i_R] if token_record(t).family not in ('key', 'time')]
+    return header, chords, tokens[i_R+1:i_L], tokens[i_L+1:]
+
+def join_bar(header, chords, R, L):
+    return ['bar'] + header + chords + ['R'] + R + ['L'] + L
+
+class BarContext: # key, time signature, clefs (R, L) and chord symbol (with its bass) in effect after the bars seen so far
+    __slots__ = ('key', 'time', 'clefs', 'chord')
+
+    def __init__(self, key=None, time=None, clefs=(None, None), chord=()):
+        self.key, self.time, self.clefs, self.chord = key, time, clefs, chord
+
+    def copy(self):
+        return BarContext(self.key, self.time, self.clefs, self.chord)
+
+    def update(self, bar):
+        header, chords, R, L = bar
+        for t in header:
+            if token_record(t).family == 'key':
+                self.key = t
+            else:
+                self.time = t
+        self.clefs = tuple(next((t for t in reversed(staff) if token_record(t).family == 'clef'), clef)
+                           for staff, clef in zip((R, L), self.clefs))
+        for t in chords:
+            family = token_record(t).family
+            if family == 'chord':
+                self.chord = (t,)
+            elif family == 'bass' and len(self.chord) == 1:
+                self.chord += (t,)
+
+    def open(self, bar): # tokens of the bar, with what it does not set itself taken from the context
+        header, chords, R, L = bar
+        families = [token_record(t).family for t in header]
+        if self.key is not None and 'key' not in families:
+            header = [self.key] + header
+        if self.time is not None and 'time' not in families:
+            header = header + [self.time]
+        if self.chord and not (chords and token_record(chords[0]).family == 'chord'):
+            chords = list(self.chord) + chords
+        R, L = [[clef] + staff if clef is not None and not (staff and token_record(staff[0]).family == 'clef') else staff
+                for staff, clef in zip((R, L), self.clefs)]
+        return join_bar(header, chords, R, L)
+
+def iter_bars(tokens): # yield the tokens of each bar of bar-major tokens (an iterable, consumed as it goes, or a str)
+    if isinstance(tokens, str):
+        tokens = tokens.split()
+    bar = None
+    for t in tokens:
+        if t == 'bar':
+            if bar is not None:
+                yield bar
+            bar = []
+        elif bar is None:
+            raise ValueError(f'bar-major tokens start with bar, not {t}')
+        bar.append(t)
+    if bar is not None:
+        yield bar
+
+def iter_windows(bars, size, hop=None, partial=True): # yield windows of size bars every hop bars (default: size)
+    # bars: iterable of the tokens of each bar; partial: the bars after the last full window make a shorter one
+    hop = hop or size
+    if size < 1 or hop < 1:
+        raise ValueError(f'size and hop of windows are at least 1, not {size} and {hop}')
+    context = BarContext()
+    window = deque(maxlen=size) # (context at its start, bar) of the last bars
+    start, end, n = 0, 0, 0 # start of the next window, end of the last one, bars read
+    for tokens in bars:
+        bar = split_bar(tokens)
+        window.append((context.copy(), bar))
+        context.update(bar)
+        n += 1
+        if n - len(window) == start and len(window) == size:
+            yield window_tokens(window)
+            start, end = start + hop, n
+    if partial and end < n and start < n:
+        yield window_tokens(list(window)[start - n:])
+
+def window_tokens(window):
+    (context, first_bar), *rest = window
+    tokens = context.open(first_bar)
+    for _, bar in rest:
+        tokens += join_bar(*bar)
+    return tokens
+
+def token_windows(tokens, size, hop=None, partial=True): # windows of bar-major tokens
+    return iter_windows(iter_bars(tokens), size, hop, partial)
+
+def score_windows(source, size, hop=None, partial=True, index=None, note_name=True, tokenize_chord_symbols=True, block=32):
+    # windows of a MusicXML score, tokenized block bars at a time through its measure index (built when not given)
+    from measure_index import build_measure_index, measure_index, tokenize_bars
+    from score_to_tokens import is_path
+    if index is None:
+        index = measure_index(source) if is_path(source) else build_measure_index(source)
+
+    def bars():
+        for start in range(0, len(index['bars']), block):
+            yield from iter_bars(tokenize_bars(source, start, start + block, index, True, note_name, tokenize_chord_symbols))
+    return iter_windows(bars(), size, hop, partial)
@@ -0,0 +1,282 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from importlib import metadata
+from xml.etree import ElementTree as ET
+
+# benchmark suite on synthetic piano scores of controllable size: times tokenization, ST+ -> ST conversion and
+# detokenization, and saves machine-readable results to compare runs (e.g. before and after a music21 upgrade)
+
+STEPS = 'CDEFGAB'
+DIVISIONS = 120 # a quarter note, divisible for triplets and quintuplets
+BEATS = 4
+KINDS = ['major', 'minor', 'dominant', 'major-seventh', 'minor-seventh', 'diminished', 'augmented', 'suspended-fourth']
+
+# modules of the import benchmark, with the dependencies that importing them must not load:
+# workers doing plain tokenization (or token conversion) should not wait for music21
+IMPORT_CASES = {
+    'score_to_tokens': ('music21', 'bs4', 'pretty_midi'),
+    'score_to_tokens_lxml': ('music21', 'bs4', 'pretty_midi'),
+    'tokens_to_musicxml': ('music21', 'bs4', 'pretty_midi'),
+    'tokens_to_score': ('music21', 'bs4', 'pretty_midi'),
+    'tokens_to_midi': ('music21', 'bs4', 'pretty_midi'),
+}
+DEPENDENCIES = ('music21', 'bs4', 'lxml', 'numpy', 'pretty_midi')
+
+# notes of one beat: (duration, type, beams, time modification)
+PLAIN_BEATS = [
+    [(120, 'quarter', [], None)],
+    [(60, 'eighth', ['begin'], None), (60, 'eighth', ['end'], None)],
+    [(30, '16th', ['begin', 'begin'], None), (30, '16th', ['continue', 'continue'], None), (30, '16th', ['continue', 'continue'], None), (30, '16th', ['end', 'end'], None)],
+]
+TUPLET_BEATS = [
+    [(40, 'eighth', ['begin'], (3, 2)), (40, 'eighth', ['continue'], (3, 2)), (40, 'eighth', ['end'], (3, 2))],
+    [(24, '16th', ['begin', 'begin'], (5, 4))] + [(24, '16th', ['continue', 'continue'], (5, 4))] * 3 + [(24, '16th', ['end', 'end'], (5, 4))],
+]
+
+# [aux func] ElementTree subelement with text
+def sub(parent, tag, text=None, **attrib):
+    element = ET.SubElement(parent, tag, attrib)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+def add_note(measure, rnd, duration, type_, beams, modification, voice, staff, octave, chord=False, rest=False):
+    note = sub(measure, 'note')
+    if chord:
+        sub(note, 'chord')
+    if rest:
+        sub(note, 'rest')
+    else:
+        pitch = sub(note, 'pitch')
+        sub(pitch, 'step', rnd.choice(STEPS))
+        if rnd.random() < 0.2:
+            sub(pitch, 'alter', rnd.choice((-1, 1)))
+        sub(pitch, 'octave', octave)
+    sub(note, 'duration', duration)
+    sub(note, 'voice', voice)
+    sub(note, 'type', type_)
+    if modification is not None:
+        time_modification = sub(note, 'time-modification')
+        sub(time_modification, 'actual-notes', modification[0])
+        sub(time_modification, 'normal-notes', modification[1])
+    if not rest:
+        sub(note, 'stem', 'up' if voice % 4 == 1 else 'down')
+    if staff is not None:
+        sub(note, 'staff', staff)
+    if not chord and not rest:
+        for number, beam in enumerate(beams, 1):
+            sub(note, 'beam', beam, number=str(number))
+
+def add_harmony(measure, rnd, staff):
+    harmony = sub(measure, 'harmony')
+    root = sub(harmony, 'root')
+    sub(root, 'root-step', rnd.choice(STEPS))
+    if rnd.random() < 0.3:
+        sub(root, 'root-alter', rnd.choice((-1, 1)))
+    sub(harmony, 'kind', rnd.choice(KINDS))
+    if staff is not None:
+        sub(harmony, 'staff', staff)
+
+def add_voice(measure, rnd, options, voice, staff, octave, harmonies):
+    for _ in range(BEATS):
+        if harmonies and rnd.random() < options['chord_symbols'] / BEATS:
+            add_harmony(measure, rnd, staff)
+        if rnd.random() < 0.1:
+            add_note(measure, rnd, DIVISIONS, 'quarter', [], None, voice, staff, octave, rest=True)
+            continue
+        beat = rnd.choice(TUPLET_BEATS if rnd.random() < options['tuplets'] else PLAIN_BEATS)
+        for duration, type_, beams, modification in beat:
+            add_note(measure, rnd, duration, type_, beams, modification, voice, staff, octave)
+            if rnd.random() < options['chord_density']:
+                for _ in range(rnd.randint(1, 2)):
+                    add_note(measure, rnd, duration, type_, beams, modification, voice, staff, octave + 1, chord=True)
+
+def add_staff(measure, rnd, options, staff, staff_number):
+    for v in range(options['voices']):
+        if v > 0:
+            backup = sub(measure, 'backup')
+            sub(backup, 'duration', BEATS * DIVISIONS)
+        add_voice(measure, rnd, options, (1 if staff == 1 else 5) + v, staff_number, 4 if staff == 1 else 2, harmonies=staff == 1 and v == 0)
+
+def synthetic_MusicXML(bars=32, voices=1, chord_density=0.3, tuplets=0.1, chord_symbols=1.0, parts=1, seed=0):
+    # voices: per staff; chord_density: chance of a chord per note; tuplets: chance of a triplet or quintuplet per beat;
+    # chord_symbols: chord symbols per bar on average; parts: 1 (one part of two staves) or 2 (one part per staff)
+    rnd = random.Random(seed)
+    options = {'voices': voices, 'chord_density': chord_density, 'tuplets': tuplets, 'chord_symbols': chord_symbols}
+    fifths = rnd.randint(-4, 4)
+
+    score = ET.Element('score-partwise', version='4.0')
+    part_list = sub(score, 'part-list')
+    part_ids = ['P1'] if parts == 1 else ['P1', 'P2']
+    for part_id in part_ids:
+        score_part = sub(part_list, 'score-part', id=part_id)
+        sub(score_part, 'part-name', 'Piano')
+
+    for p, part_id in enumerate(part_ids):
+        part = sub(score, 'part', id=part_id)
+        for i in range(bars):
+            measure = sub(part, 'measure', number=str(i + 1))
+            staves = (1, 2) if parts == 1 else (p + 1,)
+            if i == 0:
+                attributes = sub(measure, 'attributes')
+                sub(attributes, 'divisions', DIVISIONS)
+                key = sub(attributes, 'key')
+                sub(key, 'fifths', fifths)
+                time_ = sub(attributes, 'time')
+                sub(time_, 'beats', BEATS)
+                sub(time_, 'beat-type', 4)
+                if parts == 1:
+                    sub(attributes, 'staves', 2)
+                for staff in staves:
+                    clef = sub(attributes, 'clef', number=str(staff)) if parts == 1 else sub(attributes, 'clef')
+                    sub(clef, 'sign', 'G' if staff == 1 else 'F')
+                    sub(clef, 'line', 2 if staff == 1 else 4)
+            for s, staff in enumerate(staves):
+                if s > 0:
+                    backup = sub(measure, 'backup')
+                    sub(backup, 'duration', BEATS * DIVISIONS)
+                add_staff(measure, rnd, options, staff, staff if parts == 1 else None)
+
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(score, encoding='utf-8')
+
+def measure(function, repeat): # -> (result, best wall time, peak memory of Python allocations)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start() # a separate run, since tracing slows the timed runs down
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(times), peak
+
+def stages(engines, chord_engine): # name -> function(data, tokens); tokenization stages come first and give the tokens
+    # or name -> (setup, function(setup(data), tokens)) for stages whose input is prepared outside of the timing
+    from score_to_tokens import MusicXML_to_tokens, get_chord_tokens, parse_with_music21
+    from tokens_to_midi import tokens_to_MIDI
+    from tokens_to_musicxml import tokens_to_MusicXML
+    from tokens_to_score import to_ST, tokens_to_score
+
+    stages_ = {f'tokenize[{engine}]': (lambda engine: lambda data, tokens: MusicXML_to_tokens(data, engine=engine, chord_engine=chord_engine))(engine)
+               for engine in engines}
+    stages_['get_chord_tokens'] = (parse_with_music21, lambda s, tokens: get_chord_tokens(s)) # chord symbols of a music21 Score
+    stages_['to_ST'] = lambda data, tokens: to_ST(' '.join(tokens))
+    stages_['tokens_to_score'] = lambda data, tokens: tokens_to_score(tokens)
+    stages_['tokens_to_MusicXML'] = lambda data, tokens: tokens_to_MusicXML(tokens)
+    stages_['tokens_to_MIDI'] = lambda data, tokens: tokens_to_MIDI(tokens)
+    return stages_
+
+def run_case(params, stages_, repeat):
+    data = synthetic_MusicXML(**params)
+    results, tokens = [], None
+    for name, function in stages_.items():
+        input_ = data
+        if isinstance(function, tuple):
+            setup, function = function
+            input_ = setup(data)
+        output, seconds, peak = measure(lambda: function(input_, tokens), repeat)
+        if tokens is None:
+            tokens = output
+        results.append({'case': params, 'stage': name, 'seconds': round(seconds, 6), 'peak_memory_bytes': peak,
+                        'tokens': len(tokens), 'tokens_per_second': round(len(tokens) / seconds, 1) if seconds else None,
+                        'input_bytes': len(data)})
+    return results
+
+def import_time(module, repeat): # -> (best seconds, dependencies loaded) of importing a module in a fresh interpreter
+    code = (f'import json, sys, time\nstart = time.perf_counter()\nimport {module}\nseconds = time.perf_counter() - start\n'
+            f'print(json.dumps([seconds, [d for d in {DEPENDENCIES!r} if d in sys.modules]]))')
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        seconds, loaded = json.loads(output)
+        times.append(seconds)
+    return min(times), loaded
+
+def import_results(repeat):
+    results = []
+    for module, forbidden in IMPORT_CASES.items():
+        seconds, loaded = import_time(module, repeat)
+        results.append({'case': {'import': module}, 'stage': 'import', 'seconds': round(seconds, 6), 'loaded': loaded,
+                        'unexpected': [d for d in loaded if d in forbidden]})
+    return results
+
+def environment():
+    from score_to_tokens import TOKENIZER_VERSION
+    versions = {}
+    for package in ('music21', 'beautifulsoup4', 'lxml', 'numpy', 'pretty_midi'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'packages': versions,
+            'tokenizer_version': TOKENIZER_VERSION, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def case_key(result):
+    return json.dumps(result['case'], sort_keys=True), result['stage']
+
+def compare(results, baseline): # print the time ratio of every case and stage found in both runs
+    base = {case_key(r): r for r in baseline['results']}
+    print(f'{"case":<72} {"stage":<22} {"base s":>9} {"new s":>9} {"ratio":>7}')
+    for r in results:
+        b = base.get(case_key(r))
+        if b is not None:
+            print(f'{case_key(r)[0]:<72} {r["stage"]:<22} {b["seconds"]:>9.4f} {r["seconds"]:>9.4f} {r["seconds"] / b["seconds"]:>7.2f}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark tokenization and detokenization on synthetic piano scores.')
+    parser.add_argument('-o', '--output', default=None, help='save the results as JSON')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--bars', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--voices', type=int, nargs='+', default=[1, 2], help='voices per staff')
+    parser.add_argument('--chord-density', type=float, nargs='+', default=[0.3], help='chance of a chord per note')
+    parser.add_argument('--tuplets', type=float, nargs='+', default=[0.1], help='chance of a triplet or quintuplet per beat')
+    parser.add_argument('--chord-symbols', type=float, nargs='+', default=[1.0], help='chord symbols per bar')
+    parser.add_argument('--parts', type=int, nargs='+', default=[1, 2], choices=[1, 2], help='one part of two staves, or two parts')
+    parser.add_argument('--engines', nargs='+', default=['bs4', 'lxml'], choices=['bs4', 'lxml'])
+    parser.add_argument('--chord-engine', default='music21', choices=['music21', 'musicxml'])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the best is kept)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--imports', action='store_true', help='only time the imports of the modules (fails if one loads a dependency it should not)')
+    args = parser.parse_args(argv)
+
+    results = import_results(args.repeat)
+    for r in results:
+        print(f'{r["case"]["import"]:<72} {r["stage"]:<22} {r["seconds"]:>9.4f} s   loads {", ".join(r["loaded"]) or "-"}', flush=True)
+        if r['unexpected']:
+            print(f'{r["case"]["import"]} should not load {", ".join(r["unexpected"])}', file=sys.stderr)
+    failed = any(r['unexpected'] for r in results)
+
+    stages_ = {} if args.imports else stages(args.engines, args.chord_engine)
+    for bars, voices, chord_density, tuplets, chord_symbols, parts in itertools.product(
+            args.bars, args.voices, args.chord_density, args.tuplets, args.chord_symbols, args.parts) if stages_ else ():
+        params = {'bars': bars, 'voices': voices, 'chord_density': chord_density, 'tuplets': tuplets,
+                  'chord_symbols': chord_symbols, 'parts': parts, 'seed': args.seed}
+        for r in run_case(params, stages_, args.repeat):
+            print(f'{case_key(r)[0]:<72} {r["stage"]:<22} {r["seconds"]:>9.4f} s {r["tokens_per_second"]:>12.0f} tokens/s {r["peak_memory_bytes"] / 1024 ** 2:>8.1f} MB', flush=True)
+            results.append(r)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from token_records import token_record
+
+# corpus statistics for vocabularies and context lengths: token frequencies (by family), bars and tokens per piece,
+# and tokens per bar of each hand, counted in worker processes over token shards (as written by corpus_to_tokens)
+# or MusicXML files, and merged into one summary; the statistics of each file are kept next to the summary
+# (<summary>.sources.jsonl), so that running again with the same output only counts the files that are new
+# or have changed since (their earlier statistics are replaced); the summary is the merge of those of every file
+# counted so far that still exists, whether or not it is among the inputs of the last update
+#
+#   python corpus_stats.py tokens/ -o stats.json -j 8   # shards (shard-*.jsonl) of a batch tokenization
+#   python corpus_stats.py scores/ -o stats.json -j 8   # MusicXML files, tokenized on the fly
+
+STATS_VERSION = 2
+
+class CorpusStats:
+    def __init__(self):
+        self.pieces, self.failed = 0, 0
+        self.token_counts = Counter()
+        self.bars_per_piece, self.tokens_per_piece = Counter(), Counter()
+        self.tokens_per_bar = {'R': Counter(), 'L': Counter()}
+        self.sources = {} # path -> [size, mtime_ns] of the counted files (when they were read)
+
+    def add(self, tokens): # tokens of one piece, bar-major or staff-major
+        self.pieces += 1
+        self.token_counts.update(tokens)
+        self.tokens_per_piece[len(tokens)] += 1
+        R, L = bar_sizes(tokens)
+        self.bars_per_piece[len(R)] += 1
+        self.tokens_per_bar['R'].update(R)
+        self.tokens_per_bar['L'].update(L)
+
+    def merge(self, other):
+        self.pieces += other.pieces
+        self.failed += other.failed
+        self.token_counts.update(other.token_counts)
+        self.bars_per_piece.update(other.bars_per_piece)
+        self.tokens_per_piece.update(other.tokens_per_piece)
+        for hand in ('R', 'L'):
+            self.tokens_per_bar[hand].update(other.tokens_per_bar[hand])
+        self.sources.update(other.sources)
+        return self
+
+    def families(self): # {family: {'tokens': count, 'distinct': distinct tokens}}
+        families = {}
+        for token, n in self.token_counts.items():
+            family = families.setdefault(token_record(token).family, {'tokens': 0, 'distinct': 0})
+            family['tokens'] += n
+            family['distinct'] += 1
+        return dict(sorted(families.items(), key=lambda x: -x[1]['tokens']))
+
+    def counts(self): # the mergeable counts, as JSON
+        def histogram(counter):
+            return {str(k): counter[k] for k in sorted(counter)}
+        return {'pieces': self.pieces, 'failed': self.failed,
+                'token_counts': dict(self.token_counts.most_common()),
+                'bars_per_piece': histogram(self.bars_per_piece), 'tokens_per_piece': histogram(self.tokens_per_piece),
+                'tokens_per_bar': {hand: histogram(counter) for hand, counter in self.tokens_per_bar.items()}}
+
+    def to_dict(self, options=None): # summary
+        return {'version': STATS_VERSION, 'options': options,
+                'tokens': sum(self.token_counts.values()), 'bars': sum(k * n for k, n in self.bars_per_piece.items()),
+                'vocabulary_size': len(self.token_counts), 'families': self.families(),
+                **self.counts(), 'sources': self.sources}
+
+    @classmethod
+    def from_dict(cls, data): # from a summary or counts
+        def histogram(d):
+            return Counter({int(k): n for k, n in d.items()})
+        stats = cls()
+        stats.pieces, stats.failed = data['pieces'], data['failed']
+        stats.token_counts = Counter(data['token_counts'])
+        stats.bars_per_piece, stats.tokens_per_piece = histogram(data['bars_per_piece']), histogram(data['tokens_per_piece'])
+        stats.tokens_per_bar = {hand: histogram(data['tokens_per_bar'][hand]) for hand in ('R', 'L')}
+        stats.sources = data.get('sources', {})
+        return stats
+
+def bar_sizes(tokens): # -> (tokens in each bar of R, of L), without the 'bar' tokens
+    sizes = {'R': [], 'L': []}
+    if tokens and tokens[0] in ('C', 'R'): # staff-major: sections of bars
+        section = None
+        for t in tokens:
+            if t in ('C', 'R', 'L'):
+                section = sizes.get(t)
+            elif section is not None:
+                if t == 'bar':
+                    section.append(0)
+                else:
+                    section[-1] += 1
+    else: # bar-major: the hand changes at 'R' and 'L' within each bar
+        hand = None
+        for t in tokens:
+            if t == 'bar':
+                hand = None
+            elif t in ('R', 'L'):
+                hand = sizes[t]
+                hand.append(0)
+            elif hand is not None:
+                hand[-1] += 1
+    return sizes['R'], sizes['L']
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def count_shard(path): # worker: statistics of the pieces of a shard of corpus_to_tokens
+    stats = CorpusStats()
+    stats.sources[path] = file_stamp(path) # before reading: lines appended meanwhile change the stamp
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError: # partially written line of an interrupted run
+                stats.failed += 1
+                continue
+            stats.add(record['tokens'])
+    return stats
+
+def count_MusicXML(args): # worker: statistics of a MusicXML file, tokenized with options
+    path, options = args
+    from score_to_tokens import MusicXML_to_tokens
+    stats = CorpusStats()
+    stats.sources[path] = file_stamp(path)
+    try:
+        stats.add(MusicXML_to_tokens(path, **options))
+    except Exception: # counted as failed until the file changes (or retry_failed)
+        stats.failed += 1
+    return stats
+
+def count_task(task):
+    kind, arg = task
+    return count_shard(arg) if kind == 'shard' else count_MusicXML(arg)
+
+def lost_task(task, error): # statistics of a file whose worker died (crash, out of memory, killed): failed until it changes (or retry_failed)
+    kind, arg = task
+    path = arg if kind == 'shard' else arg[0]
+    stats = CorpusStats()
+    stats.sources[path] = file_stamp(path)
+    stats.failed += 1
+    return stats
+
+def find_sources(inputs): # -> (token shards, MusicXML files)
+    from score_to_tokens import find_MusicXML_files
+    shards, scores = [], []
+    for input_ in inputs:
+        if input_.endswith('.jsonl'):
+            shards.append(input_)
+        elif os.path.isdir(input_):
+            shards += [os.path.join(input_, f) for f in sorted(os.listdir(input_)) if f.startswith('shard-') and f.endswith('.jsonl')]
+            scores += find_MusicXML_files([input_])
+        else:
+            scores += find_MusicXML_files([input_])
+    return list(dict.fromkeys(shards)), list(dict.fromkeys(scores))
+
+def sources_path(stats_path):
+    return f'{stats_path}.sources.jsonl'
+
+def read_stats(stats_path): # -> (CorpusStats, options) of a summary, None if missing
+    try:
+        with open(stats_path, encoding='utf-8') as f:
+            data = json.load(f)
+    except OSError:
+        return None
+    if data.get('version') != STATS_VERSION:
+        raise ValueError(f'{stats_path}: statistics of version {data.get("version")}, not {STATS_VERSION} (use rebuild)')
+    return CorpusStats.from_dict(data), data['options']
+
+def read_source_stats(stats_path): # -> {path: CorpusStats of the file}, empty if missing
+    sources = {}
+    try:
+        with open(sources_path(stats_path), encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                stats = CorpusStats.from_dict(record)
+                stats.sources = {record['path']: record['stamp']}
+                sources[record['path']] = stats
+    except OSError:
+        pass
+    return sources
+
+def write_atomic(path, write): # write(f) to a temporary file that replaces path, so that an interrupted update leaves the previous file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def write_stats(stats, stats_path, options=None, source_stats=None): # the summary, and the statistics of each file if given
+    if source_stats is not None: # first, as the summary is derived from them
+        def write_sources(f):
+            for path, source in source_stats.items():
+                f.write(json.dumps({'path': path, 'stamp': source.sources[path], **source.counts()}, separators=(',', ':')) + '\n')
+        write_atomic(sources_path(stats_path), write_sources)
+    write_atomic(stats_path, lambda f: json.dump(stats.to_dict(options), f, separators=(',', ':')))
+
+def corpus_stats(inputs, stats_path=None, workers=None, rebuild=False, retry_failed=False, **options):
+    # -> (CorpusStats, run statistics); options are passed to MusicXML_to_tokens for MusicXML inputs;
+    # with stats_path, the files that are new or have changed since the last update (all of them if rebuild, and
+    # those that failed if retry_failed) are counted, and the summary is that of every file counted so far
+    from score_to_tokens import iter_unordered
+    shards, scores = find_sources(inputs)
+    source_stats, previous_options = {}, None
+    if stats_path is not None and not rebuild:
+        previous = read_stats(stats_path)
+        if previous is not None:
+            previous_options = previous[1]
+            source_stats = read_source_stats(stats_path)
+            if scores and previous_options not in (None, options):
+                raise ValueError(f'{stats_path}: counted with options {previous_options}, not {options} (use rebuild)')
+
+    removed = [p for p in source_stats if not os.path.exists(p)] # deleted files no longer count
+    for path in removed:
+        del source_stats[path]
+
+    def stale(path):
+        source = source_stats.get(path)
+        return source is None or source.sources[path] != file_stamp(path) or (retry_failed and source.failed > 0)
+    changed = [p for p in shards + scores if p in source_stats and stale(p)]
+    tasks = [('shard', p) for p in shards if stale(p)] + [('MusicXML', (p, options)) for p in scores if stale(p)]
+
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    counted = CorpusStats() # this run
+    if workers == 1:
+        results = map(count_task, tasks)
+    else:
+        results = iter_unordered(count_task, tasks, workers, 4 * workers, lost_task)
+    try:
+        for partial in results:
+            source_stats.update(dict.fromkeys(partial.sources, partial)) # replaces the earlier statistics of the file
+            counted.merge(partial)
+    finally:
+        if workers != 1:
+            results.close() # shuts the pool down
+
+    stats = CorpusStats()
+    for source in source_stats.values():
+        stats.merge(source)
+    if stats_path is not None:
+        write_stats(stats, stats_path, options if scores else previous_options, source_stats)
+    run = {'new_files': len(tasks) - len(changed), 'changed_files': len(changed), 'removed_files': len(removed), 'pieces': counted.pieces,
+           'failed': counted.failed, 'total_pieces': stats.pieces, 'seconds': round(time.perf_counter() - start, 2)}
+    return stats, run
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Token statistics of a corpus (token shards or MusicXML files).')
+    parser.add_argument('inputs', nargs='+', help='shard-*.jsonl files or their directories, MusicXML files, directories or *.txt lists')
+    parser.add_argument('-o', '--output', required=True, help='summary (JSON), updated with the files that are new or have changed')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--rebuild', action='store_true', help='count every file again')
+    parser.add_argument('--retry-failed', action='store_true', help='count files that failed again, even if unchanged')
+    parser.add_argument('--staff-major', action='store_true', help='staff-major instead of bar-major tokens')
+    parser.add_argument('--note-number', action='store_true', help='note numbers instead of note names')
+    parser.add_argument('--no-chord-symbols', action='store_true', help='do not tokenize chord symbols')
+    parser.add_argument('--engine', default='bs4', choices=['bs4', 'lxml'])
+    parser.add_argument('--chord-engine', default='music21', choices=['music21', 'musicxml'])
+    args = parser.parse_args(argv)
+
+    _, run = corpus_stats(args.inputs, args.output, args.workers, args.rebuild, args.retry_failed,
+                          bar_major=not args.staff_major, note_name=not args.note_number,
+                          tokenize_chord_symbols=not args.no_chord_symbols, engine=args.engine, chord_engine=args.chord_engine)
+    print(json.dumps(run))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+from functools import lru_cache
+
+import numpy as np
+
+# finite-state automaton of the bar-major ST+ grammar emitted by MusicXML_to_tokens:
+#   bar -> key/time -> chord section -> R -> staff -> L -> staff, for every bar
+# where a staff is clefs and note groups, with at most one block of consecutive <voice> ... </voice>,
+# and a note group is `note_* ... len_* [stem] [beam] [tie] [staccato] [accent] [tenuto] [slur]` or `rest len_*`;
+# the automaton is compiled into a table (state x token class), and per vocabulary into a table of token IDs
+# (kept by the vocabulary until tokens are added to it)
+
+TOKEN_CLASSES = ['bar', 'R', 'L', 'key', 'time', 'clef', 'chord', 'bass', 'note', 'rest', 'len',
+                 'stem', 'beam', 'tie', 'staccato', 'accent', 'tenuto', 'slur', '<voice>', '</voice>', 'other']
+CLASS_INDEX = {c: i for i, c in enumerate(TOKEN_CLASSES)}
+NOTE_SUFFIX = ['stem', 'beam', 'tie', 'staccato', 'accent', 'tenuto', 'slur'] # optional tokens after len, in this order
+
+SINGLE_TOKEN_CLASSES = {'bar': 'bar', 'R': 'R', 'L': 'L', 'rest': 'rest', '<voice>': '<voice>', '</voice>': '</voice>',
+                        'staccato': 'staccato', 'accent': 'accent', 'tenuto': 'tenuto', 'slur_start': 'slur', 'slur_stop': 'slur'}
+PREFIX_CLASSES = {'key', 'time', 'clef', 'chord', 'bass', 'note', 'len', 'stem', 'beam', 'tie'}
+
+MAX_CLASS_CACHE = 1 << 16 # distinct tokens whose class is cached; long-running processes may validate any number of them
+
+def token_class(token):
+    if token in SINGLE_TOKEN_CLASSES:
+        return SINGLE_TOKEN_CLASSES[token]
+    prefix = token.split('_')[0]
+    return prefix if prefix in PREFIX_CLASSES and '_' in token else 'other'
+
+@lru_cache(maxsize=MAX_CLASS_CACHE)
+def token_class_index(token):
+    return CLASS_INDEX[token_class(token)]
+
+# states: 'start', 'header', 'chords', 'chord' (after a chord name), 'between' (after </voice>, per staff)
+# and (staff, phase, group) with phase in pre/voice/post and group the position in a note group
+def transition(state, cls):
+    if state == 'start':
+        return 'header' if cls == 'bar' else None
+    if state in ('header', 'chords', 'chord'):
+        if state == 'header' and cls in ('key', 'time'):
+            return 'header'
+        if cls == 'chord':
+            return 'chord'
+        if cls == 'len' or (cls == 'bass' and state == 'chord'):
+            return 'chords'
+        return ('R', 'pre', 'idle') if cls == 'R' else None
+
+    if state[0] == 'between': # more voices, or content after them
+        staff = state[1]
+        if cls == '<voice>':
+            return (staff, 'voice', 'idle')
+        return transition((staff, 'post', 'idle'), cls)
+
+    staff, phase, group = state
+    if group == 'notes': # pitches of a note group, before its length
+        return (staff, phase, 'notes') if cls == 'note' else (staff, phase, 0) if cls == 'len' else None
+    if group == 'rest':
+        return (staff, phase, 'rest_len') if cls == 'len' else None
+    if isinstance(group, int) and cls in NOTE_SUFFIX[group:]:
+        return (staff, phase, NOTE_SUFFIX.index(cls, group) + 1)
+
+    # between note groups
+    if cls == 'note':
+        return (staff, phase, 'notes')
+    if cls == 'rest':
+        return (staff, phase, 'rest')
+    if cls == 'clef':
+        return (staff, phase, 'idle')
+    if cls == '<voice>' and phase == 'pre':
+        return (staff, 'voice', 'idle')
+    if cls == '</voice>' and phase == 'voice':
+        return ('between', staff)
+    if phase != 'voice':
+        if cls == 'L' and staff == 'R':
+            return ('L', 'pre', 'idle')
+        if cls == 'bar' and staff == 'L':
+            return 'header'
+    return None
+
+def is_accepting(state): # the sequence may end after a complete bar
+    if state in ('start', 'header', 'chords', 'chord'):
+        return False
+    if state[0] == 'between':
+        return state[1] == 'L'
+    staff, phase, group = state
+    return staff == 'L' and phase != 'voice' and group not in ('notes', 'rest')
+
+class Automaton:
+    def __init__(self):
+        # reachable states in breadth-first order, 'start' first
+        self.states, index = ['start'], {'start': 0}
+        transitions = []
+        for state in self.states:
+            row = []
+            for cls in TOKEN_CLASSES:
+                next_state = transition(state, cls)
+                if next_state is not None and next_state not in index:
+                    index[next_state] = len(self.states)
+                    self.states.append(next_state)
+                row.append(index[next_state] if next_state is not None else -1)
+            transitions.append(row)
+
+        self.table = np.array(transitions, dtype=np.int16) # -1: rejected
+        self.accepting = np.array([is_accepting(s) for s in self.states])
+        self.rows = self.table.tolist() # faster than NumPy indexing one token at a time
+
+    def step(self, state, token): # next state, or -1 if the token is not allowed
+        return self.rows[state][token_class_index(token)]
+
+    def validate(self, tokens): # -> -1 if valid, else the position of the first wrong token (len(tokens) if it ends too early)
+        if isinstance(tokens, str):
+            tokens = tokens.split()
+        state = 0
+        for i, t in enumerate(tokens):
+            state = self.rows[state][token_class_index(t)]
+            if state < 0:
+                return i
+        return -1 if self.accepting[state] else len(tokens)
+
+    def expected(self, state): # token classes allowed after a state ('<end>' if the sequence may end there)
+        return [c for c, s in zip(TOKEN_CLASSES, self.rows[state]) if s >= 0] + (['<end>'] if self.accepting[state] else [])
+
+    def check(self, tokens): # raise ValueError describing the first wrong token
+        if isinstance(tokens, str):
+            tokens = tokens.split()
+        position = self.validate(tokens)
+        if position < 0:
+            return
+        state = 0
+        for t in tokens[:position]:
+            state = self.step(state, t)
+        found = repr(tokens[position]) if position < len(tokens) else 'end of sequence'
+        raise ValueError(f'invalid ST+ sequence at position {position}: {found}, expected one of {self.expected(state)}')
+
+    def vocabulary_tables(self, vocabulary): # -> (transitions, masks, rows) for token IDs, kept by the vocabulary until tokens are added to it
+        tables = getattr(vocabulary, 'grammar_tables', None)
+        if tables is None or tables[0] is not self:
+            class_ids = np.array([token_class_index(t) for t in vocabulary.tokens], dtype=np.intp)
+            table = self.table[:, class_ids]
+            tables = vocabulary.grammar_tables = (self, table, table >= 0, table.tolist())
+        return tables[1:]
+
+    def vocabulary_table(self, vocabulary): # (states x token IDs) transitions
+        return self.vocabulary_tables(vocabulary)[0]
+
+    def masks(self, vocabulary): # (states x token IDs) booleans of allowed next tokens, for constrained decoding
+        return self.vocabulary_tables(vocabulary)[1]
+
+    def validate_ids(self, ids, vocabulary): # same as validate, for an integer array of token IDs
+        rows = self.vocabulary_tables(vocabulary)[2]
+        state = 0
+        for i, id_ in enumerate(np.asarray(ids).tolist()):
+            state = rows[state][id_]
+            if state < 0:
+                return i
+        return -1 if self.accepting[state] else len(ids)
+
+    def validate_batch(self, ids, offsets, vocabulary): # (ids, offsets) as Vocabulary.encode_batch -> failing position of each sequence (-1 if valid)
+        # all sequences advance together, so the cost is one NumPy step per position of the longest sequence
+        table = self.vocabulary_table(vocabulary)
+        starts, lengths = offsets[:-1], np.diff(offsets)
+        states = np.zeros(len(lengths), dtype=np.int16)
+        positions = np.full(len(lengths), -1, dtype=np.int64)
+        active = np.flatnonzero(lengths > 0)
+
+        step = 0
+        while len(active):
+            states[active] = table[states[active], ids[starts[active] + step]]
+            failed = states[active] < 0
+            positions[active[failed]] = step
+            step += 1
+            active = active[~failed & (lengths[active] > step)]
+
+        ended_early = (positions < 0) & ~self.accepting[np.maximum(states, 0)]
+        positions[ended_early] = lengths[ended_early]
+        return positions
+
+ST_PLUS_AUTOMATON = None
+
+def default_automaton(): # compiled once on first use
+    global ST_PLUS_AUTOMATON
+    if ST_PLUS_AUTOMATON is None:
+        ST_PLUS_AUTOMATON = Automaton()
+    return ST_PLUS_AUTOMATON
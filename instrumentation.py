@@ -0,0 +1,92 @@
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+# opt-in instrumentation of tokenization and detokenization: durations of stages and counters (measures, notes, ...)
+# are recorded while a Recorder is active; otherwise instrumented code only checks a global and gets a shared no-op
+#
+#   with instrument() as recorder:
+#       tokens = MusicXML_to_tokens(path)
+#   recorder.to_dict() # {'stages': {'load_MusicXML': {'seconds': ..., 'calls': ...}, ...}, 'counters': {'measures': ..., ...},
+#                      #  'peak_memory': bytes}
+#
+# peak_memory is the peak resident set size of the process during the block (on Linux, where it can be reset;
+# elsewhere, since the process started), which is what the memory limit of a worker applies to
+
+RECORDER = None # active Recorder (one per process)
+
+class Recorder:
+    def __init__(self):
+        self.stages = {} # name -> [seconds, calls]
+        self.counters = {}
+        self.peak_memory = None
+
+    def add(self, name, seconds):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {'stages': {name: {'seconds': round(seconds, 6), 'calls': calls} for name, (seconds, calls) in self.stages.items()},
+                'counters': dict(self.counters), 'peak_memory': self.peak_memory}
+
+class Stage: # context manager adding the duration of its block to a recorder
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder, self.name = recorder, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(self.name, time.perf_counter() - self.start)
+
+NULL_STAGE = nullcontext()
+
+def stage(name): # `with stage('to_ST'): ...`
+    return NULL_STAGE if RECORDER is None else Stage(RECORDER, name)
+
+def count(name, n=1):
+    if RECORDER is not None:
+        RECORDER.count(name, n)
+
+def reset_peak_memory(): # restart the peak resident set size from the current size (Linux only)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_memory(): # peak resident set size of the process in bytes, None if unknown
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # bytes on macOS, KiB elsewhere
+
+@contextmanager
+def instrument(callback=None): # records everything run inside the block; callback(recorder.to_dict()) at its end
+    global RECORDER
+    previous, RECORDER = RECORDER, Recorder() # a nested block records its own data only
+    if previous is None: # the peak of a nested block is that of the outermost one so far
+        reset_peak_memory()
+    try:
+        yield RECORDER
+    finally:
+        recorder, RECORDER = RECORDER, previous
+        recorder.peak_memory = peak_memory()
+        if callback is not None:
+            callback(recorder.to_dict())
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from xml.parsers import expat
+
+from instrumentation import count, stage
+
+# random access to the bars of a MusicXML file: an index of the byte span of every <measure> of every <part>,
+# with the state in effect at the start of each bar (divisions, key, time and clefs) and its chord tokens,
+# built in one pass and saved next to the score as <score>.index.json; a range of bars is then tokenized
+# by reading and parsing only its measures
+#
+#   index = measure_index('sonata.musicxml')         # built once, reused while the file is unchanged
+#   tokens = tokenize_bars('sonata.musicxml', 179, 200, index) # bars 180-200, as in the full tokenization
+#
+# bars are counted from 0 in document order (index['bars'][i]['number'] is the number attribute of the measure);
+# byte offsets of .mxl files are those of the MusicXML document in the archive
+
+INDEX_VERSION = 1 # bump whenever the layout of the index changes
+
+def scan_measures(f): # -> (encoding, n_parts, [[(number, start, end), ...] of each part]) with expat byte offsets
+    parser = expat.ParserCreate()
+    declared = {'encoding': 'utf-8', 'n_parts': 0}
+    parts, pending = [], []
+
+    def close(*_): # the element after a </measure> starts where the measure ends
+        if pending:
+            pending.pop()[2] = parser.CurrentByteIndex
+
+    def start(name, attrs):
+        close()
+        if name == 'score-part':
+            declared['n_parts'] += 1
+        elif name == 'part':
+            parts.append([])
+        elif name == 'measure':
+            parts[-1].append([attrs.get('number'), parser.CurrentByteIndex, None])
+
+    def end(name):
+        close()
+        if name == 'measure':
+            pending.append(parts[-1][-1])
+
+    def xml_declaration(version, encoding, standalone):
+        if encoding:
+            declared['encoding'] = encoding
+
+    parser.XmlDeclHandler = xml_declaration
+    parser.StartElementHandler, parser.EndElementHandler = start, end
+    parser.CharacterDataHandler = parser.CommentHandler = parser.ProcessingInstructionHandler = close
+    parser.ParseFile(f)
+    return declared['encoding'], declared['n_parts'], [[tuple(m) for m in measures] for measures in parts]
+
+def bar_states(source, n_parts): # -> (divisions used by the tokenizer, state at the start of each bar, chord tokens)
+    from score_to_tokens import ChordSymbolTracker
+    from score_to_tokens_lxml import attributes_to_tokens, first, iter_MusicXML_measures, measure_to_chord_events
+
+    tracker = ChordSymbolTracker()
+    first_divisions, divisions = None, None
+    key, time, clefs = None, None, [None, None]
+    states = []
+    for _, part_index, measure in iter_MusicXML_measures(source):
+        if part_index == tracker.n_parts:
+            tracker.new_part()
+            bar = 0
+        if first_divisions is None: # as iter_bar_token_variants
+            divisions_ = first(measure, 'divisions')
+            first_divisions = int(divisions_.text) if divisions_ is not None else None
+
+        if part_index == 0:
+            states.append({'divisions': divisions, 'key': key, 'time': time, 'clefs': list(clefs)})
+        else:
+            states[bar]['clefs'][1] = clefs[1]
+        bar += 1
+
+        for attributes in measure.iter('attributes'):
+            for i, staff in enumerate((1, 2) if n_parts == 1 else (None,)):
+                hand = i if n_parts == 1 else part_index
+                tokens, div = attributes_to_tokens(attributes, staff)
+                for token in tokens:
+                    type_ = token.split('_')[0]
+                    if type_ == 'clef':
+                        clefs[hand] = token
+                    elif hand == 0 and type_ == 'key': # key and time signatures of the right hand, as common()
+                        key = token
+                    elif hand == 0:
+                        time = token
+                if part_index == 0 and div:
+                    divisions = div
+
+        tracker.add_measure(measure_to_chord_events(measure))
+
+    return first_divisions, states, tracker.tokens()
+
+def build_measure_index(source): # source: path, bytes or binary file object of a MusicXML or .mxl file
+    from score_to_tokens import TOKENIZER_VERSION, open_MusicXML
+    with stage('scan_measures'):
+        with open_MusicXML(source) as f:
+            encoding, n_parts, parts = scan_measures(f)
+    if n_parts not in (1, 2) or len(parts) != n_parts or len({len(measures) for measures in parts}) != 1:
+        raise ValueError(f'{n_parts} parts of {[len(measures) for measures in parts]} measures: 1 or 2 parts of the same length are tokenized')
+
+    with stage('bar_states'):
+        divisions, states, chords = bar_states(source, n_parts)
+    count('measures', len(states))
+
+    bars = []
+    for i, measures in enumerate(zip(*parts)):
+        bar = {'number': measures[0][0], 'spans': [[start, end] for _, start, end in measures]}
+        bar.update(states[i])
+        if chords: # the chord symbol in effect at the start of a bar opens its chord tokens
+            bar['chords'] = chords[i] if i < len(chords) else None # the last bar has none in the full tokenization
+        bars.append(bar)
+
+    return {'version': INDEX_VERSION, 'tokenizer_version': TOKENIZER_VERSION, 'encoding': encoding,
+            'n_parts': n_parts, 'divisions': divisions, 'has_chord_symbols': bool(chords), 'bars': bars}
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def read_measure_index(index_path):
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError): # missing or broken
+        return None
+
+def write_measure_index(index, index_path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_path)), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path) # atomic, so that concurrent readers never see a partial index
+
+def measure_index(mxml_path, index_path=None, rebuild=False): # index of a file, read from index_path if up to date
+    from score_to_tokens import TOKENIZER_VERSION
+    index_path = index_path or f'{mxml_path}.index.json'
+    stamp = file_stamp(mxml_path)
+    index = None if rebuild else read_measure_index(index_path)
+    if index is None or index.get('version') != INDEX_VERSION or index.get('tokenizer_version') != TOKENIZER_VERSION \
+            or index.get('file') != stamp:
+        index = build_measure_index(mxml_path)
+        index['file'] = stamp
+        write_measure_index(index, index_path)
+    return index
+
+def read_measures(source, index, start, stop): # -> parsed <measure> elements of bars start..stop-1, [[part 0, ...], ...]
+    from lxml import etree
+    from score_to_tokens import open_MusicXML
+    parser = etree.XMLParser(encoding=index['encoding'])
+    spans = sorted({tuple(span) for bar in index['bars'][start:stop] for span in bar['spans']}) # read forward only
+    fragments = {}
+    with open_MusicXML(source) as f:
+        for span in spans:
+            f.seek(span[0])
+            fragments[span] = f.read(span[1] - span[0])
+    return [[etree.fromstring(fragments[tuple(span)], parser) for span in bar['spans']] for bar in index['bars'][start:stop]]
+
+def tokenize_bars(source, start, stop=None, index=None, bar_major=True, note_name=True, tokenize_chord_symbols=True):
+    # tokens of bars start..stop-1 (a slice of the bars), the same as those of these bars in MusicXML_to_tokens(source);
+    # index: of source, built (and, for a path, saved) when not given
+    from score_to_tokens import bars_to_tokens, is_path
+    from score_to_tokens_lxml import measure_to_tokens
+    if index is None:
+        index = measure_index(source) if is_path(source) else build_measure_index(source)
+    start, stop, _ = slice(start, stop).indices(len(index['bars']))
+
+    with stage('read_measures'):
+        measures = read_measures(source, index, start, stop)
+    with stage('tokenize_bars'):
+        staves = (1, 2) if index['n_parts'] == 1 else (None, None)
+        bars = []
+        for bar_measures in measures:
+            R_measure, L_measure = bar_measures * 2 if index['n_parts'] == 1 else bar_measures
+            count('measures')
+            bars.append((measure_to_tokens(R_measure, index['divisions'], staves[0], note_name),
+                         measure_to_tokens(L_measure, index['divisions'], staves[1], note_name)))
+
+    chords = None
+    if tokenize_chord_symbols and index['has_chord_symbols']:
+        chords = [bar['chords'] for bar in index['bars'][start:stop] if bar['chords'] is not None]
+        if bar_major: # bars without chord tokens are left out, as in the full tokenization
+            if not chords:
+                return []
+            bars = bars[:len(chords)]
+    return bars_to_tokens(bars, chords, bar_major)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tokenize a range of bars of a MusicXML score through its measure index.')
+    parser.add_argument('path', help='MusicXML or .mxl file')
+    parser.add_argument('start', type=int, help='first bar (from 1)')
+    parser.add_argument('end', type=int, nargs='?', default=None, help='last bar (default: the last of the score)')
+    parser.add_argument('--index', default=None, help='index file (default: PATH.index.json)')
+    parser.add_argument('--rebuild', action='store_true', help='build the index even if it is up to date')
+    parser.add_argument('--staff-major', action='store_true', help='staff-major instead of bar-major tokens')
+    parser.add_argument('--note-number', action='store_true', help='note numbers instead of note names')
+    parser.add_argument('--no-chord-symbols', action='store_true', help='do not tokenize chord symbols')
+    args = parser.parse_args(argv)
+
+    index = measure_index(args.path, args.index, args.rebuild)
+    tokens = tokenize_bars(args.path, args.start - 1, args.end, index, bar_major=not args.staff_major,
+                           note_name=not args.note_number, tokenize_chord_symbols=not args.no_chord_symbols)
+    print(' '.join(tokens))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+
+from score_to_tokens import FileTimeout, MusicXML_to_tokens, find_MusicXML_files, iter_unordered, raise_timeout
+from token_records import token_record
+
+# round-trip verification of the tokenizer over a corpus: tokens -> tokens_to_score -> MusicXML -> MusicXML_to_tokens
+# must give the same tokens; the MusicXML is kept in memory, and the two sequences are compared bar by bar,
+# with `bar`, `R`, `L` (and `C`) as anchors, so that a mismatch is reported where it happens
+
+# categories of differing tokens, by token family
+CATEGORIES = {'note': 'pitch', 'rest': 'rest', 'len': 'length', 'stem': 'stem', 'beam': 'beam', 'tie': 'tie',
+              'clef': 'clef', 'key': 'key', 'time': 'time', 'chord': 'chord_symbol', 'bass': 'chord_symbol',
+              '<voice>': 'voice', '</voice>': 'voice', 'slur': 'slur', 'staccato': 'articulation', 'accent': 'articulation', 'tenuto': 'articulation'}
+MAX_EXAMPLE_TOKENS = 12 # tokens kept of each side of a reported mismatch
+
+def split_bar_sections(tokens): # -> {stream: [bar]}, a bar being a tuple of (section, tokens) pairs
+    # bar-major: one stream of bars with 'header' (attributes and chords), 'R' and 'L' sections;
+    # staff-major: one stream per staff ('C', 'R', 'L'), a bar being a single section
+    bar_major = not tokens or tokens[0] not in ('C', 'R') # staff-major sequences open with their first staff
+    streams, bar = {}, None
+    section = 'header'
+    for t in tokens:
+        if t == 'bar':
+            if bar_major:
+                section = 'header'
+                bar = [(section, [])]
+                streams.setdefault('bars', []).append(bar)
+            else:
+                bar = [(section, [])]
+                streams.setdefault(section, []).append(bar)
+        elif t in ('R', 'L', 'C'):
+            section = t
+            if bar_major and bar is not None:
+                bar.append((section, []))
+        elif bar is not None:
+            bar[-1][1].append(t)
+    return {name: [tuple((s, tuple(ts)) for s, ts in bar) for bar in bars] for name, bars in streams.items()}
+
+def category(tokens):
+    return CATEGORIES.get(token_record(tokens[0]).family, 'other') if tokens else 'other'
+
+def section_mismatches(bar_index, section, expected, actual): # token-level diff of a section
+    mismatches = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, expected, actual, autojunk=False).get_opcodes():
+        if tag != 'equal':
+            mismatches.append({'bar': bar_index, 'section': section, 'category': category(expected[i1:i2] or actual[j1:j2]),
+                               'expected': list(expected[i1:i2][:MAX_EXAMPLE_TOKENS]), 'actual': list(actual[j1:j2][:MAX_EXAMPLE_TOKENS])})
+    return mismatches
+
+def bar_mismatches(bar_index, expected, actual):
+    expected_sections, actual_sections = dict(expected), dict(actual)
+    mismatches = []
+    for section in dict.fromkeys(list(expected_sections) + list(actual_sections)):
+        e, a = expected_sections.get(section, ()), actual_sections.get(section, ())
+        if e != a:
+            mismatches += section_mismatches(bar_index, section, e, a)
+    return mismatches
+
+def diff_tokens(expected, actual): # -> list of mismatches ({'bar', 'section', 'category', 'expected', 'actual'}), empty if equal
+    if expected == actual:
+        return []
+    expected_streams, actual_streams = split_bar_sections(expected), split_bar_sections(actual)
+    mismatches = []
+    for name in dict.fromkeys(list(expected_streams) + list(actual_streams)):
+        e, a = expected_streams.get(name, []), actual_streams.get(name, [])
+        # align whole bars first, so that a missing bar does not shift the comparison of every bar after it
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, e, a, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                continue
+            n = min(i2 - i1, j2 - j1)
+            for k in range(n):
+                mismatches += bar_mismatches(i1 + k, e[i1 + k], a[j1 + k])
+            for k in range(i1 + n, i2):
+                mismatches.append({'bar': k, 'section': name, 'category': 'missing_bar', 'expected': [], 'actual': []})
+            for k in range(j1 + n, j2):
+                mismatches.append({'bar': i2, 'section': name, 'category': 'extra_bar', 'expected': [], 'actual': []})
+    if not mismatches: # same bars, but different tokens outside of them
+        mismatches.append({'bar': None, 'section': None, 'category': 'other', 'expected': list(expected[:MAX_EXAMPLE_TOKENS]), 'actual': list(actual[:MAX_EXAMPLE_TOKENS])})
+    return mismatches
+
+def round_trip(tokens, writer='music21', **options): # tokens -> MusicXML (in memory) -> tokens
+    if writer == 'music21':
+        from music21.musicxml.m21ToXml import GeneralObjectExporter
+        from tokens_to_score import tokens_to_score
+        data = GeneralObjectExporter(tokens_to_score(tokens)).parse()
+    elif writer == 'musicxml':
+        from tokens_to_musicxml import tokens_to_MusicXML
+        data = tokens_to_MusicXML(tokens).encode('utf-8')
+    else:
+        raise ValueError(f'unknown writer: {writer}')
+    return MusicXML_to_tokens(data, **options)
+
+def verify_file(args): # worker: never raises, returns a report record
+    path, tokens, options, writer, timeout = args
+    start = time.perf_counter()
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if tokens is None: # a MusicXML file
+            tokens = MusicXML_to_tokens(path, **options)
+        mismatches = diff_tokens(tokens, round_trip(tokens, writer, **options))
+        record = {'path': path, 'status': 'mismatch' if mismatches else 'ok', 'n_tokens': len(tokens)}
+        if mismatches:
+            record['mismatched_bars'] = len({m['bar'] for m in mismatches})
+            record['categories'] = dict(Counter(m['category'] for m in mismatches))
+            record['mismatches'] = mismatches
+    except FileTimeout:
+        record = {'path': path, 'status': 'timeout'}
+    except Exception as e:
+        record = {'path': path, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def lost_file(task, error): # report record of a file whose worker died (crash, out of memory, killed)
+    return {'path': task[0], 'status': 'error', 'error': f'worker lost: {type(error).__name__}: {error}', 'seconds': None}
+
+def iter_inputs(inputs): # (path, tokens): token shards (*.jsonl lines of {"path": ..., "tokens": [...]}) or MusicXML files (tokens None)
+    shards = [i for i in inputs if i.endswith('.jsonl')]
+    for shard in shards:
+        with open(shard, encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                yield item['path'], item['tokens']
+    for path in find_MusicXML_files([i for i in inputs if not i.endswith('.jsonl')]):
+        yield path, None
+
+def verify_corpus(inputs, workers=None, writer='music21', timeout=None, report=None, max_mismatches=20, progress_every=100, **options):
+    # options are passed to MusicXML_to_tokens (and must be those of the tokens of shards);
+    # report: path of a JSON-lines file of per-file records; returns the summary of the run
+    workers = workers or os.cpu_count() or 1
+    summary = {'files': 0, 'ok': 0, 'mismatch': 0, 'error': 0, 'timeout': 0, 'categories': Counter(), 'files_by_category': Counter()}
+    tasks = ((path, tokens, options, writer, timeout) for path, tokens in iter_inputs(inputs))
+    start = time.perf_counter()
+
+    if workers == 1:
+        results = map(verify_file, tasks)
+    else:
+        results = iter_unordered(verify_file, tasks, workers, 4 * workers, lost_file)
+    report_file = open(report, 'w', encoding='utf-8') if report else None
+    try:
+        for record in results:
+            summary['files'] += 1
+            summary[record['status']] += 1
+            for name, n in record.get('categories', {}).items():
+                summary['categories'][name] += n
+                summary['files_by_category'][name] += 1
+            if report_file is not None:
+                if 'mismatches' in record:
+                    record['mismatches'] = record['mismatches'][:max_mismatches]
+                report_file.write(json.dumps(record) + '\n')
+            if progress_every and summary['files'] % progress_every == 0:
+                print(f"[{summary['files']}] ok {summary['ok']}, mismatch {summary['mismatch']}, error {summary['error']}, "
+                      f"timeout {summary['timeout']} | {summary['files'] / (time.perf_counter() - start):.2f} files/s", file=sys.stderr)
+    finally:
+        if report_file is not None:
+            report_file.close()
+        if workers != 1:
+            results.close() # shuts the pool down
+
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    summary['categories'] = dict(summary['categories'].most_common())
+    summary['files_by_category'] = dict(summary['files_by_category'].most_common())
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that MusicXML_to_tokens reproduces tokens after detokenization.')
+    parser.add_argument('inputs', nargs='+', help='MusicXML files, directories, *.txt lists of paths, or *.jsonl token shards')
+    parser.add_argument('-o', '--report', default=None, help='JSON-lines report of every file')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per file')
+    parser.add_argument('--writer', default='music21', choices=['music21', 'musicxml'], help='tokens_to_score + music21 export, or tokens_to_MusicXML')
+    parser.add_argument('--max-mismatches', type=int, default=20, help='mismatches kept per file in the report')
+    parser.add_argument('--staff-major', action='store_true', help='staff-major instead of bar-major tokens')
+    parser.add_argument('--note-number', action='store_true', help='note numbers instead of note names')
+    parser.add_argument('--no-chord-symbols', action='store_true', help='do not tokenize chord symbols')
+    parser.add_argument('--engine', default='bs4', choices=['bs4', 'lxml'])
+    parser.add_argument('--chord-engine', default='music21', choices=['music21', 'musicxml'])
+    args = parser.parse_args(argv)
+
+    summary = verify_corpus(args.inputs, args.workers, args.writer, args.timeout, args.report, args.max_mismatches,
+                            bar_major=not args.staff_major, note_name=not args.note_number,
+                            tokenize_chord_symbols=not args.no_chord_symbols, engine=args.engine, chord_engine=args.chord_engine)
+    print(json.dumps(summary))
+    return 0 if summary['ok'] == summary['files'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
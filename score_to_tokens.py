@@ -1,12 +1,47 @@
-from bs4 import BeautifulSoup
-from bs4.element import Tag
+import argparse
+import io
+import json
+import os
+import signal
+import sys
+import time
+import zipfile
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager, nullcontext
 from fractions import Fraction
-from music21 import converter, harmony, stream
-from pretty_midi import note_name_to_number
+from itertools import accumulate
+from xml.etree import ElementTree
+
+from instrumentation import count, instrument, peak_memory, reset_peak_memory, stage
+from token_records import token_record
+
+# music21 (chord symbols with chord_engine='music21') and bs4 (engine='bs4') are imported by the functions using them,
+# so that workers tokenizing without them do not pay for their import
 
 PITCH_ALTER_TO_SYMBOL = {'-2': 'bb', '-1': 'b', '0':'', '1': '#', '2': '##'}
 SEMITONE_TO_SYMBOL = {-1: 'b', 0: '', 1: '#'}
+ALTER_TO_PITCH_NAME = {-2: '--', -1: '-', 0: '', 1: '#', 2: '##'}
 CLEF_TRANSLATIONS = {'G': 'treble', 'F': 'bass'}
+# first abbreviation of each kind in music21.harmony.CHORD_TYPES
+CHORD_KIND_ABBREVIATIONS = {
+    'major': '', 'minor': 'm', 'augmented': '+', 'diminished': 'dim', 'dominant-seventh': '7', 'major-seventh': 'maj7',
+    'minor-major-seventh': 'mM7', 'minor-seventh': 'm7', 'augmented-major-seventh': '+M7', 'augmented-seventh': '7+',
+    'half-diminished-seventh': 'ø7', 'diminished-seventh': 'o7', 'seventh-flat-five': 'dom7dim5', 'major-sixth': '6',
+    'minor-sixth': 'm6', 'major-ninth': 'M9', 'dominant-ninth': '9', 'minor-major-ninth': 'mM9', 'minor-ninth': 'm9',
+    'augmented-major-ninth': '+M9', 'augmented-dominant-ninth': '9#5', 'half-diminished-ninth': 'ø9',
+    'half-diminished-minor-ninth': 'øb9', 'diminished-ninth': 'o9', 'diminished-minor-ninth': 'ob9', 'dominant-11th': '11',
+    'major-11th': 'M11', 'minor-major-11th': 'mM11', 'minor-11th': 'm11', 'augmented-major-11th': '+M11',
+    'augmented-11th': '+11', 'half-diminished-11th': 'ø11', 'diminished-11th': 'o11', 'major-13th': 'M13',
+    'dominant-13th': '13', 'minor-major-13th': 'mM13', 'minor-13th': 'm13', 'augmented-major-13th': '+M13',
+    'augmented-dominant-13th': '+13', 'half-diminished-13th': 'ø13', 'suspended-second': 'sus2', 'suspended-fourth': 'sus',
+    'suspended-fourth-seventh': '7sus', 'Neapolitan': 'N6', 'Italian': 'It+6', 'French': 'Fr+6', 'German': 'Gr+6',
+    'pedal': 'pedal', 'power': 'power', 'Tristan': 'tristan',
+}
+CHORD_KIND_ALIASES = {'dominant': 'dominant-seventh', 'major-minor': 'minor-major-seventh', 'half-diminished': 'half-diminished-seventh'}
+STEP_TO_SEMITONE = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+TOKENIZER_VERSION = 2 # bump whenever the emitted tokens change (part of the cache key in token_cache.py)
 BEAM_TRANSLATIONS = {'begin': 'start', 'end': 'stop', 'forward hook': 'partial-right', 'backward hook': 'partial-left'}
 
 def attributes_to_tokens(attributes, staff=None): # tokenize 'attributes' section in MusicXML
@@ -26,47 +61,68 @@ def attributes_to_tokens(attributes, staff=None): # tokenize 'attributes' sectio
     return tokens, divisions
 
 def attribute_to_token(child): # clef, key signature, and time signature
+    from bs4.element import Tag
     type_ = child.name
     
     if type_ == 'clef':
-        return f'clef_{CLEF_TRANSLATIONS.get(child.sign.text, child.sign.text)}'
+        return clef_to_token(child.sign.text)
     elif type_ == 'key':
-        key = int(child.fifths.text)
-        if key < 0:
-            return f'key_flat_{abs(key)}'
-        elif key > 0:
-            return f'key_sharp_{key}'
-        else:
-            return f'key_natural_{key}'
+        return key_to_token(int(child.fifths.text))
     elif type_ == 'time':
-        times = [int(c.text) for c in child.contents if isinstance(c, Tag)] # excluding '\n'
-        if times[1] == 2:
-            return f'time_{times[0]*2}/{times[1]*2}'
-        elif times[1] > 4:
-            fraction = str(Fraction(times[0], times[1]))
-            if int(fraction.split('/')[1]) == 2: # X/2
-                return f"time_{int(fraction.split('/')[0])*2}/{int(fraction.split('/')[0])*2}"
-            else:
-                return 'time_' + fraction
+        return time_to_token([int(c.text) for c in child.contents if isinstance(c, Tag)]) # excluding '\n'
+
+def clef_to_token(sign):
+    return f'clef_{CLEF_TRANSLATIONS.get(sign, sign)}'
+
+def key_to_token(key):
+    if key < 0:
+        return f'key_flat_{abs(key)}'
+    elif key > 0:
+        return f'key_sharp_{key}'
+    else:
+        return f'key_natural_{key}'
+
+def time_to_token(times):
+    if times[1] == 2:
+        return f'time_{times[0]*2}/{times[1]*2}'
+    elif times[1] > 4:
+        fraction = str(Fraction(times[0], times[1]))
+        if int(fraction.split('/')[1]) == 2: # X/2
+            return f"time_{int(fraction.split('/')[0])*2}/{int(fraction.split('/')[0])*2}"
         else:
-            return f'time_{times[0]}/{times[1]}'
+            return 'time_' + fraction
+    else:
+        return f'time_{times[0]}/{times[1]}'
 
-def aggregate_notes(voice_notes): # notes to chord
+def aggregate_notes(voice_notes, measure_notes, note_indices, chord_pitches, aggregated): # notes to chord (recorded in side tables keyed by id)
     for note in voice_notes[1:]:
         if note.chord is not None:
-            last_note = note.find_previous('note')
-            last_note.insert(0, note.pitch)
-            if note.technical:
-                last_note.insert(0, note.technical)
-            note.decompose()
-            
+            index = note_indices[id(note)] - 1
+            while index >= 0 and id(measure_notes[index]) in aggregated:
+                index -= 1
+            if index >= 0:
+                chord_pitches.setdefault(id(measure_notes[index]), []).insert(0, note.pitch)
+            aggregated.add(id(note))
+
 def pitch_to_note_number(pitch):
-    note_number = note_name_to_number(pitch.step.text + pitch.octave.text) # 'C4' -> 60
-    if pitch.alter:
-        note_number += int(pitch.alter.text)
+    return step_to_note_number(pitch.step.text, pitch.octave.text, pitch.alter.text if pitch.alter else None)
+
+def step_to_note_number(step, octave, alter=None):
+    note_number = 12 * (int(octave) + 1) + STEP_TO_SEMITONE[step] # 'C4' -> 60
+    if alter is not None:
+        note_number += int(alter)
     return note_number
 
-def note_to_tokens(note, divisions=8, note_name=False): # notes and rests
+def pitch_to_token(step, octave, alter=None, note_name=False):
+    if note_name:
+        if alter is not None:
+            return f'note_{step}{PITCH_ALTER_TO_SYMBOL[alter]}{octave}'
+        else:
+            return f'note_{step}{octave}'
+    else:
+        return f'note_{step_to_note_number(step, octave, alter)}'
+
+def note_to_tokens(note, divisions=8, note_name=False, chord_pitches=()): # notes and rests
     if note.duration is None: # gracenote
         return []
 
@@ -77,15 +133,9 @@ def note_to_tokens(note, divisions=8, note_name=False): # notes and rests
 
     tokens = []
 
-    sorted_pitches = sorted(note.find_all('pitch'), key=lambda x:pitch_to_note_number(x))
+    sorted_pitches = sorted(list(chord_pitches) + note.find_all('pitch'), key=lambda x:pitch_to_note_number(x))
     for pitch in sorted_pitches:
-        if note_name:
-            if pitch.alter:
-                tokens.append(f'note_{pitch.step.text}{PITCH_ALTER_TO_SYMBOL[pitch.alter.text]}{pitch.octave.text}')
-            else:
-                tokens.append(f'note_{pitch.step.text}{pitch.octave.text}')
-        else:
-            tokens.append(f'note_{pitch_to_note_number(pitch)}')
+        tokens.append(pitch_to_token(pitch.step.text, pitch.octave.text, pitch.alter.text if pitch.alter else None, note_name))
 
     # len
     tokens.append(f'len_{duration_in_fraction}')
@@ -95,7 +145,7 @@ def note_to_tokens(note, divisions=8, note_name=False): # notes and rests
 
     if note.beam:
         beams = note.find_all('beam')
-        tokens.append('beam_' + '_'.join([BEAM_TRANSLATIONS[b.text] if b.text in BEAM_TRANSLATIONS else b.text for b in beams]))
+        tokens.append(beams_to_token([b.text for b in beams]))
 
     if note.tied:
         tokens.append('tie_' + note.tied.attrs['type'])
@@ -118,17 +168,27 @@ def note_to_tokens(note, divisions=8, note_name=False): # notes and rests
 
     return tokens
 
-def element_segmentation(measure, soup, staff=None): # divide elements into three sections
+def beams_to_token(beams):
+    return 'beam_' + '_'.join([BEAM_TRANSLATIONS[b] if b in BEAM_TRANSLATIONS else b for b in beams])
+
+def voice_of(element, note_voices):
+    if id(element) in note_voices:
+        return note_voices[id(element)]
+    return element.voice.text if element.voice else None
+
+def element_segmentation(elements, note_voices, staff=None): # divide elements into three sections
+    starts, ends = {}, {} # positions of elements, keyed by id
     voice_starts, voice_ends = {}, {}
-    position = 0
-    last_voice = None
-    for element in measure.contents:
+    position, last_duration = 0, 0 # a <chord/> note before any other (not valid MusicXML) is not rewound
+    voice = last_voice = None # notes without <voice> before any other
+    for element in elements:
         if element.name == 'note':
             if element.duration is None: # gracenote
                 continue
                 
-            if element.voice:
-                voice = element.voice.text
+            voice_ = voice_of(element, note_voices)
+            if voice_ is not None:
+                voice = voice_
                 last_voice = voice
             elif element.chord:
                 voice = last_voice
@@ -137,19 +197,16 @@ def element_segmentation(measure, soup, staff=None): # divide elements into thre
             if element.chord: # rewind for concurrent notes
                 position -= last_duration
 
-            if not element.staff or int(element.staff.text) == staff:
+            in_staff = not element.staff or int(element.staff.text) == staff
+            if in_staff:
                 voice_starts[voice] = min(voice_starts[voice], position) if voice in voice_starts else position
-                start_tag = soup.new_tag('start')
-                start_tag.string = str(position)
-                element.append(start_tag)
+                starts[id(element)] = position
 
             position += duration
 
-            if not element.staff or int(element.staff.text) == staff:
+            if in_staff:
                 voice_ends[voice] = max(voice_ends[voice], position) if voice in voice_ends else position
-                end_tag = soup.new_tag('end')
-                end_tag.string = str(position)
-                element.append(end_tag)
+                ends[id(element)] = position
 
             last_duration = duration
         elif element.name == 'backup':
@@ -157,21 +214,15 @@ def element_segmentation(measure, soup, staff=None): # divide elements into thre
         elif element.name == 'forward':
             position += int(element.duration.text)
         else: # other types
-            start_tag = soup.new_tag('start')
-            end_tag = soup.new_tag('end')
-
-            start_tag.string = str(position)
-            end_tag.string = str(position)
-
-            element.append(start_tag)
-            element.append(end_tag)
+            starts[id(element)] = position
+            ends[id(element)] = position
 
     # voice section
     voice_start = sorted(voice_starts.values())[1] if voice_starts else 0
     voice_end = sorted(voice_ends.values(), reverse=True)[1] if voice_ends else 0
 
     pre_voice_elements, post_voice_elements, voice_elements = [], [], []
-    for element in measure.contents:
+    for element in elements:
         if element.name in ('backup', 'forward'):
             continue
         if element.name == 'note' and element.duration is None: # gracenote
@@ -181,9 +232,9 @@ def element_segmentation(measure, soup, staff=None): # divide elements into thre
                 continue
 
         if voice_starts or voice_ends:
-            if int(element.end.text) <= voice_start:
+            if ends[id(element)] <= voice_start:
                 pre_voice_elements.append(element)
-            elif voice_end <= int(element.start.text):
+            elif voice_end <= starts[id(element)]:
                 post_voice_elements.append(element)
             else:
                 voice_elements.append(element)
@@ -199,84 +250,86 @@ def measures_to_tokens(measures, soup, staff=None, note_name=False):
         
     return tokens
 
-def measure_to_tokens(measure, soup, staff=None, note_name=False):
+def measure_to_tokens(measure, soup, staff=None, note_name=False): # the parsed tree is left unchanged
+    from bs4.element import Tag
     divisions = int(soup.divisions.text)
     tokens = []
 
+    measure_notes = measure.find_all('note')
     if staff is not None:
-        notes = [n for n in measure.find_all('note') if n.staff and int(n.staff.text) == staff]
+        notes = [n for n in measure_notes if n.staff and int(n.staff.text) == staff]
     else:
-        notes = measure.find_all('note')
+        notes = measure_notes
 
-    # add voice to unvoiced notes (of a chord)
+    # voices of notes, including unvoiced notes (of a chord)
+    note_voices = {}
     last_voice = None
     for note in notes:
         if note.voice:
             last_voice = note.voice.text
+            note_voices[id(note)] = last_voice
         elif note.chord:                
-            voice_tag = soup.new_tag('voice')
-            voice_tag.string = str(last_voice)
-            note.append(voice_tag)
+            note_voices[id(note)] = str(last_voice)
 
-    voices = list(set([n.voice.text for n in notes if n.voice]))
+    note_indices = {id(n): i for i, n in enumerate(measure_notes)}
+    chord_pitches, aggregated = {}, set()
+    voices = list(dict.fromkeys([note_voices[id(n)] for n in notes if id(n) in note_voices])) # in order of appearance, independent of hash seeds
     for voice in voices:
-        voice_notes = [n for n in notes if n.voice and n.voice.text == voice]
-        aggregate_notes(voice_notes)
+        voice_notes = [n for n in notes if note_voices.get(id(n)) == voice]
+        aggregate_notes(voice_notes, measure_notes, note_indices, chord_pitches, aggregated)
+    count('notes', len(notes) - len(aggregated))
+    count('chords', len(chord_pitches))
+
+    elements = [e for e in measure.contents if isinstance(e, Tag) and id(e) not in aggregated]
+
+    def element_to_tokens(element):
+        nonlocal divisions
+        if element.name == 'attributes':
+            attr_tokens, div = attributes_to_tokens(element, staff)
+            divisions = div or divisions
+            return attr_tokens
+        elif element.name == 'note':
+            return note_to_tokens(element, divisions, note_name, chord_pitches.get(id(element), ()))
+        return []
 
     if len(voices) > 1:
-        pre_voice_elements, voice_elements, post_voice_elements = element_segmentation(measure, soup, staff)
+        count('multi_voice_measures')
+        with stage('element_segmentation'):
+            pre_voice_elements, voice_elements, post_voice_elements = element_segmentation(elements, note_voices, staff)
 
         for element in pre_voice_elements:
-            if element.name == 'attributes':
-                attr_tokens, div = attributes_to_tokens(element, staff)
-                tokens += attr_tokens
-                divisions = div or divisions
-            elif element.name == 'note':
-                tokens += note_to_tokens(element, divisions, note_name)
+            tokens += element_to_tokens(element)
 
         if voice_elements:
             for voice in voices:
                 tokens.append('<voice>')
                 for element in voice_elements:
-                    if (element.voice and element.voice.text == voice) or (not element.voice and voice == '1'):
-                        if element.name == 'attributes':
-                            attr_tokens, div = attributes_to_tokens(element, staff)
-                            tokens += attr_tokens
-                            divisions = div or divisions
-                        elif element.name == 'note':
-                            tokens += note_to_tokens(element, divisions, note_name)
+                    element_voice = voice_of(element, note_voices)
+                    if element_voice == voice or (element_voice is None and voice == '1'):
+                        tokens += element_to_tokens(element)
                 tokens.append('</voice>')
 
         for element in post_voice_elements:
-            if element.name == 'attributes':
-                attr_tokens, div = attributes_to_tokens(element, staff)
-                tokens += attr_tokens
-                divisions = div or divisions
-            elif element.name == 'note':
-                tokens += note_to_tokens(element, divisions, note_name)
+            tokens += element_to_tokens(element)
     else:
-        for element in measure.contents:
+        for element in elements:
             if staff is not None:
                 if element.name in ('attributes', 'note') and \
                    element.staff and int(element.staff.text) != staff:
                     continue
-            if element.name == 'attributes':
-                attr_tokens, div = attributes_to_tokens(element, staff)
-                tokens += attr_tokens
-                divisions = div or divisions
-            elif element.name == 'note':
-                tokens += note_to_tokens(element, divisions, note_name)
+            tokens += element_to_tokens(element)
 
     return tokens
 
 def common(tokens, common_types=['time', 'key']):
-    return [t for t in tokens if t.split('_')[0] in common_types]
+    return [t for t in tokens if token_record(t).family in common_types]
 
 def others(tokens, common_types=['time', 'key']):
-    return [t for t in tokens if t.split('_')[0] not in common_types]
+    return [t for t in tokens if token_record(t).family not in common_types]
 
 ## for chord symbols
 def ChordSymbol_to_tokens(c):
+    from music21 import harmony
     if isinstance(c, harmony.NoChord):
         return []
 
@@ -301,18 +354,23 @@ def ChordSymbol_to_tokens(c):
     return tokens
 
 def mod_to_str(mod):
-    if mod.modType in ('alter', 'add'):
-        mod_str = f'{SEMITONE_TO_SYMBOL[mod.interval.semitones]}{mod.degree}'
+    return degree_to_str(mod.modType, mod.degree, mod.interval.semitones if mod.interval is not None else 0)
+
+def degree_to_str(mod_type, degree, semitones):
+    if mod_type in ('alter', 'add'):
+        mod_str = f'{SEMITONE_TO_SYMBOL[semitones]}{degree}'
     else:
         mod_str = ''
 
-    if mod.degree == 5:
+    if degree == 5:
         return mod_str
     else:
         return f'({mod_str})'
 
 def get_chord_tokens(s):
-    if not s.recurse().getElementsByClass('ChordSymbol'):
+    from music21 import stream
+    chord_symbols = list(s.recurse().getElementsByClass('ChordSymbol'))
+    if not chord_symbols:
         return []
     
     measures = sorted(set([
@@ -321,18 +379,26 @@ def get_chord_tokens(s):
     ]))
 
     chords = []
-    for c in s.recurse().getElementsByClass('ChordSymbol'):
-        measure_offset = list(c.contextSites(priorityTarget=stream.Measure))[0].site.offset
+    for c in chord_symbols:
+        measure_offset = next(c.contextSites(priorityTarget=stream.Measure)).site.offset # only the first site is needed
         time = measure_offset + c.beat - 1
         if measures[0][0] <= time < measures[-1][1]:
             chords.append((time, ChordSymbol_to_tokens(c)))
-    
-    # add chords to the top of each measure
-    additional_chords = [
-        (t, [chord for time, chord in chords if time < t][-1]) # last chord
-        for t in set([start for start, end in measures]) - set([time for time, _ in chords])
-        if measures[0][0] < t and any(time < t for time, _ in chords)
-    ]
+
+    count('chord_symbols', len(chords))
+    return chords_to_tokens(measures, chords)
+
+def chords_to_tokens(measures, chords): # arrange (time, chord tokens) into bars
+    # add chords to the top of each measure: the last chord (in list order) of those before its start,
+    # looked up in a timeline of the chords sorted by time, where last_before[k] is the last of the first k+1
+    order = sorted(range(len(chords)), key=lambda i: chords[i][0])
+    times = [chords[i][0] for i in order]
+    last_before = list(accumulate(order, max))
+    additional_chords = []
+    for t in sorted(set([start for start, end in measures]) - set(times)):
+        n_before = bisect_left(times, t)
+        if measures[0][0] < t and n_before:
+            additional_chords.append((t, chords[last_before[n_before - 1]][1]))
 
     # arrange all elements in time order
     ordered_elements = sorted(
@@ -343,10 +409,10 @@ def get_chord_tokens(s):
     last_time = ordered_elements[0][0]
     all_tokens, tokens = [], None
 
-    for time, element in ordered_elements:
-        time_diff = time - last_time
+    for onset, element in ordered_elements:
+        time_diff = onset - last_time
         if time_diff:
-            if time_diff.is_integer():
+            if time_diff == int(time_diff):
                 tokens.append(f'len_{int(time_diff)}')
             else:
                 tokens.append(f'len_{str(Fraction(time_diff).limit_denominator(6))}')
@@ -360,13 +426,253 @@ def get_chord_tokens(s):
         else:
             tokens += element
 
-        last_time = time
+        last_time = onset
 
     return all_tokens
 
+## for chord symbols (read directly from <harmony> elements, without music21)
+def harmony_to_tokens(harmony, degrees): # same tokens as ChordSymbol_to_tokens
+    kind_ = harmony.find('kind')
+    kind = (kind_.text or '').strip() if kind_ is not None else ''
+    kind = CHORD_KIND_ALIASES.get(kind, kind)
+    kind_str = (kind_.get('text') or '') if kind else ''
+
+    root_ = harmony.find('root')
+    if kind == 'none' or root_ is None: # no chord
+        return []
+
+    root_step = root_.find('root-step')
+    root = step_to_pitch_name(root_step.text or root_step.get('text'), root_.find('root-alter'))
+    bass_ = harmony.find('bass')
+    if bass_ is not None:
+        bass = step_to_pitch_name(bass_.find('bass-step').text, bass_.find('bass-alter'))
+    else:
+        bass = root
+
+    mods = []
+    for degree in degrees:
+        alter = degree.find('degree-alter')
+        mod = (degree.find('degree-type').text.strip(), int(degree.find('degree-value').text), int(alter.text) if alter is not None and alter.text else 0)
+        if mod not in mods: # identical modifications are kept once
+            mods.append(mod)
+    mods = ''.join([degree_to_str(*mod) for mod in mods])
+
+    if not kind_str and degrees: # take the kind from music21's figure, e.g. 'C7/E add b9' -> '7/E'
+        kind = CHORD_KIND_ABBREVIATIONS.get(kind, '') + (f'/{bass}' if bass != root else '')
+    else:
+        kind = kind_str
+
+    root, bass = root.replace('-', 'b'), bass.replace('-', 'b')
+    if kind or mods:
+        tokens = [f'chord_{root}{kind}{mods}']
+    else:
+        tokens = [f'chord_{root}']
+
+    if bass != root:
+        tokens += [f'bass_{bass}']
+
+    return tokens
+
+def step_to_pitch_name(step, alter=None): # pitch name in music21 notation, e.g. 'B-'
+    if alter is not None and alter.text:
+        return step + ALTER_TO_PITCH_NAME[int(float(alter.text))]
+    return step
+
+def time_to_beat_length(beats, beat_type): # default beat partitioning of music21.meter.TimeSignature
+    if beats in (2, 6):
+        n_beats = 2
+    elif beats == 3:
+        n_beats = 1 if beat_type >= 8 else 3
+    elif beats == 9:
+        n_beats = 3
+    elif beats in (4, 12):
+        n_beats = 4
+    elif beats >= 15 and beats % 3 == 0:
+        n_beats = beats // 3
+    else:
+        n_beats = beats
+    return Fraction(4 * beats, beat_type) / n_beats
+
+def op_frac(x): # float for dyadic fractions and Fraction otherwise, like music21's opFrac
+    return float(x) if x.denominator & (x.denominator - 1) == 0 else x
+
+class ChordSymbolTracker: # collect chord symbols measure by measure, following the offsets and beats of music21
+    def __init__(self):
+        self.measures, self.chords = set(), {}
+        self.has_chord_symbols = False
+        self.n_parts = 0
+
+    def new_part(self):
+        self.n_parts += 1
+        self.offset = Fraction(0)
+        self.divisions = 1
+        self.staves = 1
+        self.time = None
+        self.last_measure_was_short = False
+
+    # events: ('divisions', n), ('staves', n), ('time', (beats, beat_type)), ('note', duration, is_chord, staff),
+    #         ('backup', duration), ('forward', duration) and ('harmony', offset, tokens, staff)
+    def add_measure(self, events):
+        position, last_duration = Fraction(0), Fraction(0)
+        highest = {}
+        has_notes = False
+        harmonies = []
+        for event in events:
+            type_ = event[0]
+            if type_ == 'divisions':
+                self.divisions = event[1]
+            elif type_ == 'staves':
+                self.staves = event[1]
+            elif type_ == 'time':
+                self.time = event[1]
+            elif type_ == 'note':
+                has_notes = True
+                duration = Fraction(event[1], self.divisions)
+                if event[2]: # chord
+                    position -= last_duration
+                staff = event[3] or 1
+                highest[staff] = max(highest.get(staff, 0), position + duration)
+                position += duration
+                last_duration = duration
+            elif type_ == 'backup':
+                position -= Fraction(event[1], self.divisions)
+            elif type_ == 'forward':
+                position += Fraction(event[1], self.divisions)
+            elif type_ == 'harmony':
+                self.has_chord_symbols = True
+                time = position + Fraction(event[1], self.divisions)
+                staves = [event[3]] if event[3] else range(1, self.staves + 1) # copied into every staff by music21
+                for staff in staves:
+                    highest[staff] = max(highest.get(staff, 0), time)
+                    harmonies.append((staff, time, event[2], self.time))
+
+        bar_length = Fraction(4 * self.time[0], self.time[1]) if self.time else Fraction(4)
+        measure_highest = max(highest.values(), default=Fraction(0))
+        padding = 0
+        if measure_highest == bar_length:
+            shift = measure_highest
+        elif measure_highest > bar_length: # overfull
+            diff = measure_highest - bar_length
+            shift = measure_highest if diff > Fraction(1, 2) or (diff * 16).denominator == 1 or (diff * 12).denominator == 1 else bar_length
+        elif measure_highest == 0 and not has_notes: # empty measure, filled with a rest
+            highest = {staff: bar_length for staff in range(1, self.staves + 1)}
+            shift = bar_length
+            self.last_measure_was_short = False
+        else:
+            shift = measure_highest
+            if self.offset == 0: # pickup
+                padding = bar_length - measure_highest
+            elif self.last_measure_was_short:
+                padding = bar_length - measure_highest
+                self.last_measure_was_short = False
+            else:
+                self.last_measure_was_short = True
+
+        offset = op_frac(self.offset)
+        for staff in range(1, self.staves + 1):
+            self.measures.add((offset, offset + op_frac(highest.get(staff, Fraction(0)))))
+
+        for staff, time, tokens, time_signature in sorted(harmonies, key=lambda x: x[1]): # measures keep their elements sorted by offset
+            if time_signature is None: # no beat without a time signature
+                continue
+            time += padding
+            if time >= bar_length:
+                time %= bar_length
+            beat = op_frac(1 + time / time_to_beat_length(*time_signature))
+            self.chords.setdefault((self.n_parts, staff), []).append((offset + beat - 1, tokens)) # in the order of music21's recurse()
+
+        self.offset += shift
+
+    def tokens(self):
+        if not self.has_chord_symbols:
+            return []
+
+        measures = sorted(self.measures)
+        chords = [(time, tokens) for staff in sorted(self.chords) for time, tokens in self.chords[staff] if measures[0][0] <= time < measures[-1][1]]
+        count('chord_symbols', len(chords))
+        return chords_to_tokens(measures, chords)
+
+def measure_to_chord_events(measure): # events of a measure for ChordSymbolTracker
+    events = []
+    for element in measure.contents:
+        if element.name == 'attributes':
+            if element.divisions:
+                events.append(('divisions', int(element.divisions.text)))
+            if element.staves:
+                events.append(('staves', int(element.staves.text)))
+            if element.time and element.time.beats:
+                events.append(('time', (int(element.time.beats.text), int(element.time.find('beat-type').text))))
+        elif element.name == 'note':
+            if element.duration and not element.grace:
+                events.append(('note', int(element.duration.text), element.chord is not None, int(element.staff.text) if element.staff else None))
+        elif element.name in ('backup', 'forward'):
+            events.append((element.name, int(element.duration.text)))
+        elif element.name == 'harmony':
+            offset = int(element.offset.text) if element.offset else 0
+            staff = int(element.staff.text) if element.staff else None
+            events.append(('harmony', offset, harmony_to_tokens(element, element.find_all('degree')), staff))
+    return events
+
+def get_chord_tokens_from_parts(parts):
+    return get_chord_tokens_from_events([measure_to_chord_events(measure) for measure in measures] for measures in parts)
+
+def get_chord_tokens_from_events(parts): # parts: [events of each measure] of each part
+    tracker = ChordSymbolTracker()
+    for measures in parts:
+        tracker.new_part()
+        for events in measures:
+            tracker.add_measure(events)
+    return tracker.tokens()
+
+## MusicXML sources: paths of .musicxml or compressed .mxl files, bytes, or binary file objects
+MUSICXML_MEDIA_TYPE = 'application/vnd.recordare.musicxml+xml'
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def mxl_root_file(archive): # name of the score in an .mxl archive, given by META-INF/container.xml
+    try:
+        container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+        for rootfile in container.iter():
+            if rootfile.tag.split('}')[-1] == 'rootfile' and rootfile.get('full-path'):
+                if rootfile.get('media-type', MUSICXML_MEDIA_TYPE) == MUSICXML_MEDIA_TYPE:
+                    return rootfile.get('full-path')
+    except KeyError: # no container.xml
+        pass
+    names = [n for n in archive.namelist() if not n.startswith('META-INF/') and n.lower().endswith(('.musicxml', '.xml'))]
+    if not names:
+        raise ValueError('no MusicXML file in the archive')
+    return names[0]
+
+@contextmanager
+def open_MusicXML(source): # binary stream of the MusicXML document; .mxl members are streamed without extraction
+    with ExitStack() as stack:
+        if is_path(source):
+            f = stack.enter_context(open(source, 'rb'))
+        elif isinstance(source, (bytes, bytearray)):
+            f = io.BytesIO(source)
+        else: # file object (left open)
+            f = source if source.seekable() else io.BytesIO(source.read())
+
+        start = f.tell()
+        is_mxl = f.read(4) == b'PK\x03\x04' # zip archive
+        f.seek(start)
+        if is_mxl:
+            archive = stack.enter_context(zipfile.ZipFile(f))
+            f = stack.enter_context(archive.open(mxl_root_file(archive)))
+        yield f
+
+def parse_with_music21(source):
+    from music21 import converter
+    if is_path(source) and not zipfile.is_zipfile(source): # music21 only recognizes .mxl by the extension
+        return converter.parse(source)
+    with open_MusicXML(source) as f:
+        return converter.parseData(f.read(), format='musicxml')
 
 def load_MusicXML(mxml_path): 
-    soup = BeautifulSoup(open(mxml_path, encoding='utf-8'), 'lxml-xml', from_encoding='utf-8')
+    from bs4 import BeautifulSoup
+    with open_MusicXML(mxml_path) as f:
+        soup = BeautifulSoup(f, 'lxml-xml', from_encoding='utf-8')
     
     # eliminate line breaks
     for tag in soup(string='\n'):
@@ -374,8 +680,32 @@ def load_MusicXML(mxml_path):
 
     return [part.find_all('measure') for part in soup.find_all('part')], soup
 
-def MusicXML_to_tokens(mxml_path, bar_major=True, note_name=True, tokenize_chord_symbols=True):
-    parts, soup = load_MusicXML(mxml_path)
+def bars_to_tokens(bars, chords=None, bar_major=True): # arrange (R, L) tokens of each bar and chord tokens into a sequence
+    tokens = []
+    if bar_major:
+        if chords:
+            for (R, L), C in zip(bars, chords):
+                tokens += ['bar'] + common(R) + C + ['R'] + others(R) + ['L'] + others(L)
+        else:
+            for R, L in bars:
+                tokens += ['bar'] + common(R) + ['R'] + others(R) + ['L'] + others(L)
+    else:
+        if chords:
+            tokens += ['C']
+            for C in chords:
+                tokens += ['bar'] + C
+        tokens += ['R']
+        for R, _ in bars:
+            tokens += ['bar'] + R
+        tokens += ['L']
+        for _, L in bars:
+            tokens += ['bar'] + L
+
+    return tokens
+
+def iter_bar_token_variants(parts, soup, note_names=(True,), chord_events=None, release=False): # {note_name: (R, L)} of each bar
+    # chord_events: a list per part, to which the chord events of each measure are appended;
+    # release: measures are decomposed once tokenized (except the one of the first <divisions>, read by measure_to_tokens)
     assert len(parts) in (1, 2)
     
     if len(parts) == 1:
@@ -385,26 +715,315 @@ def MusicXML_to_tokens(mxml_path, bar_major=True, note_name=True, tokenize_chord
         R_part, L_part = parts[0], parts[1]
         R_staff, L_staff = None, None
         assert len(parts[0]) == len(parts[1])
-    
+    kept = soup.divisions.find_parent('measure') if release and soup.divisions else None
+
+    for R_measure, L_measure in zip(R_part, L_part):
+        count('measures')
+        measures = (R_measure,) if R_measure is L_measure else (R_measure, L_measure)
+        if chord_events is not None:
+            for events, measure in zip(chord_events, measures):
+                events.append(measure_to_chord_events(measure))
+        yield {note_name: (measure_to_tokens(R_measure, soup, R_staff, note_name), measure_to_tokens(L_measure, soup, L_staff, note_name))
+               for note_name in note_names}
+        if release:
+            for measure in measures:
+                if measure is not kept:
+                    measure.decompose()
+
+VARIANT_OPTIONS = {'bar_major': True, 'note_name': True, 'tokenize_chord_symbols': True}
+
+def normalize_variants(variants): # fill in default options
+    normalized = []
+    for variant in variants:
+        unknown = set(variant) - set(VARIANT_OPTIONS)
+        if unknown:
+            raise ValueError(f'unknown variant options: {sorted(unknown)}')
+        normalized.append(dict(VARIANT_OPTIONS, **variant))
+    return normalized
+
+def variants_from_bars(variants, bars, chords): # bars: {note_name: [(R, L), ...]}
+    return [bars_to_tokens(bars[v['note_name']], chords if v['tokenize_chord_symbols'] else None, v['bar_major']) for v in variants]
+
+def MusicXML_to_token_variants(mxml_path, variants, engine='bs4', chord_engine='music21', cache=None, low_memory=False):
+    # parse the score once and tokenize it with several options;
+    # variants: list of dicts of bar_major, note_name and tokenize_chord_symbols (same defaults as MusicXML_to_tokens);
+    # low_memory: with engine='bs4', measures are released once tokenized and the tree before music21 parses the score
+    # (engine='lxml' always reads measures one at a time and parses with music21 after them)
+    if chord_engine not in ('music21', 'musicxml'):
+        raise ValueError(f'unknown chord_engine: {chord_engine}')
+    variants = normalize_variants(variants)
+
+    if not is_path(mxml_path) and not isinstance(mxml_path, (bytes, bytearray)): # file object: read once, since the score may be parsed twice
+        mxml_path = mxml_path.read()
+
+    if cache is not None: # TokenCache or its directory
+        from token_cache import open_cache
+        cache = open_cache(cache) if isinstance(cache, str) else cache
+        return cache.MusicXML_to_token_variants(mxml_path, variants, engine=engine, chord_engine=chord_engine, low_memory=low_memory)
+
+    if engine == 'lxml': # streaming engine
+        from score_to_tokens_lxml import MusicXML_to_token_variants as MusicXML_to_token_variants_lxml
+        return MusicXML_to_token_variants_lxml(mxml_path, variants, chord_engine)
+    elif engine != 'bs4':
+        raise ValueError(f'unknown engine: {engine}')
+
+    tokenize_chord_symbols = any(v['tokenize_chord_symbols'] for v in variants)
+    with stage('load_MusicXML'):
+        parts, soup = load_MusicXML(mxml_path)
+    chord_events = [[] for _ in parts] if low_memory and tokenize_chord_symbols and chord_engine == 'musicxml' else None
+    note_names = list(dict.fromkeys(v['note_name'] for v in variants))
+    with stage('tokenize_bars'):
+        bar_variants = list(iter_bar_token_variants(parts, soup, note_names, chord_events, release=low_memory))
+    bars = {note_name: [bar[note_name] for bar in bar_variants] for note_name in note_names}
+    if low_memory: # never alive together with the music21 stream
+        soup.decompose()
+        del parts, soup
+
+    chords = None
     if tokenize_chord_symbols:
-        chords = get_chord_tokens(converter.parse(mxml_path))
-        
-    tokens = []
-    if bar_major:
-        if tokenize_chord_symbols and chords:
-            for R_measure, L_measure, C in zip(R_part, L_part, chords):
-                R = measure_to_tokens(R_measure, soup, R_staff, note_name)
-                L = measure_to_tokens(L_measure, soup, L_staff, note_name)
-                tokens += ['bar'] + common(R) + C + ['R'] + others(R) + ['L'] + others(L)
+        if chord_events is not None: # collected before the measures were released
+            with stage('get_chord_tokens_from_parts'):
+                chords = get_chord_tokens_from_events(chord_events)
+        elif chord_engine == 'musicxml': # from the parsed tree
+            with stage('get_chord_tokens_from_parts'):
+                chords = get_chord_tokens_from_parts(parts)
         else:
-            for R_measure, L_measure in zip(R_part, L_part):
-                R = measure_to_tokens(R_measure, soup, R_staff, note_name)
-                L = measure_to_tokens(L_measure, soup, L_staff, note_name)
-                tokens += ['bar'] + common(R) + ['R'] + others(R) + ['L'] + others(L)
+            with stage('parse_with_music21'):
+                s = parse_with_music21(mxml_path)
+            with stage('get_chord_tokens'):
+                chords = get_chord_tokens(s)
+            del s # not needed to arrange the tokens
+
+    with stage('bars_to_tokens'):
+        return variants_from_bars(variants, bars, chords)
+
+def MusicXML_to_tokens(mxml_path, bar_major=True, note_name=True, tokenize_chord_symbols=True, engine='bs4', chord_engine='music21', cache=None,
+                       low_memory=False):
+    variant = {'bar_major': bar_major, 'note_name': note_name, 'tokenize_chord_symbols': tokenize_chord_symbols}
+    return MusicXML_to_token_variants(mxml_path, [variant], engine, chord_engine, cache, low_memory)[0]
+
+# batch tokenization of a corpus: a pool of worker processes, sharded JSON-lines output
+# and a manifest of finished files so that an interrupted run can be resumed
+
+MUSICXML_EXTENSIONS = ('.musicxml', '.xml', '.mxl')
+
+def find_MusicXML_files(inputs): # expand directories and file lists (*.txt, one path per line)
+    paths = []
+    for input_ in inputs:
+        if os.path.isdir(input_):
+            for root, _, files in sorted(os.walk(input_)):
+                paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(MUSICXML_EXTENSIONS)]
+        elif input_.endswith('.txt'):
+            with open(input_, encoding='utf-8') as f:
+                paths += [line.strip() for line in f if line.strip()]
+        else:
+            paths.append(input_)
+    return list(dict.fromkeys(paths)) # unique, keeping order
+
+class FileTimeout(Exception):
+    pass
+
+def raise_timeout(signum, frame):
+    raise FileTimeout()
+
+def tokenize_file(args): # worker: never raises, returns a manifest record and the tokens
+    path, options, timeout, cache_args, profile = args
+    if cache_args is not None: # (cache directory, max bytes)
+        from token_cache import open_cache
+        cache = open_cache(*cache_args)
+        hits = cache.hits
+        options = dict(options, cache=cache)
+    start = time.perf_counter()
+    reset_peak_memory()
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with instrument() if profile else nullcontext() as recorder:
+            tokens = MusicXML_to_tokens(path, **options)
+        record = {'path': path, 'status': 'ok', 'n_tokens': len(tokens)}
+        if cache_args is not None:
+            record['cache'] = 'hit' if cache.hits > hits else 'miss'
+        if profile:
+            record['profile'] = recorder.to_dict()
+    except FileTimeout:
+        tokens, record = None, {'path': path, 'status': 'timeout'}
+    except Exception as e:
+        tokens, record = None, {'path': path, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    record['peak_memory'] = peak_memory() # of the worker, while tokenizing this file
+    return record, tokens
+
+def lost_file(task, error): # manifest record of a file whose worker died (crash, out of memory, killed)
+    return {'path': task[0], 'status': 'error', 'error': f'worker lost: {type(error).__name__}: {error}', 'seconds': None, 'peak_memory': None}, None
+
+def read_manifest(manifest_path): # {path: last record}
+    records = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError: # partially written line of an interrupted run
+                    continue
+                records[record['path']] = record
+    return records
+
+class ShardWriter: # JSON-lines shards of at most shard_size scores: shard-00000.jsonl, shard-00001.jsonl, ...
+    def __init__(self, out_dir, shard_size=1000):
+        self.out_dir, self.shard_size = out_dir, shard_size
+        existing = [f for f in os.listdir(out_dir) if f.startswith('shard-') and f.endswith('.jsonl')]
+        self.index = len(existing) # a resumed run starts a new shard
+        self.file, self.count = None, 0
+
+    def write(self, path, tokens): # returns the shard name
+        if self.file is None or self.count >= self.shard_size:
+            self.close()
+            self.name = f'shard-{self.index:05d}.jsonl'
+            self.file = open(os.path.join(self.out_dir, self.name), 'w', encoding='utf-8')
+            self.index += 1
+            self.count = 0
+        self.file.write(json.dumps({'path': path, 'tokens': tokens}) + '\n')
+        self.file.flush()
+        self.count += 1
+        return self.name
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def corpus_to_tokens(inputs, out_dir, workers=None, shard_size=1000, timeout=None, retry_failed=False, progress_every=100,
+                     cache_dir=None, cache_max_bytes=None, profile=False, **options):
+    # options are passed to MusicXML_to_tokens; returns the statistics of this run;
+    # profile: record the durations of stages and the counters of each file in the manifest (see instrumentation)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.jsonl')
+    done = read_manifest(manifest_path)
+    skip_statuses = ('ok',) if retry_failed else ('ok', 'error', 'timeout')
+    all_paths = find_MusicXML_files(inputs)
+    paths = [p for p in all_paths if done.get(p, {}).get('status') not in skip_statuses]
+    workers = workers or os.cpu_count() or 1
+
+    stats = {'files': 0, 'ok': 0, 'error': 0, 'timeout': 0, 'tokens': 0, 'skipped': len(all_paths) - len(paths), 'peak_memory': None}
+    if cache_dir is not None:
+        from token_cache import DEFAULT_MAX_BYTES
+        cache_args = (cache_dir, cache_max_bytes or DEFAULT_MAX_BYTES)
+        stats.update({'cache_hits': 0, 'cache_misses': 0})
     else:
-        if tokenize_chord_symbols and chords:
-            tokens += ['C'] + sum([['bar'] + C for C in chords], [])
-        tokens += ['R'] + measures_to_tokens(R_part, soup, R_staff, note_name)
-        tokens += ['L'] + measures_to_tokens(L_part, soup, L_staff, note_name)
+        cache_args = None
+    writer = ShardWriter(out_dir, shard_size)
+    start = time.perf_counter()
 
-    return tokens
+    def report():
+        elapsed = time.perf_counter() - start
+        stats['seconds'] = round(elapsed, 2)
+        stats['files_per_second'] = round(stats['files'] / elapsed, 2) if elapsed else 0.0
+        stats['tokens_per_second'] = round(stats['tokens'] / elapsed, 1) if elapsed else 0.0
+        print(f"[{stats['files']}/{len(paths)}] ok {stats['ok']}, error {stats['error']}, timeout {stats['timeout']} | "
+              f"{stats['files_per_second']} files/s, {stats['tokens_per_second']} tokens/s", file=sys.stderr)
+
+    tasks = ((path, options, timeout, cache_args, profile) for path in paths)
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        if workers == 1:
+            results = map(tokenize_file, tasks)
+        else:
+            results = iter_unordered(tokenize_file, tasks, workers, 4 * workers, lost_file)
+        try:
+            for record, tokens in results:
+                if tokens is not None:
+                    record['shard'] = writer.write(record['path'], tokens) # tokens first, then the manifest
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()
+
+                stats['files'] += 1
+                stats[record['status']] += 1
+                stats['tokens'] += record.get('n_tokens', 0)
+                if record['peak_memory'] is not None:
+                    stats['peak_memory'] = max(stats['peak_memory'] or 0, record['peak_memory'])
+                if 'cache' in record:
+                    stats['cache_hits' if record['cache'] == 'hit' else 'cache_misses'] += 1
+                if progress_every and stats['files'] % progress_every == 0:
+                    report()
+        finally:
+            writer.close()
+            if workers != 1:
+                results.close() # shuts the pool down
+
+    report()
+    return stats
+
+def iter_unordered(func, tasks, workers, max_pending, lost): # results in completion order, with a bounded number of pending tasks
+    # in a pool of worker processes; a worker that dies (crash, out of memory, killed) breaks the pool: the result of each
+    # task that was in flight is then lost(task, error), and the remaining tasks go to a new pool
+    pool = ProcessPoolExecutor(workers)
+    pending = {} # future -> (task, pool)
+
+    def restart(broken): # once per broken pool, whichever of its tasks notices first
+        nonlocal pool
+        if pool is broken:
+            pool = ProcessPoolExecutor(workers)
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(task):
+        try:
+            future = pool.submit(func, task)
+        except BrokenProcessPool: # broken by a task that has not been collected yet
+            restart(pool)
+            future = pool.submit(func, task)
+        pending[future] = (task, pool)
+
+    def collect():
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            task, owner = pending.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                restart(owner)
+                result = lost(task, e)
+            yield result
+
+    try:
+        for task in tasks:
+            submit(task)
+            if len(pending) >= max_pending:
+                yield from collect()
+        while pending:
+            yield from collect()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tokenize MusicXML scores into ST+ tokens.')
+    parser.add_argument('inputs', nargs='+', help='MusicXML files, directories, or *.txt lists of paths')
+    parser.add_argument('-o', '--out-dir', required=True, help='directory of the shards and the manifest')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--shard-size', type=int, default=1000, help='scores per shard')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per file')
+    parser.add_argument('--retry-failed', action='store_true', help='tokenize failed and timed-out files again')
+    parser.add_argument('--cache-dir', default=None, help='reuse tokens of unchanged files from this cache')
+    parser.add_argument('--cache-size', type=float, default=2048, help='maximum cache size in MB')
+    parser.add_argument('--profile', action='store_true', help='record stage durations and counters of each file in the manifest')
+    parser.add_argument('--low-memory', action='store_true', help='release measures once tokenized and the tree before music21 parses a score')
+    parser.add_argument('--staff-major', action='store_true', help='staff-major instead of bar-major tokens')
+    parser.add_argument('--note-number', action='store_true', help='note numbers instead of note names')
+    parser.add_argument('--no-chord-symbols', action='store_true', help='do not tokenize chord symbols')
+    parser.add_argument('--engine', default='bs4', choices=['bs4', 'lxml'])
+    parser.add_argument('--chord-engine', default='music21', choices=['music21', 'musicxml'])
+    args = parser.parse_args(argv)
+
+    stats = corpus_to_tokens(args.inputs, args.out_dir, args.workers, args.shard_size, args.timeout, args.retry_failed,
+                             cache_dir=args.cache_dir, cache_max_bytes=int(args.cache_size * 1024 ** 2), profile=args.profile,
+                             bar_major=not args.staff_major, note_name=not args.note_number,
+                             tokenize_chord_symbols=not args.no_chord_symbols, engine=args.engine, chord_engine=args.chord_engine,
+                             low_memory=args.low_memory)
+    print(json.dumps(stats))
+    return 0 if stats['error'] == 0 and stats['timeout'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
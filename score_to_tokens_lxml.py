@@ -0,0 +1,349 @@
+from collections import deque
+from fractions import Fraction
+from lxml import etree
+
+from instrumentation import count, stage
+from score_to_tokens import ChordSymbolTracker, beams_to_token, clef_to_token, harmony_to_tokens, key_to_token, open_MusicXML, pitch_to_token, step_to_note_number, time_to_token, variants_from_bars
+
+# streaming counterpart of score_to_tokens: reads <measure> elements with lxml.etree.iterparse,
+# emits the same ST+ tokens and frees each measure once it has been consumed
+
+# [aux func] first descendant with the given name (same as `tag.name` in BeautifulSoup)
+def first(element, name):
+    return next(element.iter(name), None)
+
+def staff_of(element):
+    staff = first(element, 'staff')
+    return int(staff.text) if staff is not None else None
+
+def voice_of(element, note_voices):
+    if element in note_voices:
+        return note_voices[element]
+    voice = first(element, 'voice')
+    return voice.text if voice is not None else None
+
+def attributes_to_tokens(attributes, staff=None): # tokenize 'attributes' section in MusicXML
+    tokens = []
+    divisions = None
+
+    for child in attributes:
+        type_ = child.tag
+        if type_ == 'divisions':
+            divisions = int(child.text)
+        elif type_ in ('clef', 'key', 'time'):
+            if staff is not None:
+                if child.get('number') is not None and int(child.get('number')) != staff:
+                    continue
+            tokens.append(attribute_to_token(child))
+
+    return tokens, divisions
+
+def attribute_to_token(child): # clef, key signature, and time signature
+    type_ = child.tag
+
+    if type_ == 'clef':
+        return clef_to_token(first(child, 'sign').text)
+    elif type_ == 'key':
+        return key_to_token(int(first(child, 'fifths').text))
+    elif type_ == 'time':
+        return time_to_token([int(c.text) for c in child if isinstance(c.tag, str)]) # excluding comments
+
+def pitch_to_values(pitch): # (step, octave, alter)
+    alter = first(pitch, 'alter')
+    return first(pitch, 'step').text, first(pitch, 'octave').text, alter.text if alter is not None else None
+
+def aggregate_notes(voice_notes, note_indices, chord_pitches, aggregated): # notes to chord (recorded in side tables)
+    measure_notes = list(note_indices)
+    for note in voice_notes[1:]:
+        if first(note, 'chord') is not None:
+            index = note_indices[note] - 1
+            while index >= 0 and measure_notes[index] in aggregated:
+                index -= 1
+            if index >= 0:
+                chord_pitches.setdefault(measure_notes[index], []).insert(0, first(note, 'pitch'))
+            aggregated.add(note)
+
+def note_to_tokens(note, divisions=8, note_name=False, chord_pitches=()): # notes and rests
+    duration = first(note, 'duration')
+    if duration is None: # gracenote
+        return []
+
+    duration_in_fraction = str(Fraction(int(duration.text), divisions))
+
+    if first(note, 'rest') is not None:
+        return ['rest', f'len_{duration_in_fraction}'] # for rests
+
+    tokens = []
+
+    pitches = [pitch_to_values(p) for p in chord_pitches] + [pitch_to_values(p) for p in note.iter('pitch')]
+    for step, octave, alter in sorted(pitches, key=lambda x: step_to_note_number(*x)):
+        tokens.append(pitch_to_token(step, octave, alter, note_name))
+
+    # len
+    tokens.append(f'len_{duration_in_fraction}')
+
+    stem = first(note, 'stem')
+    if stem is not None and stem.text != 'none':
+        tokens.append(f'stem_{stem.text}')
+
+    beams = [b.text for b in note.iter('beam')]
+    if beams:
+        tokens.append(beams_to_token(beams))
+
+    tied = first(note, 'tied')
+    if tied is not None:
+        tokens.append('tie_' + tied.attrib['type'])
+
+    # articulations
+    if first(note, 'notations') is not None:
+        for articulation in ('staccato', 'accent', 'tenuto'):
+            if first(note, articulation) is not None:
+                tokens.append(articulation)
+
+    # slur
+    slur = first(note, 'slur')
+    if slur is not None:
+        if slur.attrib['type'] == 'start':
+            tokens.append('slur_start')
+        if slur.attrib['type'] == 'stop':
+            tokens.append('slur_stop')
+
+    return tokens
+
+def element_segmentation(elements, note_voices, staff=None): # divide elements into three sections
+    starts, ends = {}, {}
+    voice_starts, voice_ends = {}, {}
+    position, last_duration = 0, 0 # a <chord/> note before any other (not valid MusicXML) is not rewound
+    voice = last_voice = None # notes without <voice> before any other
+    for element in elements:
+        if element.tag == 'note':
+            duration = first(element, 'duration')
+            if duration is None: # gracenote
+                continue
+
+            voice_ = voice_of(element, note_voices)
+            if voice_ is not None:
+                voice = voice_
+                last_voice = voice
+            elif first(element, 'chord') is not None:
+                voice = last_voice
+
+            duration = int(duration.text)
+            if first(element, 'chord') is not None: # rewind for concurrent notes
+                position -= last_duration
+
+            in_staff = staff_of(element) in (None, staff)
+            if in_staff:
+                voice_starts[voice] = min(voice_starts[voice], position) if voice in voice_starts else position
+                starts[element] = position
+
+            position += duration
+
+            if in_staff:
+                voice_ends[voice] = max(voice_ends[voice], position) if voice in voice_ends else position
+                ends[element] = position
+
+            last_duration = duration
+        elif element.tag == 'backup':
+            position -= int(first(element, 'duration').text)
+        elif element.tag == 'forward':
+            position += int(first(element, 'duration').text)
+        else: # other types
+            starts[element] = position
+            ends[element] = position
+
+    # voice section
+    voice_start = sorted(voice_starts.values())[1] if voice_starts else 0
+    voice_end = sorted(voice_ends.values(), reverse=True)[1] if voice_ends else 0
+
+    pre_voice_elements, post_voice_elements, voice_elements = [], [], []
+    for element in elements:
+        if element.tag in ('backup', 'forward'):
+            continue
+        if element.tag == 'note' and first(element, 'duration') is None: # gracenote
+            continue
+        if staff is not None:
+            if staff_of(element) not in (None, staff):
+                continue
+
+        if voice_starts or voice_ends:
+            if ends[element] <= voice_start:
+                pre_voice_elements.append(element)
+            elif voice_end <= starts[element]:
+                post_voice_elements.append(element)
+            else:
+                voice_elements.append(element)
+        else:
+            pre_voice_elements.append(element)
+
+    return pre_voice_elements, voice_elements, post_voice_elements
+
+def measure_to_tokens(measure, divisions, staff=None, note_name=False):
+    tokens = []
+
+    note_indices = {n: i for i, n in enumerate(measure.iter('note'))}
+    if staff is not None:
+        notes = [n for n in note_indices if staff_of(n) == staff]
+    else:
+        notes = list(note_indices)
+
+    # voices of notes, including unvoiced notes of a chord
+    note_voices = {}
+    last_voice = None
+    for note in notes:
+        voice = first(note, 'voice')
+        if voice is not None:
+            last_voice = voice.text
+            note_voices[note] = voice.text
+        elif first(note, 'chord') is not None:
+            note_voices[note] = str(last_voice)
+
+    chord_pitches, aggregated = {}, set()
+    voices = list(dict.fromkeys([note_voices[n] for n in notes if n in note_voices])) # in order of appearance
+    for voice in voices:
+        voice_notes = [n for n in notes if note_voices.get(n) == voice]
+        aggregate_notes(voice_notes, note_indices, chord_pitches, aggregated)
+    count('notes', len(notes) - len(aggregated))
+    count('chords', len(chord_pitches))
+
+    elements = [e for e in measure if isinstance(e.tag, str) and e not in aggregated] # excluding comments
+
+    def element_to_tokens(element):
+        nonlocal divisions
+        if element.tag == 'attributes':
+            attr_tokens, div = attributes_to_tokens(element, staff)
+            divisions = div or divisions
+            return attr_tokens
+        elif element.tag == 'note':
+            return note_to_tokens(element, divisions, note_name, chord_pitches.get(element, ()))
+        return []
+
+    if len(voices) > 1:
+        count('multi_voice_measures')
+        with stage('element_segmentation'):
+            pre_voice_elements, voice_elements, post_voice_elements = element_segmentation(elements, note_voices, staff)
+
+        for element in pre_voice_elements:
+            tokens += element_to_tokens(element)
+
+        if voice_elements:
+            for voice in voices:
+                tokens.append('<voice>')
+                for element in voice_elements:
+                    element_voice = voice_of(element, note_voices)
+                    if element_voice == voice or (element_voice is None and voice == '1'):
+                        tokens += element_to_tokens(element)
+                tokens.append('</voice>')
+
+        for element in post_voice_elements:
+            tokens += element_to_tokens(element)
+    else:
+        for element in elements:
+            if staff is not None:
+                if element.tag in ('attributes', 'note') and staff_of(element) not in (None, staff):
+                    continue
+            tokens += element_to_tokens(element)
+
+    return tokens
+
+def measure_to_chord_events(measure): # events of a measure for ChordSymbolTracker
+    events = []
+    for element in measure:
+        if element.tag == 'attributes':
+            divisions, staves, time = element.find('divisions'), element.find('staves'), element.find('time')
+            if divisions is not None:
+                events.append(('divisions', int(divisions.text)))
+            if staves is not None:
+                events.append(('staves', int(staves.text)))
+            if time is not None and time.find('beats') is not None:
+                events.append(('time', (int(time.find('beats').text), int(time.find('beat-type').text))))
+        elif element.tag == 'note':
+            duration = element.find('duration')
+            if duration is not None and element.find('grace') is None:
+                events.append(('note', int(duration.text), element.find('chord') is not None, staff_of(element)))
+        elif element.tag in ('backup', 'forward'):
+            events.append((element.tag, int(element.find('duration').text)))
+        elif element.tag == 'harmony':
+            offset = element.find('offset')
+            events.append(('harmony', int(offset.text) if offset is not None else 0, harmony_to_tokens(element, element.findall('degree')), staff_of(element)))
+    return events
+
+def iter_MusicXML_measures(source): # yield (number of parts, part index, measure)
+    n_parts = 0
+    part, part_index = None, -1
+    with open_MusicXML(source) as f:
+        for _, element in etree.iterparse(f, events=('end',), tag=('score-part', 'measure')):
+            if element.tag == 'score-part':
+                n_parts += 1
+                continue
+
+            if element.getparent() is not part:
+                part = element.getparent()
+                part_index += 1
+
+            yield n_parts, part_index, element
+
+            # free the consumed measure
+            element.clear()
+            while element.getprevious() is not None:
+                del part[0]
+
+def iter_bar_token_variants(source, note_names=(True,), chord_tracker=None): # yield {note_name: (R, L)} of each bar
+    divisions = None
+    R_bars = deque()
+
+    for n_parts, part_index, measure in iter_MusicXML_measures(source):
+        assert n_parts in (1, 2) and part_index < n_parts
+
+        if divisions is None:
+            divisions_ = first(measure, 'divisions')
+            divisions = int(divisions_.text) if divisions_ is not None else None
+
+        if chord_tracker is not None:
+            if part_index == chord_tracker.n_parts:
+                chord_tracker.new_part()
+            chord_tracker.add_measure(measure_to_chord_events(measure))
+
+        if n_parts == 1:
+            count('measures')
+            yield {n: (measure_to_tokens(measure, divisions, 1, n), measure_to_tokens(measure, divisions, 2, n)) for n in note_names}
+        elif part_index == 0:
+            R_bars.append({n: measure_to_tokens(measure, divisions, None, n) for n in note_names})
+        else:
+            assert R_bars
+            R = R_bars.popleft()
+            count('measures')
+            yield {n: (R[n], measure_to_tokens(measure, divisions, None, n)) for n in note_names}
+
+    assert not R_bars
+
+def iter_bar_tokens(source, note_name=True, chord_tracker=None): # yield (R, L) tokens of each bar
+    for bar in iter_bar_token_variants(source, (note_name,), chord_tracker):
+        yield bar[note_name]
+
+def MusicXML_to_token_variants(mxml_path, variants, chord_engine='music21'): # variants: normalized option dicts (see score_to_tokens)
+    tokenize_chord_symbols = any(v['tokenize_chord_symbols'] for v in variants)
+    chord_tracker = ChordSymbolTracker() if tokenize_chord_symbols and chord_engine == 'musicxml' else None
+    note_names = list(dict.fromkeys(v['note_name'] for v in variants))
+    with stage('tokenize_bars'): # parsing included, since measures are read while tokenizing
+        bar_variants = list(iter_bar_token_variants(mxml_path, note_names, chord_tracker))
+    bars = {note_name: [bar[note_name] for bar in bar_variants] for note_name in note_names}
+
+    chords = None
+    if tokenize_chord_symbols:
+        if chord_tracker is not None: # collected while streaming
+            chords = chord_tracker.tokens()
+        else:
+            from score_to_tokens import get_chord_tokens, parse_with_music21
+            with stage('parse_with_music21'):
+                s = parse_with_music21(mxml_path)
+            with stage('get_chord_tokens'):
+                chords = get_chord_tokens(s)
+            del s # not needed to arrange the tokens
+
+    with stage('bars_to_tokens'):
+        return variants_from_bars(variants, bars, chords)
+
+def MusicXML_to_tokens(mxml_path, bar_major=True, note_name=True, tokenize_chord_symbols=True, chord_engine='music21'):
+    variant = {'bar_major': bar_major, 'note_name': note_name, 'tokenize_chord_symbols': tokenize_chord_symbols}
+    return MusicXML_to_token_variants(mxml_path, [variant], chord_engine)[0]
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+
+# long-running tokenization service: worker processes import music21, bs4 and the tokenizers once, and then serve
+# JSON-lines requests read from stdin (answers on stdout) or from a local socket, one request per line:
+#
+#   {"id": 1, "op": "tokenize-file", "path": "score.musicxml", "options": {"note_name": false}}
+#   {"id": 2, "op": "tokenize-bytes", "data": "<base64 of a MusicXML or .mxl file>"}
+#   {"id": 3, "op": "detokenize-tokens", "tokens": ["bar", ...], "writer": "musicxml"}
+#
+# answers come in completion order, with the id of their request:
+#
+#   {"id": 1, "op": "tokenize-file", "status": "ok", "tokens": [...], "seconds": 0.41, "peak_memory": 187416576, "latency": 0.43}
+#
+# status is 'ok', 'error' (with "error") or 'timeout'; seconds: time in the worker, peak_memory: peak resident set size
+# of the worker while handling the request, in bytes; latency: from reading the request to writing its answer;
+# "profile": true adds the stage durations and counters of instrumentation;
+# at most max_pending requests are in progress: beyond that, no more input is read until one of them is answered;
+# a worker that dies (killed for memory, crashed) fails the requests in progress with an error, and the pool is restarted
+
+OPERATIONS = ('tokenize-file', 'tokenize-bytes', 'detokenize-tokens')
+MAX_LINE = 256 * 1024 ** 2 # longest request in bytes (MusicXML files sent as base64)
+WARM_MODULES = ('score_to_tokens', 'tokens_to_musicxml', 'tokens_to_score', 'music21.musicxml.m21ToXml')
+OPTIONAL_WARM_MODULES = ('pretty_midi', 'tokens_to_midi')
+
+def warm_up(): # worker initializer: the import cost is paid once per worker
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    for name in OPTIONAL_WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError: # pretty_midi not installed
+            pass
+
+def run(request, options): # -> answer fields
+    from instrumentation import instrument
+    op = request.get('op')
+    if op not in OPERATIONS:
+        raise ValueError(f'unknown op: {op}')
+    with instrument() if request.get('profile') else nullcontext() as recorder:
+        if op in ('tokenize-file', 'tokenize-bytes'):
+            from score_to_tokens import MusicXML_to_tokens
+            source = request['path'] if op == 'tokenize-file' else base64.b64decode(request['data'])
+            answer = {'tokens': MusicXML_to_tokens(source, **dict(options, **request.get('options', {})))}
+        else: # detokenize-tokens
+            writer = request.get('writer', 'music21')
+            if writer == 'music21':
+                from music21.musicxml.m21ToXml import GeneralObjectExporter
+                from tokens_to_score import tokens_to_score
+                musicxml = GeneralObjectExporter(tokens_to_score(request['tokens'])).parse().decode('utf-8')
+            elif writer == 'musicxml':
+                from tokens_to_musicxml import tokens_to_MusicXML
+                musicxml = tokens_to_MusicXML(request['tokens'])
+            else:
+                raise ValueError(f'unknown writer: {writer}')
+            answer = {'musicxml': musicxml}
+    if recorder is not None:
+        answer['profile'] = recorder.to_dict()
+    return answer
+
+def handle(request, options, timeout): # worker: never raises
+    from instrumentation import peak_memory, reset_peak_memory
+    from score_to_tokens import FileTimeout, raise_timeout
+    start = time.perf_counter()
+    reset_peak_memory()
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        answer = dict(status='ok', **run(request, options))
+    except FileTimeout:
+        answer = {'status': 'timeout'}
+    except Exception as e:
+        answer = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    answer['seconds'] = round(time.perf_counter() - start, 3)
+    answer['peak_memory'] = peak_memory()
+    return answer
+
+class Service:
+    def __init__(self, workers=1, max_pending=None, timeout=None, **options):
+        # options are passed to MusicXML_to_tokens, under those of each request
+        self.workers = workers
+        self.pool = self.start_pool()
+        self.slots = asyncio.Semaphore(max_pending or 2 * workers)
+        self.timeout, self.options = timeout, options
+        self.stats = {'requests': 0, 'ok': 0, 'error': 0, 'timeout': 0, 'restarts': 0}
+
+    def start_pool(self):
+        pool = ProcessPoolExecutor(self.workers, initializer=warm_up)
+        pool.submit(int) # start the workers (and their imports) before the first request
+        return pool
+
+    def restart_pool(self, broken): # once per broken pool, whichever of its requests notices first
+        if self.pool is broken:
+            self.pool = self.start_pool()
+            self.stats['restarts'] += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def answer(self, line, received, write):
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('a request is a JSON object')
+            except ValueError as e:
+                request, answer = {}, {'status': 'error', 'error': f'bad request: {e}'}
+            else:
+                pool = self.pool
+                try:
+                    answer = await asyncio.get_running_loop().run_in_executor(pool, handle, request, self.options, self.timeout)
+                except BrokenProcessPool as e: # a worker died: this request (or another in progress) killed it
+                    answer = {'status': 'error', 'error': f'worker lost: {type(e).__name__}: {e}'}
+                    self.restart_pool(pool)
+                except Exception as e:
+                    answer = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+            answer = dict(id=request.get('id'), op=request.get('op'), **answer)
+            answer['latency'] = round(time.perf_counter() - received, 3)
+            self.stats['requests'] += 1
+            self.stats[answer['status']] += 1
+            await write((json.dumps(answer) + '\n').encode('utf-8'))
+        except ConnectionError: # the client has gone
+            pass
+        finally:
+            self.slots.release()
+
+    async def serve_lines(self, readline, write): # until readline gives b'' (end of input)
+        tasks = set()
+        while True:
+            await self.slots.acquire() # backpressure: the next request is read once a slot is free
+            line = await readline()
+            if not line:
+                self.slots.release()
+                break
+            if not line.strip():
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self.answer(line, time.perf_counter(), write))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+
+        async def write(data): # answers are small next to the work behind them
+            stdout.write(data)
+            stdout.flush()
+        await self.serve_lines(lambda: loop.run_in_executor(None, stdin.readline), write)
+
+    async def serve_connection(self, reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+        try:
+            await self.serve_lines(reader.readline, write)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e: # ValueError: a line longer than MAX_LINE
+            print(f'connection closed: {type(e).__name__}: {e}', file=sys.stderr)
+        finally:
+            writer.close()
+
+    async def serve_socket(self, path=None, port=None): # a Unix socket at path, or 127.0.0.1:port
+        if path is not None:
+            server = await asyncio.start_unix_server(self.serve_connection, path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self.serve_connection, '127.0.0.1', port, limit=MAX_LINE)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve tokenization and detokenization requests (JSON lines) with warm worker processes.')
+    parser.add_argument('--socket', default=None, help='listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--port', type=int, default=None, help='listen on 127.0.0.1:PORT instead of stdin/stdout')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--max-pending', type=int, default=None, help='requests in progress before input is paused (default: 2 per worker)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per request')
+    parser.add_argument('--staff-major', action='store_true', help='staff-major instead of bar-major tokens')
+    parser.add_argument('--note-number', action='store_true', help='note numbers instead of note names')
+    parser.add_argument('--no-chord-symbols', action='store_true', help='do not tokenize chord symbols')
+    parser.add_argument('--engine', default='bs4', choices=['bs4', 'lxml'])
+    parser.add_argument('--chord-engine', default='music21', choices=['music21', 'musicxml'])
+    parser.add_argument('--low-memory', action='store_true', help='release measures once tokenized and the tree before music21 parses a score')
+    args = parser.parse_args(argv)
+
+    async def serve():
+        service = Service(args.workers, args.max_pending, args.timeout,
+                          bar_major=not args.staff_major, note_name=not args.note_number,
+                          tokenize_chord_symbols=not args.no_chord_symbols, engine=args.engine, chord_engine=args.chord_engine,
+                          low_memory=args.low_memory)
+        try:
+            if args.socket is not None or args.port is not None:
+                await service.serve_socket(args.socket, args.port)
+            else:
+                await service.serve_stdio()
+        finally:
+            service.close()
+            print(json.dumps(service.stats), file=sys.stderr)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import numpy as np
+from math import lcm
+from xml.etree import ElementTree as ET
+
+from tokens_to_musicxml import MUSICXML_DECLARATION, StaffWriter, part_measure, score_element, tokens_to_divisions
+from tokens_to_score import PartStaffBuilder, common, concatenated_to_regular, group_related_tokens, insert_attrs, split_header_R_L
+from vocabulary import LEN_DENOMINATORS
+
+# incremental detokenizer for ST+ tokens streamed by a model: tokens are fed in chunks of any size, and each bar
+# is turned into measures (music21 objects or MusicXML fragments) as soon as the next 'bar' token closes it;
+# the key, open slurs, accidentals and voice numbering are carried over, so earlier tokens are never processed again;
+# MusicXML fragments that start a slur are held back until it stops (or the sequence ends, which drops its start),
+# so that the fragments are those of tokens_to_MusicXML
+
+DIVISIONS = lcm(*LEN_DENOMINATORS) # initial divisions of output='musicxml', refined by later bars if needed
+
+class StreamingDetokenizer:
+    def __init__(self, output='music21', voice_numbering=False, vocabulary=None):
+        if output not in ('music21', 'musicxml'):
+            raise ValueError(f'unknown output: {output}')
+        self.output, self.voice_numbering, self.vocabulary = output, voice_numbering, vocabulary
+        self.header = [] # tokens before the first bar
+        self.bar = None # tokens of the bar that is still open
+        self.n_bars = 0
+        self.held = [] # <measure> elements of output='musicxml' under a slur that is still open
+
+        if output == 'music21':
+            # with voice_numbering, the voices of L follow the most voices R has had so far
+            # (tokens_to_score looks ahead at every bar of R instead)
+            self.R = PartStaffBuilder(start_voice=1 if voice_numbering else 0, slur_number=1)
+            self.L = PartStaffBuilder(start_voice=2 if voice_numbering else 0, slur_number=2)
+            from accidentals import AccidentalState
+            self.R_accidentals, self.L_accidentals = AccidentalState(), AccidentalState()
+        else:
+            self.divisions = DIVISIONS
+            self.R = StaffWriter(1, 1, DIVISIONS, slur_number=1)
+            self.L = StaffWriter(2, 5, DIVISIONS, slur_number=2)
+
+    def decode(self, tokens): # token, space-joined str, list of tokens, or token IDs (int or integer array) -> list of tokens
+        if isinstance(tokens, str):
+            return tokens.split()
+        if isinstance(tokens, int) or (hasattr(tokens, 'dtype') and tokens.dtype.kind in 'iu'):
+            if self.vocabulary is None:
+                from vocabulary import default_vocabulary
+                self.vocabulary = default_vocabulary()
+            return self.vocabulary.decode(np.atleast_1d(tokens))
+        return list(tokens)
+
+    def feed(self, tokens): # -> list of bars completed by these tokens
+        bars = []
+        for t in self.decode(tokens):
+            if t == 'bar':
+                if self.bar is not None:
+                    bars += self.complete(self.bar)
+                self.bar = []
+            elif self.bar is None:
+                self.header.append(t)
+                continue
+            self.bar.append(t)
+        return bars
+
+    push = feed
+
+    def close(self): # end of the sequence: the last bar is completed -> list of bars
+        bars = []
+        if self.bar is not None:
+            bars += self.complete(self.bar, last=True)
+            self.bar = None
+        return bars
+
+    def complete(self, tokens, last=False): # -> bars that can be returned once this bar is done
+        measures = self.bar_to_measures(tokens, last)
+        if self.output == 'music21': # a music21 Slur is only added where it stops
+            return [measures]
+        self.held.append(measures)
+        if not last and any(writer.slur_open and writer.slur_notes for writer in (self.R, self.L)):
+            return [] # its start is written in a held measure, to be dropped if it is never stopped
+        held, self.held = self.held, []
+        return [measure_fragment(measure) for measure in held]
+
+    def bar_to_measures(self, tokens, last=False): # ST+ bar -> (R, L) music21 Measures or a MusicXML <measure> element
+        header, R, L = split_header_R_L(' '.join(tokens[1:]))
+        attrs = common(header) # as to_ST
+        R_tokens = ['bar'] + insert_attrs(R, attrs).split()
+        L_tokens = ['bar'] + insert_attrs(L, attrs).split()
+        self.n_bars += 1
+
+        if self.output == 'music21':
+            from music21 import bar
+            r = self.R.bar_to_measure(group_related_tokens(concatenated_to_regular(R_tokens)))
+            if self.voice_numbering:
+                self.L.start_voice = max(self.L.start_voice, len(r.voices) + 1)
+            l = self.L.bar_to_measure(group_related_tokens(concatenated_to_regular(L_tokens)))
+            for m, accidentals in ((r, self.R_accidentals), (l, self.L_accidentals)):
+                accidentals.apply(m)
+                m.number = self.n_bars
+                if last:
+                    m.rightBarline = bar.Barline('regular')
+            return r, l
+
+        divisions = lcm(self.divisions, tokens_to_divisions(R_tokens + L_tokens)) # the lengths of later bars are not known in advance
+        self.R.divisions = self.L.divisions = divisions
+        self.R.write(R_tokens)
+        self.L.write(L_tokens)
+        if last: # a slur that is never stopped is dropped, as in tokens_to_MusicXML
+            self.R.close()
+            self.L.close()
+        measure = part_measure(self.n_bars, self.R.measures.pop(), self.L.measures.pop(), divisions, first=self.n_bars == 1, last=last)
+        if divisions != self.divisions and self.n_bars > 1: # finer divisions from this measure on
+            attributes = ET.Element('attributes')
+            ET.SubElement(attributes, 'divisions').text = str(divisions)
+            measure.insert(0, attributes)
+        self.divisions = divisions
+        return measure
+
+    def MusicXML_header(self): # text before the first fragment of output='musicxml'
+        score, _ = score_element()
+        ET.indent(score)
+        text = ET.tostring(score, encoding='unicode')
+        return MUSICXML_DECLARATION + text[:text.rindex('<part ')] + '<part id="P1">\n'
+
+    def MusicXML_footer(self): # text after the last fragment
+        return '\n  </part>\n</score-partwise>\n'
+
+def measure_fragment(measure): # <measure> element -> text of a fragment, indented as in the document
+    ET.indent(measure, level=2)
+    return '    ' + ET.tostring(measure, encoding='unicode')
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+from music21 import stream
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from accidentals import make_part_accidentals
+from score_to_tokens import MusicXML_to_tokens
+from test_engine_parity import FIXTURES, fixture_source
+from tokens_to_score import PartStaffBuilder, concatenated_to_regular, group_related_tokens, split_bars, split_header_R_L, to_ST
+
+# the accidental display of accidentals.py must be that of music21's makeAccidentals pass (as tokens_to_PartStaff
+# made it before), for the staves of the fixtures of test_engine_parity: the same measures are built twice,
+# and the accidental name and display status of every pitch are compared
+
+def staff_tokens(name, note_name, staff):
+    tokens = MusicXML_to_tokens(fixture_source(name), note_name=note_name)
+    _, R, L = split_header_R_L(to_ST(' '.join(tokens)))
+    return (R if staff == 'R' else L).split()
+
+def build_PartStaff(tokens): # measures of tokens_to_PartStaff, before the accidentals
+    builder = PartStaffBuilder(start_voice=0)
+    p = stream.PartStaff()
+    for bar_tokens in split_bars(group_related_tokens(concatenated_to_regular(tokens))):
+        p.append(builder.bar_to_measure(bar_tokens))
+    return p
+
+def accidentals(p): # (pitch, accidental, display status) of every pitch, measure by measure
+    return [[(x.nameWithOctave, x.accidental.name if x.accidental else None, x.accidental.displayStatus if x.accidental else None)
+             for n in m.recurse().notes for x in n.pitches] for m in p.getElementsByClass(stream.Measure)]
+
+@pytest.mark.parametrize('staff', ('R', 'L'))
+@pytest.mark.parametrize('note_name', (True, False), ids=('note_name', 'note_number'))
+@pytest.mark.parametrize('name', FIXTURES)
+def test_accidentals_parity(name, note_name, staff):
+    tokens = staff_tokens(name, note_name, staff)
+    engine, reference = build_PartStaff(tokens), build_PartStaff(tokens)
+    make_part_accidentals(engine.getElementsByClass(stream.Measure))
+    reference.makeAccidentals(cautionaryNotImmediateRepeat=False, overrideStatus=True, inPlace=True)
+    expected = accidentals(reference)
+    assert any(expected) # a staff without notes would prove nothing
+    assert accidentals(engine) == expected
@@ -0,0 +1,52 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_MusicXML
+from score_to_tokens import MusicXML_to_tokens
+
+# the lxml engine (and the musicxml chord engine, and low_memory) must give the tokens of the bs4 engine with
+# music21 chord symbols, for every tokenization option; fixtures are small scores of the music21 corpus
+# (.mxl and .xml, one part of two staves or two parts, with and without chord symbols) and synthetic scores
+#
+#   python -m pytest tests/
+
+CORPUS_WORKS = ('leadSheet/fosterBrownHair', 'schoenberg/opus19/movement2', 'demos/two-parts',
+                'mozart/k545/movement1_exposition', 'demos/ComprehensiveChordSymbolsTestFile')
+SYNTHETIC = {'synthetic-1-part': dict(bars=8, voices=2, parts=1, chord_symbols=2.0, seed=1),
+             'synthetic-2-parts': dict(bars=8, voices=3, parts=2, chord_symbols=1.0, seed=2)}
+OPTIONS = [dict(zip(('bar_major', 'note_name', 'tokenize_chord_symbols'), values))
+           for values in itertools.product((True, False), repeat=3)]
+ENGINES = {'lxml': dict(engine='lxml'),
+           'lxml-musicxml-chords': dict(engine='lxml', chord_engine='musicxml'),
+           'bs4-musicxml-chords': dict(engine='bs4', chord_engine='musicxml'),
+           'bs4-low-memory': dict(engine='bs4', low_memory=True)}
+REFERENCE = dict(engine='bs4', chord_engine='music21')
+
+def fixture_source(name):
+    if name in SYNTHETIC:
+        return synthetic_MusicXML(**SYNTHETIC[name])
+    from music21 import corpus
+    return str(corpus.getWork(name))
+
+FIXTURES = list(CORPUS_WORKS) + list(SYNTHETIC)
+references = {}
+
+def reference_tokens(name, option_index):
+    key = (name, option_index)
+    if key not in references:
+        references[key] = MusicXML_to_tokens(fixture_source(name), **OPTIONS[option_index], **REFERENCE)
+    return references[key]
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('option_index', range(len(OPTIONS)), ids=lambda i: '-'.join(f'{k}={v}' for k, v in OPTIONS[i].items()))
+@pytest.mark.parametrize('name', FIXTURES)
+def test_engine_parity(name, option_index, engine):
+    tokens = MusicXML_to_tokens(fixture_source(name), **OPTIONS[option_index], **ENGINES[engine])
+    reference = reference_tokens(name, option_index)
+    assert reference # a fixture that tokenizes to nothing would prove nothing
+    assert tokens == reference
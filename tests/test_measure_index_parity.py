@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from measure_index import build_measure_index, tokenize_bars
+from score_to_tokens import MusicXML_to_tokens
+from test_engine_parity import FIXTURES, OPTIONS, fixture_source
+
+# the tokens of a range of bars read through the measure index must be the slice of the full tokenization
+# (bs4 engine, music21 chord symbols) for these bars, for the fixtures and options of test_engine_parity;
+# staff-major tokens are compared for the whole score; indexes are built in memory, not saved next to the fixtures
+
+RANGES = {'all': lambda n: (0, None), 'first': lambda n: (0, 1), 'last': lambda n: (n - 1, n),
+          'inner': lambda n: (1, max(n - 1, 2)), 'second-half': lambda n: (n // 2, None)}
+indexes = {}
+
+def fixture_index(name):
+    if name not in indexes:
+        indexes[name] = build_measure_index(fixture_source(name))
+    return indexes[name]
+
+def bar_slice(tokens, start, stop): # tokens of bars start..stop-1 of a bar-major sequence
+    positions = [i for i, t in enumerate(tokens) if t == 'bar'] + [len(tokens)]
+    bars = [tokens[a:b] for a, b in zip(positions, positions[1:])]
+    return [t for bar in bars[start:stop] for t in bar]
+
+BAR_MAJOR = [i for i, options in enumerate(OPTIONS) if options['bar_major']]
+STAFF_MAJOR = [i for i, options in enumerate(OPTIONS) if not options['bar_major']]
+
+def option_id(option_index):
+    return '-'.join(f'{k}={v}' for k, v in OPTIONS[option_index].items())
+
+@pytest.mark.parametrize('bars', RANGES)
+@pytest.mark.parametrize('option_index', BAR_MAJOR, ids=option_id)
+@pytest.mark.parametrize('name', FIXTURES)
+def test_measure_index_parity(name, option_index, bars):
+    options = OPTIONS[option_index]
+    full = MusicXML_to_tokens(fixture_source(name), **options)
+    start, stop = RANGES[bars](full.count('bar')) # with chord symbols, the last bar is left out of the full tokenization
+    expected = bar_slice(full, start, stop)
+    assert expected # a range that tokenizes to nothing would prove nothing
+    assert tokenize_bars(fixture_source(name), start, stop, fixture_index(name), **options) == expected
+
+@pytest.mark.parametrize('option_index', STAFF_MAJOR, ids=option_id)
+@pytest.mark.parametrize('name', FIXTURES)
+def test_measure_index_staff_major(name, option_index):
+    options = OPTIONS[option_index]
+    assert tokenize_bars(fixture_source(name), 0, None, fixture_index(name), **options) == MusicXML_to_tokens(fixture_source(name), **options)
@@ -0,0 +1,37 @@
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from score_to_tokens import MusicXML_to_tokens
+from test_engine_parity import FIXTURES, fixture_source
+from tokens_to_score import tokens_to_score
+
+# tokens_to_score in worker processes (one task per staff, or chunks of bars) must give the MusicXML of the serial
+# conversion, for the fixtures of test_engine_parity; the export date and the ids music21 draws from object ids are left out
+
+PARALLEL = {'staves': dict(workers=2), 'chunks-of-1': dict(workers=2, bars_per_chunk=1), 'chunks-of-4': dict(workers=3, bars_per_chunk=4)}
+references = {}
+
+def export(score):
+    from music21.musicxml.m21ToXml import GeneralObjectExporter
+    xml = GeneralObjectExporter(score).parse().decode('utf-8')
+    xml = re.sub(r'<encoding-date>.*?</encoding-date>', '', xml)
+    return re.sub(r' (id|idref)="[^"]*"', '', xml)
+
+def tokens_and_reference(name, voice_numbering):
+    key = (name, voice_numbering)
+    if key not in references:
+        tokens = MusicXML_to_tokens(fixture_source(name))
+        references[key] = tokens, export(tokens_to_score(tokens, voice_numbering=voice_numbering))
+    return references[key]
+
+@pytest.mark.parametrize('parallel', PARALLEL)
+@pytest.mark.parametrize('voice_numbering', (False, True))
+@pytest.mark.parametrize('name', FIXTURES)
+def test_parallel_parity(name, voice_numbering, parallel):
+    tokens, reference = tokens_and_reference(name, voice_numbering)
+    assert export(tokens_to_score(tokens, voice_numbering=voice_numbering, **PARALLEL[parallel])) == reference
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from score_to_tokens import MusicXML_to_tokens
+from test_engine_parity import FIXTURES, OPTIONS, fixture_source
+from tokens_to_musicxml import tokens_to_MusicXML
+from tokens_to_score import tokens_to_score
+
+# the MusicXML of tokens_to_MusicXML must tokenize again to the tokens of the music21 export (tokens_to_score),
+# for the fixtures and options of test_engine_parity; bar-major and staff-major tokens are given to the writers as they are
+
+# fixtures on which the music21 export loses what the writer keeps (xfail, strict: they pass once music21 catches up)
+MUSIC21_DIFFERENCES = {'schoenberg/opus19/movement2': 'music21 drops a slur across a clef change and adds rests to the voices',
+                       'synthetic-2-parts': 'music21 moves the rests of a third voice and adds a rest after the voices'}
+
+def music21_export(tokens):
+    from music21.musicxml.m21ToXml import GeneralObjectExporter
+    return GeneralObjectExporter(tokens_to_score(tokens)).parse()
+
+@pytest.mark.parametrize('option_index', range(len(OPTIONS)), ids=lambda i: '-'.join(f'{k}={v}' for k, v in OPTIONS[i].items()))
+@pytest.mark.parametrize('name', [pytest.param(name, marks=pytest.mark.xfail(reason=MUSIC21_DIFFERENCES[name], strict=True))
+                                  if name in MUSIC21_DIFFERENCES else name for name in FIXTURES])
+def test_writer_parity(name, option_index):
+    options = OPTIONS[option_index]
+    tokens = MusicXML_to_tokens(fixture_source(name), **options)
+    written = MusicXML_to_tokens(tokens_to_MusicXML(tokens).encode('utf-8'), **options)
+    exported = MusicXML_to_tokens(music21_export(tokens), **options)
+    assert exported # a score that exports to nothing would prove nothing
+    assert written == exported
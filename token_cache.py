@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: the usage file is not locked, so concurrent writers may exceed max_bytes
+    fcntl = None
+
+# on-disk cache of MusicXML_to_tokens results, keyed by the content of the score, the tokenization options
+# and TOKENIZER_VERSION; entries are evicted in least-recently-used order once the cache exceeds max_bytes;
+# the size of the cache is kept in a usage file shared (and locked) by every process writing to the directory,
+# so that max_bytes bounds the whole directory however many workers use it
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+USAGE_FILE = 'usage' # {"bytes": ..., "entries": ...} of the cache directory
+LOW_WATER = 0.9 # eviction goes down to this fraction of max_bytes, so that the directory is not scanned on every put
+TMP_GRACE = 600 # seconds after which a temporary file of put is taken for that of a dead writer, and removed on eviction
+
+class TokenCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir, self.max_bytes = cache_dir, max_bytes
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.usage_path = os.path.join(cache_dir, USAGE_FILE)
+
+    @contextmanager
+    def usage(self): # locked usage of the cache directory (counted from its entries if missing), written back on exit
+        fd = os.open(self.usage_path, os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+', encoding='utf-8') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX) # released when the file is closed
+            try:
+                usage = json.loads(f.read())
+            except ValueError: # new, or broken by a process killed while writing it
+                entries = self.scan()
+                usage = {'bytes': sum(size for _, _, size in entries), 'entries': len(entries)}
+            yield usage
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(usage))
+
+    def scan(self): # -> [(mtime, key, size)] of the entries, oldest first (modification time is updated on every hit)
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith('.json'):
+                    try:
+                        stat = os.stat(os.path.join(root, f))
+                    except OSError: # evicted meanwhile (a process without fcntl)
+                        continue
+                    entries.append((stat.st_mtime_ns, f[:-len('.json')], stat.st_size))
+        return sorted(entries)
+
+    def remove_stale_tmp(self): # temporary files of writers killed before replacing their entry (never counted in the usage)
+        deadline = time.time() - TMP_GRACE
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith('.tmp'):
+                    path = os.path.join(root, f)
+                    try:
+                        if os.path.getmtime(path) < deadline:
+                            os.remove(path)
+                    except OSError: # replaced or removed meanwhile
+                        pass
+
+    def keys(self, source, variants): # source: path or bytes; the content is hashed once for all variants
+        from score_to_tokens import TOKENIZER_VERSION
+        content = hashlib.sha256()
+        if isinstance(source, (bytes, bytearray)):
+            content.update(source)
+        else:
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    content.update(block)
+
+        keys = []
+        for options in variants:
+            h = content.copy()
+            h.update(json.dumps([TOKENIZER_VERSION, sorted(options.items())]).encode())
+            keys.append(h.hexdigest())
+        return keys
+
+    def key(self, source, options):
+        return self.keys(source, [options])[0]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                tokens = json.load(f)
+        except (OSError, ValueError): # missing, evicted by another process, or broken
+            return None
+        try:
+            os.utime(path) # most recently used
+        except OSError: # evicted by another process since it was read: still a hit
+            pass
+        return tokens
+
+    def put(self, key, tokens):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(tokens, f)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        with self.usage() as usage:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = None
+            os.replace(tmp_path, path) # atomic, so that concurrent readers never see a partial entry
+            usage['bytes'] += os.path.getsize(path) - (replaced or 0)
+            usage['entries'] += replaced is None
+            if usage['bytes'] > self.max_bytes:
+                self.evict(usage, key)
+
+    def evict(self, usage, keep): # oldest entries first, except keep (the entry just written); under the usage lock
+        self.remove_stale_tmp()
+        entries = self.scan() # the directory is the truth: other processes read and wrote entries meanwhile
+        size = sum(size for _, _, size in entries)
+        n = len(entries)
+        for _, key, entry_size in entries:
+            if size <= LOW_WATER * self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            size -= entry_size
+            n -= 1
+            self.evictions += 1
+        usage['bytes'], usage['entries'] = size, n
+
+    def MusicXML_to_token_variants(self, mxml_path, variants, engine='bs4', chord_engine='music21', low_memory=False):
+        from score_to_tokens import MusicXML_to_token_variants, is_path, normalize_variants
+        if not is_path(mxml_path) and not isinstance(mxml_path, (bytes, bytearray)): # file object
+            mxml_path = mxml_path.read()
+        variants = normalize_variants(variants)
+        keys = self.keys(mxml_path, [dict(v, chord_engine=chord_engine) for v in variants]) # engines emit the same tokens
+
+        results = [self.get(key) for key in keys]
+        missing = [i for i, tokens in enumerate(results) if tokens is None]
+        self.hits += len(results) - len(missing)
+        self.misses += len(missing)
+        if missing: # tokenized from one parse
+            computed = MusicXML_to_token_variants(mxml_path, [variants[i] for i in missing], engine, chord_engine, low_memory=low_memory)
+            for i, tokens in zip(missing, computed):
+                self.put(keys[i], tokens)
+                results[i] = tokens
+        return results
+
+    def MusicXML_to_tokens(self, mxml_path, bar_major=True, note_name=True, tokenize_chord_symbols=True, engine='bs4', chord_engine='music21',
+                           low_memory=False):
+        variant = {'bar_major': bar_major, 'note_name': note_name, 'tokenize_chord_symbols': tokenize_chord_symbols}
+        return self.MusicXML_to_token_variants(mxml_path, [variant], engine, chord_engine, low_memory)[0]
+
+    def stats(self): # hits, misses and evictions of this process; entries and bytes of the whole directory
+        lookups = self.hits + self.misses
+        with self.usage() as usage:
+            entries, size = usage['entries'], usage['bytes']
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions, 'entries': entries, 'bytes': size}
+
+    def clear(self):
+        with self.usage() as usage:
+            for _, key, _ in self.scan():
+                try:
+                    os.remove(self.path(key))
+                except OSError:
+                    pass
+            self.remove_stale_tmp() # recent ones may belong to a put in progress
+            usage['bytes'], usage['entries'] = 0, 0
+
+OPEN_CACHES = {}
+
+def open_cache(cache_dir, max_bytes=DEFAULT_MAX_BYTES): # one TokenCache per directory and process
+    if cache_dir not in OPEN_CACHES:
+        OPEN_CACHES[cache_dir] = TokenCache(cache_dir, max_bytes)
+    return OPEN_CACHES[cache_dir]
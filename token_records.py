@@ -0,0 +1,46 @@
+from fractions import Fraction
+from functools import lru_cache
+
+# interned parse of token strings, shared by the tokenizer and the detokenizers: each distinct token is split once
+# into a TokenRecord, so that hot loops look fields up instead of splitting the same strings again;
+# the table is bounded, as long-running processes (service.py) may be fed any number of distinct tokens
+
+MAX_RECORDS = 1 << 16 # far more than the distinct tokens of a vocabulary; least recently used records are dropped beyond
+
+class TokenRecord:
+    __slots__ = ('token', 'parts', 'family', 'value', 'fraction', 'length', 'stem', 'beams', 'regular')
+
+    def __init__(self, token):
+        parts = token.split('_')
+        self.token, self.parts = token, tuple(parts)
+        self.family = parts[0] # note, rest, len, stem, beam, tie, clef, key, time, chord, bass, slur, bar, ...
+        self.value = parts[1] if len(parts) > 1 else None # pitch, length, stem direction, tie type, ...
+        self.fraction, self.length = None, None
+        self.stem, self.beams = None, ()
+        self.regular = (token,) # tokens after concatenated_to_regular
+
+        if self.family in ('len', 'attr'): # length, optionally followed by stem and beams (concatenated tokens)
+            try:
+                self.fraction = Fraction(parts[1])
+                self.length = float(self.fraction)
+            except (IndexError, ValueError, ZeroDivisionError):
+                pass
+            if len(parts) >= 3:
+                self.stem = parts[2]
+            self.beams = tuple(parts[3:])
+            if len(parts) >= 2:
+                self.regular = (f'len_{parts[1]}',) + ((f'stem_{parts[2]}',) if len(parts) >= 3 else ()) + ((f'beam_{"_".join(parts[3:])}',) if len(parts) >= 4 else ())
+        elif self.family in ('stem', 'dir'):
+            self.stem = self.value
+        elif self.family == 'beam':
+            self.beams = self.parts[1:]
+
+    def __repr__(self):
+        return f'TokenRecord({self.token!r})'
+
+@lru_cache(maxsize=MAX_RECORDS)
+def token_record(token): # the same record for every occurrence of a token string (while it is in the table)
+    return TokenRecord(token)
+
+def token_records(tokens):
+    return [token_record(t) for t in tokens]
@@ -0,0 +1,191 @@
+import io
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from instrumentation import count, stage
+from token_records import token_record
+from tokens_to_musicxml import token_to_fifths, token_to_time
+
+# render ST+ tokens directly as MIDI with pretty_midi (imported on first use), without music21: one pass over the tokens
+# places every note at its onset in quarter notes, following the voices of each staff as tokens_to_MusicXML does,
+# and merges tied notes; bars start together in both hands, each bar lasting as long as its longer staff
+#
+#   pm = tokens_to_MIDI(tokens, qpm=100)             # pretty_midi.PrettyMIDI
+#   data = tokens_to_MIDI_bytes(tokens)              # standard MIDI file
+#   files = tokens_to_MIDI_batch(sequences, workers=4)
+
+STEP_TO_SEMITONE = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+ACCIDENTAL_TO_SEMITONES = {'': 0, '#': 1, '##': 2, 'b': -1, 'bb': -2}
+PITCH_NAME = re.compile(r'([A-G])(#{0,2}|b{0,2})(-?\d+)$')
+
+@lru_cache(maxsize=None)
+def pitch_to_note_number(pitch_): # value of a note token: note name (C#4) or note number (61)
+    if pitch_.isdecimal():
+        return int(pitch_)
+    step, accidental, octave = PITCH_NAME.match(pitch_).groups()
+    return 12 * (int(octave) + 1) + STEP_TO_SEMITONE[step] + ACCIDENTAL_TO_SEMITONES[accidental]
+
+class StaffTimeline: # positions of one staff within the current bar, with the voice rules of StaffWriter
+    def __init__(self, hand, notes):
+        self.hand, self.notes = hand, notes # notes: shared list of [start, end, note number, hand]
+        self.ties = {} # note number -> note whose tie is still open
+        self.new_bar(0)
+
+    def new_bar(self, bar_start):
+        self.bar_start, self.position, self.end = bar_start, 0, 0
+        self.voice_index, self.voice_start, self.first_voice_end = -1, None, None
+        self.voice_flag, self.after_voice = False, False
+
+    def place(self):
+        if self.after_voice and not self.voice_flag and self.first_voice_end is not None:
+            self.position = self.first_voice_end
+
+    def voice(self, token):
+        if token == '<voice>':
+            self.voice_index += 1
+            if self.voice_start is None:
+                self.voice_start = self.position
+            self.position = self.voice_start
+            self.voice_flag = True
+        elif self.voice_flag: # </voice>
+            if self.voice_index == 0:
+                self.first_voice_end = self.position
+            self.voice_flag, self.after_voice = False, True
+
+    def group(self, pitches, lengths, tie): # a note, chord or rest of one or more tied lengths
+        self.place()
+        length = sum(lengths)
+        start = self.bar_start + self.position
+        end = start + length
+        if len(lengths) > 1: # tied inside the group: the tie goes on only with a tie token
+            tie = 'continue' if tie else None
+        for pitch in pitches:
+            note = self.ties.pop(pitch, None) if tie in ('stop', 'continue') else None
+            if note is not None and note[1] == start: # continued
+                note[1] = end
+            else:
+                note = [start, end, pitch, self.hand]
+                self.notes.append(note)
+            if tie in ('start', 'continue'):
+                self.ties[pitch] = note
+        self.position += length
+        self.end = max(self.end, self.position)
+
+def tokens_to_timeline(tokens): # -> (notes [start, end, note number, hand (0: R, 1: L)], time signatures, key signatures)
+    # in quarter notes from the start; signatures: [(onset, (beats, beat_type))] and [(onset, fifths)] when they change
+    notes, time_signatures, key_signatures = [], [], []
+    staves = (StaffTimeline(0, notes), StaffTimeline(1, notes))
+    staff, bar_start, started = None, 0, False
+    pitches, lengths, tie, rest = [], [], None, False
+
+    def flush():
+        nonlocal pitches, lengths, tie, rest
+        if lengths and staff is not None:
+            staff.group([] if rest else pitches, lengths, tie)
+        pitches, lengths, tie, rest = [], [], None, False
+
+    for t in tokens:
+        for t in token_record(t).regular:
+            r = token_record(t)
+            family = r.family
+            if family in ('note', 'rest'):
+                if lengths: # the next group
+                    flush()
+                if family == 'rest':
+                    rest = True
+                else:
+                    pitches.append(pitch_to_note_number(r.value))
+            elif family == 'len':
+                lengths.append(r.fraction)
+            elif family == 'tie':
+                tie = tie or r.value
+            elif family in ('stem', 'beam', 'staccato', 'accent', 'tenuto'):
+                pass
+            else:
+                flush()
+                if t == 'bar':
+                    if started:
+                        bar_start += max(s.end for s in staves)
+                    started = True
+                    for s in staves:
+                        s.new_bar(bar_start)
+                    staff = None
+                    count('measures')
+                elif t in ('R', 'L'):
+                    staff = staves[t == 'L']
+                elif t in ('<voice>', '</voice>'):
+                    if staff is not None:
+                        staff.voice(t)
+                elif family == 'time' and staff is None:
+                    signature = tuple(int(x) for x in token_to_time(t))
+                    if not time_signatures or time_signatures[-1][1] != signature:
+                        time_signatures.append((bar_start, signature))
+                elif family == 'key' and staff is None:
+                    fifths = token_to_fifths(t)
+                    if key_signatures and key_signatures[-1][0] == bar_start: # key_natural_0 before the new key
+                        key_signatures.pop()
+                    if not key_signatures or key_signatures[-1][1] != fifths:
+                        key_signatures.append((bar_start, fifths))
+    flush()
+    return notes, time_signatures, key_signatures
+
+def to_token_list(string_or_list, vocabulary=None): # str, list of tokens or integer array of token IDs -> list of ST+ tokens
+    if hasattr(string_or_list, 'dtype') and string_or_list.dtype.kind in 'iu': # NumPy array of IDs
+        if vocabulary is None:
+            from vocabulary import default_vocabulary
+            vocabulary = default_vocabulary()
+        tokens = list(vocabulary.decode(string_or_list))
+    elif isinstance(string_or_list, str):
+        tokens = string_or_list.split()
+    else:
+        tokens = list(string_or_list)
+
+    if tokens and tokens[0] in ('C', 'R'): # staff-major ST
+        from tokens_to_score import ST_to_ST_plus
+        tokens = ST_to_ST_plus(tokens, vocabulary)
+    return tokens
+
+def tokens_to_MIDI(string_or_list, qpm=120, velocity=80, program=0, split_hands=False, vocabulary=None):
+    # -> pretty_midi.PrettyMIDI at a constant tempo of qpm quarter notes per minute;
+    # split_hands: one instrument per hand (R, L) instead of a single piano
+    import pretty_midi
+    with stage('tokens_to_timeline'):
+        notes, time_signatures, key_signatures = tokens_to_timeline(to_token_list(string_or_list, vocabulary))
+
+    with stage('build_MIDI'):
+        seconds = 60 / qpm # per quarter note
+        pm = pretty_midi.PrettyMIDI(initial_tempo=qpm)
+        names = ('R', 'L') if split_hands else ('Piano',)
+        instruments = [pretty_midi.Instrument(program, name=name) for name in names]
+        for start, end, pitch, hand in notes:
+            if end > start: # zero-length notes are not written
+                instruments[hand if split_hands else 0].notes.append(
+                    pretty_midi.Note(velocity, pitch, float(start * seconds), float(end * seconds)))
+        pm.instruments.extend(instruments)
+        pm.time_signature_changes = [pretty_midi.TimeSignature(beats, beat_type, float(onset * seconds))
+                                     for onset, (beats, beat_type) in time_signatures]
+        pm.key_signature_changes = [pretty_midi.KeySignature(fifths * 7 % 12, float(onset * seconds)) # major keys
+                                    for onset, fifths in key_signatures]
+    count('notes', len(notes))
+    return pm
+
+def tokens_to_MIDI_bytes(string_or_list, **options): # -> bytes of a standard MIDI file; options: as tokens_to_MIDI
+    f = io.BytesIO()
+    tokens_to_MIDI(string_or_list, **options).write(f)
+    return f.getvalue()
+
+def write_MIDI(string_or_list, path, **options):
+    tokens_to_MIDI(string_or_list, **options).write(path)
+
+def MIDI_bytes_worker(args):
+    string_or_list, options = args
+    return tokens_to_MIDI_bytes(string_or_list, **options)
+
+def tokens_to_MIDI_batch(sequences, workers=None, chunksize=16, **options): # -> list of MIDI file bytes, in order
+    # sequences are rendered in a pool of worker processes (in this process if workers is None or 1)
+    tasks = [(sequence, options) for sequence in sequences]
+    if workers is None or workers <= 1:
+        return [MIDI_bytes_worker(task) for task in tasks]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(MIDI_bytes_worker, tasks, chunksize=chunksize))
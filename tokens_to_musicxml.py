@@ -0,0 +1,361 @@
+from fractions import Fraction
+from functools import lru_cache
+from math import lcm
+from xml.etree import ElementTree as ET
+
+from instrumentation import stage
+from token_records import token_record, token_records
+from tokens_to_score import PITCH_CLASS_NAMES, concatenated_to_regular, group_related_tokens, split_header_R_L, to_ST
+
+# write ST+ tokens directly as MusicXML text, without building music21 objects
+# (covers the same features as tokens_to_PartStaff: voices, ties, beams, slurs, articulations, clef/key/time and pitch spelling)
+
+ACCIDENTAL_TO_ALTER = {'--': -2, '-': -1, '': 0, '#': 1, '##': 2}
+ALTER_TO_ACCIDENTAL = {-2: 'flat-flat', -1: 'flat', 0: 'natural', 1: 'sharp', 2: 'double-sharp'}
+SHARP_ORDER = 'FCGDAEB'
+
+TYPE_NAMES = {Fraction(8): 'breve', Fraction(4): 'whole', Fraction(2): 'half', Fraction(1): 'quarter', Fraction(1, 2): 'eighth',
+              Fraction(1, 4): '16th', Fraction(1, 8): '32nd', Fraction(1, 16): '64th', Fraction(1, 32): '128th'}
+TUPLETS = [(3, 2), (5, 4), (6, 4), (7, 4)] # (actual, normal)
+BEAM_TRANSLATIONS = {'start': 'begin', 'stop': 'end', 'continue': 'continue', 'partial-right': 'forward hook', 'partial-left': 'backward hook'}
+CLEFS = {'treble': ('G', 2), 'bass': ('F', 4), 'C': ('C', 3), 'percussion': ('percussion', None)}
+ATTRIBUTE_ORDER = {'divisions': 0, 'key': 1, 'time': 2, 'staves': 3, 'clef': 4} # children of <attributes>, as the schema orders them
+
+# [aux func] pitch token -> (step, alter, octave), spelled like pitch_to_name in tokens_to_score
+@lru_cache(maxsize=None)
+def pitch_to_spelling(pitch_, fifths=0):
+    if pitch_.isdecimal():
+        number = int(pitch_)
+        name = PITCH_CLASS_NAMES[(fifths > 0) - (fifths < 0)][number % 12]
+        return name[0], ACCIDENTAL_TO_ALTER[name[1:]], number // 12 - 1
+    name = pitch_.replace('b', '-')
+    i = 1
+    while name[i] in '-#':
+        i += 1
+    return name[0], ACCIDENTAL_TO_ALTER[name[1:i]], int(name[i:])
+
+@lru_cache(maxsize=None)
+def key_alters(fifths): # alteration of each step under a key signature (shared, not to be modified)
+    alters = {step: 0 for step in 'CDEFGAB'}
+    for step in (SHARP_ORDER[:fifths] if fifths > 0 else SHARP_ORDER[::-1][:-fifths]):
+        alters[step] = 1 if fifths > 0 else -1
+    return alters
+
+def token_to_fifths(token):
+    parts = token_record(token).parts
+    return {'sharp': 1, 'flat': -1}.get(parts[1], 0) * int(parts[2])
+
+def token_to_time(token):
+    value = token_record(token).value
+    if '/' in value:
+        return value.split('/')
+    return (value, '4' if int(value) < 6 else '8')
+
+def note_types(): # {length: (type, dots, tuplet)} of every note value written as a single note
+    types = {}
+    for actual, normal in TUPLETS[::-1] + [(1, 1)]: # plain values take precedence
+        for undotted, name in TYPE_NAMES.items():
+            for dots in range(3 if actual == 1 else 1, -1, -1): # fewer dots take precedence
+                length = undotted * (2 - Fraction(1, 2 ** dots)) * normal / actual
+                types[length] = (name, dots, (actual, normal) if actual > 1 else None)
+    return types
+
+NOTE_TYPES = note_types()
+
+class StaffWriter: # turn the tokens of one staff into a list of <measure> contents
+    def __init__(self, staff, voice_base, divisions, slur_number):
+        self.staff, self.voice_base, self.divisions, self.slur_number = staff, voice_base, divisions, slur_number
+        self.measures = []
+        self.fifths = 0
+        self.slur_open, self.slur_notes = False, []
+        self.slur_start = None # <slur type="start"> on the first of slur_notes
+
+    def duration(self, length):
+        return str(int(length * self.divisions))
+
+    def move_to(self, target): # <backup> or <forward> to a position in the measure
+        diff = target - self.position
+        if diff < 0:
+            backup = ET.SubElement(self.measure, 'backup')
+            ET.SubElement(backup, 'duration').text = self.duration(-diff)
+        elif diff > 0:
+            forward = ET.SubElement(self.measure, 'forward')
+            ET.SubElement(forward, 'duration').text = self.duration(diff)
+            ET.SubElement(forward, 'voice').text = str(self.voice)
+            ET.SubElement(forward, 'staff').text = str(self.staff)
+        self.position = target
+
+    def new_measure(self):
+        self.measure = ET.Element('measure')
+        self.measures.append(self.measure)
+        self.position = 0
+        self.voice_index, self.voice_start, self.first_voice_end = -1, None, None
+        self.voice_flag, self.after_voice = False, False
+        self.voice = self.voice_base
+        self.accidentals = {} # (step, octave) -> alter shown in this measure
+
+    def place(self): # position of the next element
+        if self.after_voice and not self.voice_flag and self.first_voice_end is not None:
+            self.voice = self.voice_base
+            self.move_to(self.first_voice_end)
+
+    def attribute(self, token): # consecutive attributes share one <attributes>, in schema order (as music21 writes them)
+        self.place()
+        if len(self.measure) and self.measure[-1].tag == 'attributes':
+            attributes = self.measure[-1]
+        else:
+            attributes = ET.SubElement(self.measure, 'attributes')
+        type_, value = token_record(token).family, token_record(token).value
+        if type_ == 'clef':
+            sign, line = CLEFS.get(value, (value, None))
+            clef = ET.SubElement(attributes, 'clef', number=str(self.staff))
+            ET.SubElement(clef, 'sign').text = sign
+            if line is not None:
+                ET.SubElement(clef, 'line').text = str(line)
+        elif type_ == 'key':
+            self.fifths = token_to_fifths(token)
+            key = ET.SubElement(attributes, 'key', number=str(self.staff))
+            ET.SubElement(key, 'fifths').text = str(self.fifths)
+        elif type_ == 'time':
+            beats, beat_type = token_to_time(token)
+            time = ET.SubElement(attributes, 'time', number=str(self.staff))
+            ET.SubElement(time, 'beats').text = beats
+            ET.SubElement(time, 'beat-type').text = beat_type
+        attributes[:] = sorted(attributes, key=lambda e: ATTRIBUTE_ORDER[e.tag])
+
+    def accidental(self, step, alter, octave, tie): # shown if the alteration differs from the key or an earlier note of the measure
+        if tie in ('stop', 'continue'):
+            return None
+        current = self.accidentals.get((step, octave), key_alters(self.fifths)[step])
+        self.accidentals[(step, octave)] = alter
+        return ALTER_TO_ACCIDENTAL[alter] if alter != current else None
+
+    def notes(self, tokens):
+        self.place()
+        spellings, lengths, direction, beams, tie_, articulations_ = [], [], [], [], [], []
+        for r in token_records(tokens):
+            if r.family == 'note':
+                spellings.append(pitch_to_spelling(r.value, self.fifths))
+            elif r.family == 'len':
+                lengths.append(r.fraction)
+            elif r.family == 'stem':
+                direction.append(r.stem)
+            elif r.family == 'beam':
+                beams.append(r.beams)
+            elif r.family == 'tie':
+                tie_.append(r.value)
+            elif r.token in ('staccato', 'accent', 'tenuto'):
+                articulations_.append(r.token)
+        if tokens[0] == 'rest':
+            self.note(None, lengths[0], None, [], None, [])
+            return
+
+        for i, length in enumerate(lengths):
+            if len(lengths) > 1: # tied notes
+                if len(tie_):
+                    tie = 'continue'
+                elif i == 0:
+                    tie = 'start'
+                elif i == len(lengths) - 1:
+                    tie = 'stop'
+                else:
+                    tie = 'continue'
+            else:
+                tie = tie_[0] if tie_ else None
+            self.note(spellings, length, direction[0] if direction else None, beams[0] if beams else [], tie, articulations_)
+
+    def note(self, spellings, length, stem, beams, tie, articulations_):
+        first_note = None
+        for j, spelling in enumerate(spellings or [None]):
+            note = ET.SubElement(self.measure, 'note')
+            if j > 0:
+                ET.SubElement(note, 'chord')
+            if spelling is None:
+                ET.SubElement(note, 'rest')
+            else:
+                step, alter, octave = spelling
+                pitch = ET.SubElement(note, 'pitch')
+                ET.SubElement(pitch, 'step').text = step
+                if alter:
+                    ET.SubElement(pitch, 'alter').text = str(alter)
+                ET.SubElement(pitch, 'octave').text = str(octave)
+            ET.SubElement(note, 'duration').text = self.duration(length)
+            for type_ in (('stop', 'start') if tie == 'continue' else (tie,) if tie else ()):
+                ET.SubElement(note, 'tie', type=type_)
+            ET.SubElement(note, 'voice').text = str(self.voice)
+
+            note_type = NOTE_TYPES.get(length) # None if the length needs more than one note
+            if note_type is not None:
+                ET.SubElement(note, 'type').text = note_type[0]
+                for _ in range(note_type[1]):
+                    ET.SubElement(note, 'dot')
+            if spelling is not None:
+                accidental = self.accidental(step, alter, octave, tie)
+                if accidental is not None:
+                    ET.SubElement(note, 'accidental').text = accidental
+            if note_type is not None and note_type[2] is not None:
+                modification = ET.SubElement(note, 'time-modification')
+                ET.SubElement(modification, 'actual-notes').text = str(note_type[2][0])
+                ET.SubElement(modification, 'normal-notes').text = str(note_type[2][1])
+            if stem is not None:
+                ET.SubElement(note, 'stem').text = stem
+            ET.SubElement(note, 'staff').text = str(self.staff)
+            if j == 0:
+                for level, beam in enumerate(beams, 1):
+                    ET.SubElement(note, 'beam', number=str(level)).text = BEAM_TRANSLATIONS.get(beam, beam)
+                first_note = note
+
+            notations = []
+            if tie:
+                notations += [('tied', type_) for type_ in (('stop', 'start') if tie == 'continue' else (tie,))]
+            if notations:
+                notations_ = ET.SubElement(note, 'notations')
+                for name, type_ in notations:
+                    ET.SubElement(notations_, name, type=type_)
+
+        if articulations_ and spellings:
+            articulations = ET.SubElement(notations_element(first_note), 'articulations')
+            for name in articulations_:
+                ET.SubElement(articulations, name)
+        if self.slur_open:
+            if not self.slur_notes: # started on the first note, so that finished measures need no later changes
+                self.slur_start = ET.SubElement(notations_element(first_note), 'slur', type='start', number=str(self.slur_number))
+            self.slur_notes.append(first_note)
+        self.position += length
+
+    def slur_stop(self):
+        if self.slur_open:
+            if self.slur_notes:
+                ET.SubElement(notations_element(self.slur_notes[-1]), 'slur', type='stop', number=str(self.slur_number))
+            self.slur_open, self.slur_notes = False, []
+
+    def close(self): # drop the start of a slur that is never stopped
+        if self.slur_open and self.slur_notes:
+            notations = self.slur_notes[0].find('notations')
+            notations.remove(self.slur_start)
+            if not len(notations):
+                self.slur_notes[0].remove(notations)
+        self.slur_open, self.slur_notes = False, []
+        return self.measures
+
+    def write(self, tokens):
+        tokens = group_related_tokens(concatenated_to_regular(tokens))
+        for i, t in enumerate(tokens):
+            if t == 'bar':
+                self.new_measure()
+            elif t == '<voice>':
+                self.voice_index += 1
+                self.voice = self.voice_base + self.voice_index
+                if self.voice_start is None:
+                    self.voice_start = self.position # record the start point of voices
+                self.move_to(self.voice_start)
+                self.voice_flag = True
+            elif t == '</voice>':
+                if self.voice_flag:
+                    if self.voice_index == 0:
+                        self.first_voice_end = self.position
+                    self.voice_flag = False
+                    self.after_voice = True
+            elif t == 'slur_start':
+                self.slur_open = True
+            elif t == 'slur_stop':
+                self.slur_stop()
+            elif t[:4] in ('note', 'rest'): # joined note groups
+                self.notes(t.split())
+            elif token_record(t).family in ('clef', 'key', 'time'):
+                if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
+                    continue # same workaround for MuseScore as tokens_to_PartStaff
+                self.attribute(t)
+        return self.measures
+
+def notations_element(note): # <notations> of a note, created after its other children if missing
+    notations = note.find('notations')
+    if notations is None:
+        notations = ET.SubElement(note, 'notations')
+    return notations
+
+def tokens_to_divisions(tokens): # smallest divisions that express every length as an integer
+    denominators = [token_record(t).fraction.denominator for t in concatenated_to_regular(tokens) if t.startswith('len_')]
+    return lcm(1, *denominators)
+
+def end_position(measure, divisions): # position at the end of a staff, to return to the start of the measure
+    position = 0
+    for element in measure:
+        if element.tag in ('note', 'forward') and element.find('chord') is None:
+            position += int(element.find('duration').text)
+        elif element.tag == 'backup':
+            position -= int(element.find('duration').text)
+    return position
+
+MUSICXML_DECLARATION = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">\n')
+
+def score_element(): # <score-partwise> with a single piano part, and its empty <part>
+    score = ET.Element('score-partwise', version='4.0')
+    part_list = ET.SubElement(score, 'part-list')
+    score_part = ET.SubElement(part_list, 'score-part', id='P1')
+    ET.SubElement(score_part, 'part-name').text = 'Piano'
+    part = ET.SubElement(score, 'part', id='P1')
+    return score, part
+
+def part_measure(number, R_measure, L_measure, divisions, first=False, last=False): # <measure> of the part from the contents of both staves
+    measure = ET.Element('measure', number=str(number))
+    if first:
+        attributes = ET.SubElement(measure, 'attributes')
+        ET.SubElement(attributes, 'divisions').text = str(divisions)
+        ET.SubElement(attributes, 'staves').text = '2'
+    if R_measure is not None:
+        measure.extend(R_measure)
+        position = end_position(R_measure, divisions)
+        if position and L_measure is not None and len(L_measure):
+            backup = ET.SubElement(measure, 'backup')
+            ET.SubElement(backup, 'duration').text = str(position)
+    if L_measure is not None:
+        measure.extend(L_measure)
+    if last: # last barline
+        barline = ET.SubElement(measure, 'barline', location='right')
+        ET.SubElement(barline, 'bar-style').text = 'regular'
+    return measure
+
+# build MusicXML text from a token sequence (string, list, or integer array of token IDs)
+def tokens_to_MusicXML(string_or_list, vocabulary=None, validate=False):
+    if hasattr(string_or_list, 'dtype') and string_or_list.dtype.kind in 'iu': # NumPy array of IDs
+        if vocabulary is None:
+            from vocabulary import default_vocabulary
+            vocabulary = default_vocabulary()
+        string = ' '.join(vocabulary.decode(string_or_list))
+    elif type(string_or_list) is not str:
+        string = ' '.join(string_or_list)
+    else:
+        string = string_or_list
+
+    if string.split(maxsplit=1)[0] not in ('C', 'R'): # ST+ (staff-major ST starts with its chord or R staff)
+        if validate: # fail early with the position of the first malformed token
+            from grammar import default_automaton
+            default_automaton().check(string)
+        with stage('to_ST'):
+            string = to_ST(string)
+
+    _, R_str, L_str = split_header_R_L(string)
+    R_tokens, L_tokens = R_str.split(), L_str.split()
+    divisions = tokens_to_divisions(R_tokens + L_tokens)
+
+    with stage('write_staves'):
+        R_writer, L_writer = StaffWriter(1, 1, divisions, slur_number=1), StaffWriter(2, 5, divisions, slur_number=2)
+        R_writer.write(R_tokens)
+        L_writer.write(L_tokens)
+        R_measures, L_measures = R_writer.close(), L_writer.close()
+
+        score, part = score_element()
+        n_measures = max(len(R_measures), len(L_measures))
+        for i in range(n_measures):
+            part.append(part_measure(i + 1, R_measures[i] if i < len(R_measures) else None, L_measures[i] if i < len(L_measures) else None,
+                                     divisions, first=i == 0, last=i == n_measures - 1))
+
+    with stage('serialize'):
+        ET.indent(score)
+        return MUSICXML_DECLARATION + ET.tostring(score, encoding='unicode') + '\n'
+
+def write_MusicXML(string_or_list, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(tokens_to_MusicXML(string_or_list))
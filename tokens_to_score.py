@@ -1,20 +1,31 @@
-from music21 import articulations, bar, chord, clef, key, layout, meter, note, pitch, spanner, stream, tie
+from functools import lru_cache
+
+from instrumentation import stage
+from token_records import token_record, token_records
+
+# music21 is imported by the functions that build music21 objects, so that the token conversions of this module
+# (used by tokens_to_MusicXML and the streaming detokenizer) load without it
 
 # dictionary to change note names
 sharp_to_flat = {'C#': 'D-', 'D#': 'E-', 'F#': 'G-', 'G#': 'A-', 'A#': 'B-'}
 flat_to_sharp = {v:k for k, v in sharp_to_flat.items()}
 
+# note names of the pitch classes: default spelling of music21.pitch.Pitch, and the same with sharps or flats only
+PITCH_CLASS_NAMES = {0: ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']}
+PITCH_CLASS_NAMES[-1] = [sharp_to_flat.get(name, name) for name in PITCH_CLASS_NAMES[0]]
+PITCH_CLASS_NAMES[1] = [flat_to_sharp.get(name, name) for name in PITCH_CLASS_NAMES[0]]
+
 # translate note numbers into note names considering key signature
-def pitch_to_name(pitch_, key=key.KeySignature(0)):
+def pitch_to_name(pitch_, key=None):
+    sharps = 0 if key is None else key.sharps
+    return spell_pitch(pitch_, (sharps > 0) - (sharps < 0))
+
+@lru_cache(maxsize=None)
+def spell_pitch(pitch_, sign): # sign: 1 for sharp keys, -1 for flat keys, 0 for no key signature
     if pitch_.isdecimal():
-        name = str(pitch.Pitch(int(pitch_)))
-        if key.sharps < 0:
-            for k, v in sharp_to_flat.items():
-                name = name.replace(k, v)
-        elif key.sharps > 0:
-            for k, v in flat_to_sharp.items():
-                name = name.replace(k, v)
-        return name
+        number = int(pitch_)
+        octave = number // 12 - 1 # music21 leaves out octave -1 (so that the note gets the default octave)
+        return PITCH_CLASS_NAMES[sign][number % 12] + (str(octave) if octave >= 0 else '')
     else:
         return pitch_.replace('b', '-')
 
@@ -24,18 +35,18 @@ def group_related_tokens(tokens):
     note_flag, len_flag = False, False
 
     for t in tokens:
-        parts = t.split('_')
-        if parts[0] in ('note', 'rest'):
+        family = token_record(t).family
+        if family in ('note', 'rest'):
             if note_flag and len_flag and len(notes):
                 out.append(' '.join(notes))
                 notes = []
             note_flag = True
             len_flag = False
             notes.append(t)
-        elif parts[0] == 'len':
+        elif family == 'len':
             len_flag = True
             notes.append(t)
-        elif parts[0] in ('stem', 'beam', 'tie', 'staccato', 'accent', 'tenuto'):
+        elif family in ('stem', 'beam', 'tie', 'staccato', 'accent', 'tenuto'):
             notes.append(t)
         elif t == 'slur_start':
             out.append(t)
@@ -53,7 +64,8 @@ def group_related_tokens(tokens):
 
 # translate clef or signature token into music21 object
 def single_token_to_obj(token):
-    parts = token.split('_')
+    from music21 import clef, key, meter
+    parts = token_record(token).parts
     if parts[0] == 'clef':
         if parts[1] == 'treble':
             return clef.TrebleClef()
@@ -74,17 +86,33 @@ def single_token_to_obj(token):
 
 # translate note(rest)-related tokens into music21 object
 def note_token_to_obj(tokens, key):
+    from music21 import chord, note, tie
     if tokens[0] == 'rest': # for rests
         length = str_to_float(tokens[1])
         return note.Rest(quarterLength=length)
 
-    # for notes
-    note_names = [pitch_to_name(t.split('_')[1], key) for t in tokens if t.split('_')[0] == 'note']
-    lengths = [str_to_float(t) for t in tokens if t.split('_')[0] == 'len']
-    direction = [t.split('_')[1] for t in tokens if t.split('_')[0] in ('stem', 'dir')] + [t.split('_')[2] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 3]
-    beams = [t.split('_')[1:] for t in tokens if t.split('_')[0] == 'beam'] + [t.split('_')[3:] for t in tokens if t.split('_')[0] == 'len' and len(t.split('_')) >= 4]
-    tie_ = [t.split('_')[1] for t in tokens if t.split('_')[0] == 'tie']
-    articulations_ = [t for t in tokens if t in ('staccato', 'accent', 'tenuto')]
+    # for notes (one pass over the parsed tokens)
+    note_names, lengths, direction, beams, tie_, articulations_ = [], [], [], [], [], []
+    len_direction, len_beams = [], [] # from concatenated len tokens, after the separate ones
+    for r in token_records(tokens):
+        if r.family == 'note':
+            note_names.append(pitch_to_name(r.value, key))
+        elif r.family == 'len':
+            lengths.append(r.length)
+            if len(r.parts) >= 3:
+                len_direction.append(r.stem)
+            if len(r.parts) >= 4:
+                len_beams.append(r.beams)
+        elif r.family in ('stem', 'dir'):
+            direction.append(r.stem)
+        elif r.family == 'beam':
+            beams.append(r.beams)
+        elif r.family == 'tie':
+            tie_.append(r.value)
+        elif r.token in ('staccato', 'accent', 'tenuto'):
+            articulations_.append(r.token)
+    direction += len_direction
+    beams += len_beams
 
     if len(note_names) > 1: # chord
         if len(lengths) > 1:
@@ -180,6 +208,7 @@ def append_beams(obj, beams):
             obj.beams.append(b)
 
 def translate_articulation(token):
+    from music21 import articulations
     if token == 'staccato':
         return articulations.Staccato()
     elif token == 'accent':
@@ -187,113 +216,223 @@ def translate_articulation(token):
     elif token == 'tenuto':
         return articulations.Tenuto()
 
-def tokens_to_PartStaff(tokens, key_=0, start_voice=1, slur_number=1):
-    tokens = concatenated_to_regular(tokens)
-
-    p = stream.PartStaff()
-    k = key.KeySignature(key_)
-
-    voice_id = start_voice
-    voice_flag = False
-    after_voice = False
-    voice_start = None
-
-    ottava_flag = False
-    ottava_elements = []
-
-    slur_flag = False
-    slur_elements = []
-
-    tokens = group_related_tokens(tokens)
-
-    for i, t in enumerate(tokens):
-        if t == 'bar':
-            if i != 0:
-                p.append(m)
-            m = stream.Measure()
-            voice_id = start_voice
-            voice_start = None
-            voice_flag = False
-            after_voice = False
-        elif t == '<voice>':
-            v = stream.Voice(id=voice_id)
-            voice_flag = True
-            if voice_start is None:
-                voice_start = m.duration.quarterLength # record the start point of voice
-        elif t == '</voice>':
-            if voice_flag:
-                v.makeAccidentals(useKeySignature=k)
-                for element in v:
-                    element.offset += voice_start
-                m.append(v)
-                voice_id += 1
+class PartStaffBuilder: # build the measures of a PartStaff one bar at a time, keeping key, slur and voice state between bars
+    def __init__(self, key_=0, start_voice=1, slur_number=1):
+        from music21 import key
+        self.k = key.KeySignature(key_)
+        self.start_voice, self.slur_number = start_voice, slur_number
+
+        self.ottava_flag = False
+        self.ottava_elements = []
+
+        self.slur_flag = False
+        self.slur_elements = []
+
+    def bar_to_measure(self, tokens): # grouped tokens of one bar, starting with 'bar'
+        from music21 import spanner, stream
+        for i, t in enumerate(tokens):
+            if t == 'bar':
+                m = stream.Measure()
+                voice_id = self.start_voice
+                voice_start = None
                 voice_flag = False
-                after_voice = True
-        elif t == 'slur_start':
-            slur = spanner.Slur()
-            slur.idLocal = slur_number
-            slur_flag = True
-        elif t == 'slur_stop':
-            if slur_flag:
-                slur.addSpannedElements(slur_elements)
-                m.append(slur)
-                slur_flag = False
-                slur_elements = []
-        elif t.split('_')[0] in ('clef', 'key', 'time'):
-            if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
-                continue # workaround for MuseScore (which ignores consecutive key signtures): if key signatures appear in succession, skip the one with natural
-            o = single_token_to_obj(t)
-            if voice_flag:
-                v.append(o)
-            else:
-                m.append(o)
-            if slur_flag:
-                slur_elements.append(o)
-            if t.split('_')[0] == 'key': # generate another key signature object to use makeAccidentals and to translate note number to name
-                k = o
-        elif t[:4] in ('note', 'rest'):
-            n = note_token_to_obj(t.split(), k)
-            if ottava_flag:
-                ottava_elements.append(n)
-            if slur_flag:
-                slur_elements.append(n)
-
-            if voice_flag:
-                v.append(n)
-            else:
-                m.append(n)
-
-            if after_voice:
-                n.offset -= v.quarterLength * (voice_id - 1)
-    # last measure
-    p.append(m)
+                after_voice = False
+            elif t == '<voice>':
+                v = stream.Voice(id=voice_id)
+                voice_flag = True
+                if voice_start is None:
+                    voice_start = m.duration.quarterLength # record the start point of voice
+            elif t == '</voice>':
+                if voice_flag:
+                    for element in v:
+                        element.offset += voice_start
+                    m.append(v)
+                    voice_id += 1
+                    voice_flag = False
+                    after_voice = True
+            elif t == 'slur_start':
+                self.slur = spanner.Slur()
+                self.slur.idLocal = self.slur_number
+                self.slur_flag = True
+            elif t == 'slur_stop':
+                if self.slur_flag:
+                    self.slur.addSpannedElements(self.slur_elements)
+                    m.append(self.slur)
+                    self.slur_flag = False
+                    self.slur_elements = []
+            elif t[:4] in ('note', 'rest'): # note groups are joined strings, so they are not looked up as tokens
+                n = note_token_to_obj(t.split(), self.k)
+                if self.ottava_flag:
+                    self.ottava_elements.append(n)
+                if self.slur_flag:
+                    self.slur_elements.append(n)
+
+                if voice_flag:
+                    v.append(n)
+                else:
+                    m.append(n)
+
+                if after_voice:
+                    n.offset -= v.quarterLength * (voice_id - 1)
+            elif token_record(t).family in ('clef', 'key', 'time'):
+                if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
+                    continue # workaround for MuseScore (which ignores consecutive key signtures): if key signatures appear in succession, skip the one with natural
+                o = single_token_to_obj(t)
+                if voice_flag:
+                    v.append(o)
+                else:
+                    m.append(o)
+                if self.slur_flag:
+                    self.slur_elements.append(o)
+                if token_record(t).family == 'key': # generate another key signature object to translate note number to name
+                    self.k = o
 
-    # adjust offsets for notes in voices
-    for m in p:
+        # adjust offsets for notes in voices
         voices = m.getElementsByClass(stream.Voice)
         for v in voices[1:]:
             v.offset = voices[0].offset
-        
+
         for v in voices:
             for element in v:
                 element.offset += v.offset
 
-    p.makeAccidentals(cautionaryNotImmediateRepeat=False, overrideStatus=True, inPlace=True)
+        return m
+
+# [aux func] split grouped tokens into bars, each starting with 'bar'
+def split_bars(tokens):
+    bars = []
+    for t in tokens:
+        if t == 'bar':
+            bars.append([])
+        bars[-1].append(t)
+    return bars
+
+def tokens_to_PartStaff(tokens, key_=0, start_voice=1, slur_number=1):
+    tokens = group_related_tokens(concatenated_to_regular(tokens))
+    builder = PartStaffBuilder(key_, start_voice, slur_number)
+    return measures_to_PartStaff(builder.bar_to_measure(bar_tokens) for bar_tokens in split_bars(tokens))
+
+def measures_to_PartStaff(measures):
+    from music21 import stream
+    from accidentals import make_part_accidentals
+    p = stream.PartStaff()
+    for m in measures:
+        p.append(m)
+
+    with stage('accidentals'):
+        make_part_accidentals(p.getElementsByClass(stream.Measure))
     return p
 
+# parallel construction of the staves: R and L are independent once the first voice of L is known, and the bars of a staff
+# only depend on the key in effect and on open slurs, so ranges of bars where no slur is open can be built apart;
+# the accidentals of a staff depend on every measure before, so they are made after the ranges are joined
+
+# [aux func] (key token in effect, whether a slur is open) at the start of each bar, as carried over by PartStaffBuilder
+def bar_states(bars):
+    states = []
+    key_token, slur_open = None, False
+    for tokens in bars:
+        states.append((key_token, slur_open))
+        for i, t in enumerate(tokens):
+            if t == 'slur_start':
+                slur_open = True
+            elif t == 'slur_stop':
+                slur_open = False
+            elif t[:4] not in ('note', 'rest') and token_record(t).family == 'key':
+                if t[:11] == 'key_natural' and i+1 < len(tokens) and tokens[i+1].split('_')[0] == 'key':
+                    continue # skipped by PartStaffBuilder as well
+                key_token = t
+    return states
+
+# [aux func] [start, end) ranges of at least bars_per_chunk bars (except the last), starting where no slur is open
+def bar_ranges(states, bars_per_chunk):
+    ranges, start = [], 0
+    for i, (_, slur_open) in enumerate(states):
+        if i - start >= bars_per_chunk and not slur_open:
+            ranges.append((start, i))
+            start = i
+    ranges.append((start, len(states)))
+    return ranges
+
+# [aux func] voices of the fullest measure built from the bars (1 for measures without voices)
+def max_voices(bars):
+    counts = []
+    for tokens in bars:
+        n, voice_flag = 0, False
+        for t in tokens:
+            if t == '<voice>':
+                voice_flag = True
+            elif t == '</voice>' and voice_flag:
+                n += 1
+                voice_flag = False
+        counts.append(n or 1)
+    return max(counts)
+
+def bars_to_measures(bars, key_token=None, start_voice=1, slur_number=1): # measures of consecutive bars with no slur open before them
+    builder = PartStaffBuilder(start_voice=start_voice, slur_number=slur_number)
+    if key_token is not None:
+        builder.k = single_token_to_obj(key_token)
+    return [builder.bar_to_measure(bar_tokens) for bar_tokens in bars]
+
+# plain pickling loses the sites of elements nested in voices, so streams are passed between processes with freezeThaw
+def freeze(s):
+    from music21 import freezeThaw
+    return freezeThaw.StreamFreezer(s, fastButUnsafe=True).writeStr(fmt='pickle')
+
+def thaw(data):
+    from music21 import freezeThaw
+    thawer = freezeThaw.StreamThawer()
+    thawer.openStr(data)
+    return thawer.stream
+
+def PartStaff_worker(tokens, key_, start_voice, slur_number):
+    return freeze(tokens_to_PartStaff(tokens, key_, start_voice, slur_number))
+
+def measures_worker(bars, key_token, start_voice, slur_number):
+    from music21 import stream
+    s = stream.Stream()
+    for m in bars_to_measures(bars, key_token, start_voice, slur_number):
+        s.append(m)
+    return freeze(s)
+
+def thawed_measures(data):
+    from music21 import stream
+    s = thaw(data)
+    measures = list(s.getElementsByClass(stream.Measure))
+    s.clear() # leave the measures to the PartStaff
+    return measures
+
+def tokens_to_PartStaffs_parallel(R_tokens, L_tokens, voice_numbering=False, workers=2, bars_per_chunk=None): # -> (R, L) PartStaffs
+    from concurrent.futures import ProcessPoolExecutor
+
+    R_bars, L_bars = [split_bars(group_related_tokens(concatenated_to_regular(t))) for t in (R_tokens, L_tokens)]
+    R_start, L_start = (1, max_voices(R_bars) + 1) if voice_numbering else (0, 0)
+
+    if bars_per_chunk is None: # one task per staff
+        tasks = [(R_tokens, 0, R_start, 1), (L_tokens, 0, L_start, 2)]
+        local, worker, unpack = tokens_to_PartStaff, PartStaff_worker, thaw
+    else:
+        tasks, n_R_tasks = [], None
+        for bars, start_voice, slur_number in ((R_bars, R_start, 1), (L_bars, L_start, 2)):
+            states = bar_states(bars)
+            tasks += [(bars[start:end], states[start][0], start_voice, slur_number) for start, end in bar_ranges(states, bars_per_chunk)]
+            n_R_tasks = n_R_tasks or len(tasks)
+        local, worker, unpack = bars_to_measures, measures_worker, thawed_measures
+
+    # the first task is run here while the others run in the workers
+    with ProcessPoolExecutor(min(workers - 1, len(tasks) - 1)) as pool:
+        futures = [pool.submit(worker, *args) for args in tasks[1:]]
+        results = [local(*tasks[0])] + [unpack(f.result()) for f in futures]
+
+    if bars_per_chunk is None:
+        return tuple(results)
+    return (measures_to_PartStaff(m for measures in results[:n_R_tasks] for m in measures),
+            measures_to_PartStaff(m for measures in results[n_R_tasks:] for m in measures))
+
 def concatenated_to_regular(tokens):
     regular_tokens = []
     for t in tokens:
-        if t.startswith('len') or t.startswith('attr'):
-            attrs = t.split('_')
-            if len(attrs) == 2:
-                regular_tokens.append(f'len_{attrs[1]}')
-            elif len(attrs) == 3:
-                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}']
-            else:
-                regular_tokens += [f'len_{attrs[1]}', f'stem_{attrs[2]}', f'beam_{"_".join(attrs[3:])}']
-        else:
-            regular_tokens.append(t)
+        regular_tokens += token_record(t).regular
     return regular_tokens
 
 def split_header_R_L(string):
@@ -313,7 +452,7 @@ def normalize(seq):
     return ' '.join(seq.split())
 
 def common(seq):
-    return ' '.join([t for t in seq.split() if t.split('_')[0] in ('time', 'key')])
+    return ' '.join([t for t in seq.split() if token_record(t).family in ('time', 'key')])
 
 def insert_attrs(seq, common_attrs):
     if common_attrs:
@@ -327,38 +466,116 @@ def insert_attrs(seq, common_attrs):
         return seq
     
 def to_ST(seq):
-    R_bars, L_bars = [], []
-    
-    bars = seq.split('bar')
-    for bar in bars[1:]:
-        header, R, L = split_header_R_L(bar)
-        attrs = common(header)
-        R_bars += ['bar', insert_attrs(R, attrs)]
-        L_bars += ['bar', insert_attrs(L, attrs)]
-            
-    return normalize(f"{bars[0]} R {' '.join(R_bars)} L {' '.join(L_bars)}")
-
-# build music21 Score object from a token sequence (string or list)
-def tokens_to_score(string_or_list, voice_numbering=False):
-    if type(string_or_list) is not str:
+    return ST_plus_to_ST(seq)
+
+# ST+ <-> ST in one pass over the bars, on space-joined str, lists of tokens or integer arrays of token IDs
+ATTRIBUTE_FAMILIES = ('time', 'key') # bar header tokens copied into both staves in ST, and taken back from R in ST+
+
+def conversion_symbols(tokens, vocabulary=None): # -> (list, {marker: symbol}, is_attribute[symbol], is_clef(symbol), list -> the type given)
+    if hasattr(tokens, 'dtype') and tokens.dtype.kind in 'iu': # NumPy array of IDs
+        import numpy as np
+        if vocabulary is None:
+            from vocabulary import default_vocabulary
+            vocabulary = default_vocabulary()
+        if getattr(vocabulary, 'conversion_flags', None) is None: # kept by the vocabulary until tokens are added to it
+            records = token_records(vocabulary.tokens)
+            vocabulary.conversion_flags = ([r.family in ATTRIBUTE_FAMILIES for r in records], [r.token.startswith('clef') for r in records])
+        is_attribute, is_clef = vocabulary.conversion_flags
+        markers = {name: vocabulary.index[name] for name in ('bar', 'R', 'L', 'C')}
+        dtype = tokens.dtype
+        return tokens.tolist(), markers, is_attribute, is_clef.__getitem__, lambda seq: np.array(seq, dtype=dtype)
+
+    seq = tokens.split() if isinstance(tokens, str) else list(tokens)
+    is_attribute = {t: token_record(t).family in ATTRIBUTE_FAMILIES for t in set(seq)} # looked up by subscription in the loops
+    markers = {name: name for name in ('bar', 'R', 'L', 'C')}
+    return seq, markers, is_attribute, lambda t: t.startswith('clef'), ' '.join if isinstance(tokens, str) else list
+
+def ST_plus_to_ST(tokens, vocabulary=None): # bar-major ST+ -> staff-major ST, where each staff gets the key/time of the bar header
+    seq, markers, is_attribute, is_clef, output = conversion_symbols(tokens, vocabulary)
+    bar_, R_, L_ = markers['bar'], markers['R'], markers['L']
+    starts = [i for i, t in enumerate(seq) if t == bar_]
+    R_staff, L_staff = [R_], [L_]
+
+    for start, end in zip(starts, starts[1:] + [len(seq)]):
+        r = seq.index(R_, start, end)
+        try:
+            l = seq.index(L_, start, end)
+            R_tokens, L_tokens = seq[r+1:l], seq[l+1:end]
+        except ValueError: # no left hand
+            R_tokens, L_tokens = seq[r+1:end], []
+        attrs = [t for t in seq[start+1:r] if is_attribute[t]]
+        for staff, staff_tokens in ((R_staff, R_tokens), (L_staff, L_tokens)):
+            staff.append(bar_)
+            if attrs and staff_tokens and is_clef(staff_tokens[0]): # after the clef
+                staff += staff_tokens[:1] + attrs + staff_tokens[1:]
+            else:
+                staff += attrs + staff_tokens
+
+    return output((seq[:starts[0]] if starts else seq) + R_staff + L_staff)
+
+def ST_to_ST_plus(tokens, vocabulary=None): # staff-major ST (C, R and L staves) -> bar-major ST+, as MusicXML_to_tokens would give it
+    seq, markers, is_attribute, _, output = conversion_symbols(tokens, vocabulary)
+    bar_, R_, L_, C_ = markers['bar'], markers['R'], markers['L'], markers['C']
+    staves = {C_: [], R_: [], L_: []} # marker -> bars
+    prefix, bars = [], None
+    for t in seq:
+        if t in staves:
+            bars = staves[t]
+        elif t == bar_ and bars is not None:
+            bars.append([])
+        elif bars:
+            bars[-1].append(t)
+        else:
+            prefix.append(t)
+
+    result = prefix
+    C_bars = staves[C_] or [[]] * len(staves[R_])
+    for R_bar, L_bar, C_bar in zip(staves[R_], staves[L_], C_bars): # as bars_to_tokens in score_to_tokens
+        result.append(bar_)
+        result += [t for t in R_bar if is_attribute[t]]
+        result += C_bar
+        result.append(R_)
+        result += [t for t in R_bar if not is_attribute[t]]
+        result.append(L_)
+        result += [t for t in L_bar if not is_attribute[t]]
+    return output(result)
+
+# build music21 Score object from a token sequence (string, list, or integer array of token IDs)
+# workers: build the staves in this many processes (the same Score as the serial path);
+# bars_per_chunk: also split each staff into ranges of about this many bars, for long scores
+def tokens_to_score(string_or_list, voice_numbering=False, vocabulary=None, validate=False, workers=None, bars_per_chunk=None):
+    from music21 import bar, layout, stream
+    if hasattr(string_or_list, 'dtype') and string_or_list.dtype.kind in 'iu': # NumPy array of IDs
+        if vocabulary is None:
+            from vocabulary import default_vocabulary
+            vocabulary = default_vocabulary()
+        string = ' '.join(vocabulary.decode(string_or_list))
+    elif type(string_or_list) is not str:
         string = ' '.join(string_or_list)
     else:
         string = string_or_list
 
-    if string.index('bar') < string.index('R'): # ST+
-        string = to_ST(string)
+    if string.split(maxsplit=1)[0] not in ('C', 'R'): # ST+ (staff-major ST starts with its chord or R staff)
+        if validate: # fail early with the position of the first malformed token
+            from grammar import default_automaton
+            default_automaton().check(string)
+        with stage('to_ST'):
+            string = to_ST(string)
     
     _, R_str, L_str = split_header_R_L(string)
     R_tokens = R_str.split()
     L_tokens = L_str.split()
     
-    if voice_numbering:
-        r = tokens_to_PartStaff(R_tokens, slur_number=1)
-        r_voices = max([len(m.voices) if m.hasVoices() else 1 for m in r])
-        l = tokens_to_PartStaff(L_tokens, start_voice=r_voices+1, slur_number=2)
-    else:
-        r = tokens_to_PartStaff(R_tokens, start_voice=0, slur_number=1)
-        l = tokens_to_PartStaff(L_tokens, start_voice=0, slur_number=2)
+    with stage('tokens_to_PartStaff'): # accidentals included
+        if workers is not None and workers > 1:
+            r, l = tokens_to_PartStaffs_parallel(R_tokens, L_tokens, voice_numbering, workers, bars_per_chunk)
+        elif voice_numbering:
+            r = tokens_to_PartStaff(R_tokens, slur_number=1)
+            r_voices = max([len(m.voices) if m.hasVoices() else 1 for m in r])
+            l = tokens_to_PartStaff(L_tokens, start_voice=r_voices+1, slur_number=2)
+        else:
+            r = tokens_to_PartStaff(R_tokens, start_voice=0, slur_number=1)
+            l = tokens_to_PartStaff(L_tokens, start_voice=0, slur_number=2)
 
     # add last barline
     r.elements[-1].rightBarline = bar.Barline('regular')
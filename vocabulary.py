@@ -0,0 +1,126 @@
+import json
+import numpy as np
+from fractions import Fraction
+
+from score_to_tokens import BEAM_TRANSLATIONS, CHORD_KIND_ABBREVIATIONS, CLEF_TRANSLATIONS, PITCH_ALTER_TO_SYMBOL, key_to_token, time_to_token
+
+# canonical vocabulary of ST+ tokens and integer-ID encoding with NumPy arrays
+
+PAD, UNK = '<pad>', '<unk>'
+SPECIAL_TOKENS = [PAD, UNK] # id 0 and 1
+STRUCTURE_TOKENS = ['bar', 'R', 'L', 'C', '<voice>', '</voice>', 'rest', 'staccato', 'accent', 'tenuto', 'slur_start', 'slur_stop']
+
+STEPS = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+OCTAVES = range(0, 10)
+LEN_DENOMINATORS = (1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 24, 32, 48, 64)
+MAX_LEN = 16 # in quarter notes
+MAX_BEAM_LEVELS = 4
+TIME_BEATS, TIME_BEAT_TYPES = range(1, 17), (1, 2, 4, 8, 16)
+
+def note_tokens():
+    tokens = [f'note_{n}' for n in range(128)] # note numbers
+    for octave in OCTAVES: # note names
+        for step in STEPS:
+            tokens += [f'note_{step}{symbol}{octave}' for symbol in PITCH_ALTER_TO_SYMBOL.values()]
+    return tokens
+
+def len_tokens():
+    lengths = sorted(set(Fraction(n, d) for d in LEN_DENOMINATORS for n in range(1, MAX_LEN * d + 1)))
+    return [f'len_{length}' for length in lengths]
+
+def beam_tokens():
+    types = ['start', 'continue', 'stop'] + [v for v in BEAM_TRANSLATIONS.values() if v.startswith('partial')]
+    tokens, levels = [], [[]]
+    for _ in range(MAX_BEAM_LEVELS):
+        levels = [level + [t] for level in levels for t in types]
+        tokens += ['beam_' + '_'.join(level) for level in levels]
+    return tokens
+
+def attribute_tokens():
+    tokens = [f'clef_{c}' for c in list(CLEF_TRANSLATIONS.values()) + ['C', 'percussion']]
+    tokens += [key_to_token(fifths) for fifths in range(-7, 8)]
+    times = [(beats, beat_type) for beat_type in TIME_BEAT_TYPES for beats in TIME_BEATS if beat_type <= 4 or beats % beat_type] # e.g. 8/8 is not tokenizable
+    tokens += list(dict.fromkeys(time_to_token(time) for time in times))
+    return tokens
+
+def chord_tokens():
+    roots = [step + alter for step in STEPS for alter in ('b', '', '#')]
+    kinds = list(dict.fromkeys(CHORD_KIND_ABBREVIATIONS.values()))
+    return [f'chord_{root}{kind}' for root in roots for kind in kinds] + [f'bass_{root}' for root in roots]
+
+def ST_plus_tokens(): # every token family emitted by score_to_tokens, in a fixed order
+    tokens = SPECIAL_TOKENS + STRUCTURE_TOKENS + note_tokens() + len_tokens()
+    tokens += ['stem_up', 'stem_down'] + beam_tokens() + ['tie_start', 'tie_stop', 'tie_continue']
+    tokens += attribute_tokens() + chord_tokens()
+    return list(dict.fromkeys(tokens))
+
+class Vocabulary:
+    def __init__(self, tokens=None):
+        self.tokens = []
+        self.index = {}
+        self.add(SPECIAL_TOKENS + list(ST_plus_tokens() if tokens is None else tokens))
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.index
+
+    def add(self, tokens): # new tokens are appended, so existing IDs never change
+        for t in tokens:
+            if t not in self.index:
+                self.index[t] = len(self.tokens)
+                self.tokens.append(t)
+        self.array = np.array(self.tokens, dtype=object) # for decoding by fancy indexing
+        self.dtype = np.uint16 if len(self.tokens) <= np.iinfo(np.uint16).max + 1 else np.int32
+        self.conversion_flags = None # built by tokens_to_score.conversion_symbols for these tokens
+        self.grammar_tables = None # built by grammar.Automaton.vocabulary_tables for these tokens
+
+    def extend(self, sequences): # add tokens of a corpus (e.g. chord names with degrees or unusual lengths)
+        for tokens in sequences:
+            self.add(tokens.split() if isinstance(tokens, str) else tokens)
+        return self
+
+    def encode(self, tokens, strict=False): # tokens (list or space-joined str) -> 1-D integer array
+        if isinstance(tokens, str):
+            tokens = tokens.split()
+        index = self.index
+        if strict:
+            unknown = [t for t in tokens if t not in index]
+            if unknown:
+                raise KeyError(f'unknown tokens: {unknown[:10]}')
+        unk = index[UNK]
+        return np.fromiter((index.get(t, unk) for t in tokens), dtype=self.dtype, count=len(tokens))
+
+    def decode(self, ids, skip_pad=True): # integer array -> list of tokens
+        ids = np.asarray(ids)
+        if skip_pad:
+            ids = ids[ids != self.index[PAD]]
+        return self.array[ids].tolist()
+
+    def encode_batch(self, sequences, strict=False): # -> (concatenated ids, offsets) with sequence i at ids[offsets[i]:offsets[i+1]]
+        encoded = [self.encode(tokens, strict) for tokens in sequences]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        ids = np.concatenate(encoded) if encoded else np.zeros(0, dtype=self.dtype)
+        return ids, offsets
+
+    def decode_batch(self, ids, offsets):
+        return [self.decode(ids[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.tokens, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+ST_PLUS_VOCABULARY = None
+
+def default_vocabulary(): # built once on first use
+    global ST_PLUS_VOCABULARY
+    if ST_PLUS_VOCABULARY is None:
+        ST_PLUS_VOCABULARY = Vocabulary()
+    return ST_PLUS_VOCABULARY